@@ -6,11 +6,18 @@ from botocore.response import StreamingBody
 from lambda_function import TABLE_NAME
 
 import os
+import random
 import zipfile
 import json
+import base64
+import hashlib
+import io
+import argparse
 from datetime import datetime
 import time
+import uuid
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
 from colorama import Fore, Style
 
@@ -18,6 +25,11 @@ import pandas as pd
 
 
 def assert_user_authenticated():
+    if os.environ.get("AWS_ENDPOINT_URL"):
+        # running against a local AWS stand-in (e.g. `moto_server`), which accepts any credentials
+        print(f"{Fore.YELLOW}using local AWS endpoint {os.environ['AWS_ENDPOINT_URL']}{Style.RESET_ALL}")
+        return
+
     sts = boto3.client("sts")
     assert sts.get_caller_identity(), "unable to authenticate"
 
@@ -45,6 +57,122 @@ class DateTimeEncoder(json.JSONEncoder):
         return super(DateTimeEncoder, self).default(obj)
 
 
+WAITER_CONFIG = {"Delay": 1, "MaxAttempts": 120}
+
+
+def retry_with_backoff(fn, retry_on: tuple, max_attempts: int = 8, base_delay: float = 0.5, max_delay: float = 10.0):
+    """
+    calls `fn` until it doesn't raise a ClientError with one of the `retry_on` error codes, sleeping exponentially longer (with jitter) in between
+    """
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in retry_on or attempt == max_attempts - 1:
+                raise
+            delay = min(max_delay, base_delay * 2**attempt) * random.uniform(0.5, 1.0)
+            print(f"{e.response['Error']['Code']}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class Provisioner:
+    """
+    runs provisioning steps concurrently as soon as the steps they depend on are done and records how long each one took
+
+    >>> provisioner = Provisioner()
+    >>> provisioner.add("bucket", lambda results: S3Client.create_bucket(bucket_name))
+    >>> provisioner.add("upload", lambda results: S3Client.upload_file(bucket_name, file_path), depends_on=["bucket"])
+    >>> results = provisioner.run()
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.steps = {}
+        self.timings = {}
+        self.failed = set()
+
+    def add(self, name: str, fn, depends_on: list = ()) -> None:
+        assert name not in self.steps, f"step {name} already added"
+        assert all(dependency in self.steps for dependency in depends_on), f"dependencies of {name} must be added first"
+        self.steps[name] = (fn, list(depends_on))
+
+    def __run_step(self, name: str, fn, results: dict, start_time: float):
+        step_start = time.time()
+        try:
+            return fn(results)
+        except Exception:
+            self.failed.add(name)
+            raise
+        finally:
+            self.timings[name] = (step_start - start_time, time.time() - step_start)
+
+    def run(self) -> dict:
+        results = {}
+        pending = dict(self.steps)
+        running = {}
+        start_time = time.time()
+
+        # the timings are printed for a failed deployment too, leaving the executor waits for the steps still running
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while pending or running:
+                    for name, (fn, depends_on) in list(pending.items()):
+                        if all(dependency in results for dependency in depends_on):
+                            running[executor.submit(self.__run_step, name, fn, results, start_time)] = name
+                            del pending[name]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()  # re-raises the exception of a failed step
+        finally:
+            self.print_timings(time.time() - start_time)
+        return results
+
+    def print_timings(self, total_time: float) -> None:
+        print(f"{Fore.GREEN}provisioning timings{Style.RESET_ALL}")
+        print(f"\t{'step':<24}{'start':>10}{'duration':>10}")
+        for name, (offset, duration) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            color = Fore.RED if name in self.failed else ""
+            print(f"\t{color}{name:<24}{offset:>9.2f}s{duration:>9.2f}s{'  failed' if name in self.failed else ''}{Style.RESET_ALL}")
+        for name in self.steps:
+            if name not in self.timings:
+                print(f"\t{Style.DIM}{name:<24}{'not started':>20}{Style.RESET_ALL}")
+        sequential_time = sum(duration for _, duration in self.timings.values())
+        print(f"\t{'total':<24}{total_time:>19.2f}s (sequential: {sequential_time:.2f}s)")
+
+
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)  # fixed timestamp, so identical sources always produce byte-identical zips
+
+LAMBDA_CONFIGURATION = {"Runtime": "python3.10", "Handler": "lambda_function.main", "Timeout": 900, "MemorySize": 1024}
+
+
+def sha256_file(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def lambda_code_sha256(file_path: Path) -> str:
+    # lambda reports the `CodeSha256` of a function as base64 encoded digest
+    return base64.b64encode(bytes.fromhex(sha256_file(file_path))).decode("utf-8")
+
+
+def write_deterministic_zip(zip_file_path, files: dict) -> None:
+    """
+    `files` maps archive names to local paths. entries are sorted and carry fixed timestamps and permissions, so the content hash only changes when the content does.
+    `zip_file_path` can also be a file object
+    """
+    with zipfile.ZipFile(zip_file_path, "w") as z:
+        for arcname in sorted(files):
+            info = zipfile.ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            z.writestr(info, Path(files[arcname]).read_bytes())
+
+
 class S3Client:
     c = boto3.client("s3")
 
@@ -82,18 +210,22 @@ class S3Client:
         print(f"{Fore.GREEN}deleting bucket {bucket_name}{Style.RESET_ALL}")
         assert S3Client.bucket_exists(bucket_name)
 
-        response = S3Client.c.list_objects_v2(Bucket=bucket_name)
-        if response["KeyCount"] > 0:
-            S3Client.c.delete_objects(Bucket=bucket_name, Delete={"Objects": [{"Key": obj["Key"]} for obj in response["Contents"]]})
-        S3Client.c.delete_bucket(Bucket=bucket_name)
-
+        for page in S3Client.c.get_paginator("list_objects_v2").paginate(Bucket=bucket_name):
+            if page["KeyCount"] > 0:
+                S3Client.c.delete_objects(Bucket=bucket_name, Delete={"Objects": [{"Key": obj["Key"]} for obj in page["Contents"]]})
+        response = S3Client.c.delete_bucket(Bucket=bucket_name)
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
+
+        S3Client.c.get_waiter("bucket_not_exists").wait(Bucket=bucket_name, WaiterConfig=WAITER_CONFIG)
         assert not S3Client.bucket_exists(bucket_name)
 
     @staticmethod
-    def create_bucket(bucket_name: str) -> None:
+    def create_bucket(bucket_name: str, fresh: bool = False) -> None:
         print(f"{Fore.GREEN}creating bucket {bucket_name}{Style.RESET_ALL}")
 
+        if S3Client.bucket_exists(bucket_name) and not fresh:
+            print(f"bucket {bucket_name} already exists, keeping it")
+            return
         if S3Client.bucket_exists(bucket_name):
             print(f"bucket {bucket_name} already exists, deleting first")
             S3Client.delete_bucket(bucket_name)
@@ -102,6 +234,8 @@ class S3Client:
         response = S3Client.c.create_bucket(Bucket=bucket_name)
         print(json.dumps(response, indent=2))
 
+        S3Client.c.get_waiter("bucket_exists").wait(Bucket=bucket_name, WaiterConfig=WAITER_CONFIG)
+
         assert S3Client.bucket_exists(bucket_name)
 
     @staticmethod
@@ -115,9 +249,9 @@ class S3Client:
             policy_dict = json.loads(policy["Policy"])
             for statement in policy_dict["Statement"]:
                 if statement["Sid"] == statement_id:
-                    # If the permission exists, remove it
-                    LambdaClient.c.remove_permission(FunctionName=lambda_arn, StatementId=statement_id)
-                    break
+                    # the statement id is derived from the bucket name, so an existing permission is already the one we need
+                    print(f"invoke permission for {bucket_name} already exists, keeping it")
+                    return
         except LambdaClient.c.exceptions.ResourceNotFoundException:
             pass
 
@@ -132,30 +266,69 @@ class S3Client:
         print(json.dumps(json.loads(policy["Policy"]), indent=2))
 
     @staticmethod
-    def upload_file(bucket_name: str, file_path: Path) -> None:
+    def object_unchanged(bucket_name: str, key: str, content_hash: str) -> bool:
+        try:
+            response = S3Client.c.head_object(Bucket=bucket_name, Key=key)
+        except ClientError:
+            return False
+        return response.get("Metadata", {}).get("sha256") == content_hash
+
+    @staticmethod
+    def upload_file(bucket_name: str, file_path: Path, only_if_changed: bool = False, metadata: dict = None) -> bool:
         print(f"{Fore.GREEN}uploading file {file_path} to bucket {bucket_name}{Style.RESET_ALL}")
         assert S3Client.bucket_exists(bucket_name)
         assert file_path.exists()
 
-        S3Client.c.upload_file(str(file_path), bucket_name, file_path.name)
+        content_hash = sha256_file(file_path)
+        if only_if_changed and S3Client.object_unchanged(bucket_name, file_path.name, content_hash):
+            print(f"{file_path.name} unchanged, skipping upload")
+            return False
 
-    @staticmethod
-    def upload_folder(bucket_name: str, folder_path: Path, s3_directory: str = "") -> None:
-        print(f"{Fore.GREEN}uploading folder {folder_path} to bucket {bucket_name}{Style.RESET_ALL}")
-        assert S3Client.bucket_exists(bucket_name)
+        S3Client.c.upload_file(str(file_path), bucket_name, file_path.name, ExtraArgs={"Metadata": {"sha256": content_hash, **(metadata or {})}})
+        return True
 
-        for file_path in tqdm(folder_path.rglob("*")):
+    @staticmethod
+    def changed_files(bucket_name: str, folder_path: Path, s3_directory: str = "") -> list:
+        changed = []
+        for file_path in sorted(folder_path.rglob("*")):
             if file_path.is_file():
                 relative_path = file_path.relative_to(folder_path)
                 key = f"{s3_directory}/{relative_path}" if s3_directory else str(relative_path)
+                if not S3Client.object_unchanged(bucket_name, key, sha256_file(file_path)):
+                    changed.append((file_path, key))
+        return changed
 
-                S3Client.c.upload_file(str(file_path), bucket_name, key)
+    @staticmethod
+    def upload_folder(bucket_name: str, folder_path: Path, s3_directory: str = "", only_if_changed: bool = False) -> None:
+        print(f"{Fore.GREEN}uploading folder {folder_path} to bucket {bucket_name}{Style.RESET_ALL}")
+        assert S3Client.bucket_exists(bucket_name)
+
+        if only_if_changed:
+            uploads = S3Client.changed_files(bucket_name, folder_path, s3_directory)
+        else:
+            uploads = [(p, f"{s3_directory}/{p.relative_to(folder_path)}" if s3_directory else str(p.relative_to(folder_path))) for p in folder_path.rglob("*") if p.is_file()]
+        print(f"uploading {len(uploads)} files")
+
+        for file_path, key in tqdm(uploads):
+            S3Client.c.upload_file(str(file_path), bucket_name, key, ExtraArgs={"Metadata": {"sha256": sha256_file(file_path)}})
+
+    @staticmethod
+    def bucket_notification_exists(bucket_name: str, lambda_function_arn: str) -> bool:
+        response = S3Client.c.get_bucket_notification_configuration(Bucket=bucket_name)
+        for configuration in response.get("LambdaFunctionConfigurations", []):
+            if configuration["LambdaFunctionArn"] == lambda_function_arn and configuration["Events"] == ["s3:ObjectCreated:*"]:
+                return True
+        return False
 
     @staticmethod
     def set_bucket_notification(bucket_name: str, lambda_function_arn: str) -> None:
         print(f"{Fore.GREEN}setting bucket notification for {bucket_name}{Style.RESET_ALL}")
         assert S3Client.bucket_exists(bucket_name)
 
+        if S3Client.bucket_notification_exists(bucket_name, lambda_function_arn):
+            print(f"bucket notification for {bucket_name} already set, keeping it")
+            return
+
         response = S3Client.c.put_bucket_notification_configuration(
             Bucket=bucket_name,
             NotificationConfiguration={
@@ -188,11 +361,8 @@ class DynamoDBClient:
 
     @staticmethod
     def table_exists(table_name: str) -> bool:
-        response = DynamoDBClient.c.list_tables()
-        assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
-
-        for table in response["TableNames"]:
-            if table == table_name:
+        for page in DynamoDBClient.c.get_paginator("list_tables").paginate():
+            if table_name in page["TableNames"]:
                 return True
         return False
 
@@ -217,27 +387,21 @@ class DynamoDBClient:
         assert DynamoDBClient.table_exists(table_name)
 
         # wait for users to stop using table
-        while True:
-            try:
-                response = DynamoDBClient.c.delete_table(TableName=table_name)
-                break
-            except botocore.ClientError:
-                pass
+        response = retry_with_backoff(lambda: DynamoDBClient.c.delete_table(TableName=table_name), retry_on=("ResourceInUseException", "LimitExceededException"))
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
-        print(json.dumps(response, indent=2))
+        print(json.dumps(response, cls=DateTimeEncoder, indent=2))
 
         # wait for table to be deleted
-        max_wait = 5
-        for _ in range(max_wait):
-            if not DynamoDBClient.table_exists(table_name):
-                break
-            time.sleep(1)
+        DynamoDBClient.c.get_waiter("table_not_exists").wait(TableName=table_name, WaiterConfig=WAITER_CONFIG)
         assert not DynamoDBClient.table_exists(table_name)
 
     @staticmethod
-    def create_table(table_name: str) -> None:
+    def create_table(table_name: str, fresh: bool = False) -> None:
         print(f"{Fore.GREEN}creating table {table_name}{Style.RESET_ALL}")
 
+        if DynamoDBClient.table_exists(table_name) and not fresh:
+            print(f"table {table_name} already exists, keeping it")
+            return
         if DynamoDBClient.table_exists(table_name):
             print(f"table {table_name} already exists, deleting first")
             DynamoDBClient.delete_table(table_name)
@@ -253,15 +417,25 @@ class DynamoDBClient:
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
 
         # wait for creation to finish
-        while True:
-            response = DynamoDBClient.c.describe_table(TableName=table_name)
-            if response["Table"]["TableStatus"] == "ACTIVE":
-                break
-            time.sleep(1)
+        DynamoDBClient.c.get_waiter("table_exists").wait(TableName=table_name, WaiterConfig=WAITER_CONFIG)
+        response = DynamoDBClient.c.describe_table(TableName=table_name)
         print(json.dumps(response, cls=DateTimeEncoder, indent=2))
         assert DynamoDBClient.table_exists(table_name)
 
-    def download_table(self, table_name: str, file_path: Path, transfer_times: list = None) -> None:
+    @staticmethod
+    def item_trace(item: dict) -> dict:
+        """
+        the trace the handler stored with the item, as plain JSON
+        """
+        trace = item.get("trace", {}).get("M", {})
+        spans = [{"name": span["M"]["name"]["S"], "start": float(span["M"]["start"]["N"]), "duration": float(span["M"]["duration"]["N"])} for span in trace.get("spans", {}).get("L", [])]
+        return {"trace_id": trace.get("trace_id", {}).get("S", ""), "spans": spans}
+
+    def download_table(self, table_name: str, file_path: Path, uploads: dict = None, traces_path: Path = None) -> None:
+        """
+        `uploads` maps trace ids to the upload spans of this run, results are matched to their upload by trace id.
+        `traces_path` also writes the per-image traces, with the upload span, as JSON lines
+        """
         print(f"{Fore.GREEN}downloading table {table_name} to {file_path}{Style.RESET_ALL}")
         assert self.table_exists(table_name)
 
@@ -273,7 +447,9 @@ class DynamoDBClient:
             response = self.c.scan(TableName=table_name, ExclusiveStartKey=response["LastEvaluatedKey"])
             all_data.extend(response["Items"])
 
+        uploads = uploads or {}
         extracted_data = []
+        traces = []
         for item in all_data:
             s3_event_time = item.get("s3_eventTime", {}).get("S", "")
             yolo_detection = item.get("yolo_detection", {}).get("M", {})
@@ -282,13 +458,22 @@ class DynamoDBClient:
             inference_time = yolo_detection.get("inference_time", {}).get("N", "")
             input_image = yolo_detection.get("input_image", {}).get("S", "")
 
-            extracted_data.append({"s3_eventTime": s3_event_time, "inference_time": inference_time, "input_image": input_image, "timestamp": timestamp})
+            trace = self.item_trace(item)
+            upload = uploads.get(trace["trace_id"])
+            transfer_time = upload["duration"] if upload else None
+
+            extracted_data.append({"s3_eventTime": s3_event_time, "inference_time": inference_time, "input_image": input_image, "timestamp": timestamp, "transfer_time": transfer_time, "trace_id": trace["trace_id"]})
+            if trace["trace_id"]:
+                spans = sorted(([upload] if upload else []) + trace["spans"], key=lambda span: span["start"])
+                traces.append({**trace, "spans": spans, "image": input_image})
 
         df = pd.DataFrame(extracted_data)
-        if transfer_times:
-            df["transfer_time"] = transfer_times
         df.to_csv(file_path, index=False)
         print(f"Data exported to {file_path}")
+        if traces_path:
+            with open(traces_path, "w") as f:
+                f.writelines(json.dumps(trace) + "\n" for trace in traces)
+            print(f"{len(traces)} traces exported to {traces_path}")
 
 
 class LambdaClient:
@@ -297,29 +482,27 @@ class LambdaClient:
 
     @staticmethod
     def layer_exists(lambda_name: str) -> bool:
-        existing_functions = LambdaClient.c.list_layers()["Layers"]
-        for function in existing_functions:
-            if lambda_name == function["LayerName"]:
-                return True
+        for page in LambdaClient.c.get_paginator("list_layers").paginate():
+            for layer in page["Layers"]:
+                if lambda_name == layer["LayerName"]:
+                    return True
         return False
 
     @staticmethod
     def lambda_exists(lambda_name: str) -> bool:
-        existing_functions = LambdaClient.c.list_functions()["Functions"]
-        for function in existing_functions:
-            if lambda_name == function["FunctionName"]:
-                return True
+        for page in LambdaClient.c.get_paginator("list_functions").paginate():
+            for function in page["Functions"]:
+                if lambda_name == function["FunctionName"]:
+                    return True
         return False
 
     @staticmethod
     def list_lambdas():
         print(f"{Fore.GREEN}listing lambda functions{Style.RESET_ALL}")
 
-        response = LambdaClient.c.list_functions()
-        assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
-
-        for function in response["Functions"]:
-            print(f"\t{function['FunctionName']}")
+        for page in LambdaClient.c.get_paginator("list_functions").paginate():
+            for function in page["Functions"]:
+                print(f"\t{function['FunctionName']}")
 
     @staticmethod
     def delete_lambda(lambda_name: str, file_path: Path) -> None:
@@ -370,7 +553,10 @@ class LambdaClient:
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
 
     @staticmethod
-    def create_lambda(lambda_name: str, bucket_name: str, layer_name: str, file_path: Path) -> str:
+    def create_lambda(lambda_name: str, bucket_name: str, layer_name: str, file_path: Path, bundle_folder: Path = None) -> str:
+        """
+        `bundle_folder` is shipped inside the function package (e.g. the model configs), so the lambda doesn't have to download it from S3 on a cold start
+        """
         print(f"{Fore.GREEN}creating lambda function {lambda_name}{Style.RESET_ALL}")
         assert file_path.exists()
         assert file_path.suffix == ".py"
@@ -381,42 +567,111 @@ class LambdaClient:
             LambdaClient.delete_lambda(lambda_name, file_path)
             print(f"deleted existing lambda function - back to creating")
 
-        def zip_file(file_path: Path) -> Path:
-            zip_file_path = file_path.with_suffix(".zip")
-            if zip_file_path.exists():
-                zip_file_path.unlink()
-                print(f"deleted existing lambda zip")
-
-            with zipfile.ZipFile(zip_file_path, "w") as z:
-                z.write(file_path, file_path.name)
-            os.chmod(file_path, 0o777)
-            print(f"created lambda zip")
-            return zip_file_path
-
-        zip_file_path = zip_file(file_path)
+        zip_file_path = LambdaClient.build_package(file_path, bundle_folder)
 
         with open(zip_file_path, "rb") as f:
             accountid = boto3.client("sts").get_caller_identity()["Account"]
             role = "LabRole"
-            response = LambdaClient.c.create_function(
-                FunctionName=lambda_name,
-                Runtime="python3.10",
-                Role=f"arn:aws:iam::{accountid}:role/{role}",
-                Handler="lambda_function.main",
-                Code={"ZipFile": f.read()},
-                Layers=[layer_name],
-                Timeout=900,
-                MemorySize=1024,
+            code = f.read()
+            # a freshly created role can take a few seconds until lambda is allowed to assume it
+            response = retry_with_backoff(
+                lambda: LambdaClient.c.create_function(
+                    FunctionName=lambda_name,
+                    Role=f"arn:aws:iam::{accountid}:role/{role}",
+                    Code={"ZipFile": code},
+                    Layers=[layer_name],
+                    **LAMBDA_CONFIGURATION,
+                ),
+                retry_on=("InvalidParameterValueException",),
             )
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
         print(json.dumps(response, indent=2))
 
+        LambdaClient.c.get_waiter("function_active_v2").wait(FunctionName=lambda_name, WaiterConfig=WAITER_CONFIG)
+
         assert LambdaClient.lambda_exists(lambda_name)
 
         LambdaClient.__add_invoke_permission(lambda_name, bucket_name)
 
         return response["FunctionArn"]
 
+    @staticmethod
+    def package_files(file_path: Path, bundle_folder: Path = None) -> dict:
+        files = {file_path.name: file_path}
+        if bundle_folder is not None:
+            assert bundle_folder.is_dir(), f"bundle folder {bundle_folder} does not exist"
+            for bundled_file in bundle_folder.rglob("*"):
+                if bundled_file.is_file():
+                    files[str(Path(bundle_folder.name) / bundled_file.relative_to(bundle_folder))] = bundled_file
+        return files
+
+    @staticmethod
+    def build_package(file_path: Path, bundle_folder: Path = None) -> Path:
+        zip_file_path = file_path.with_suffix(".zip")
+        write_deterministic_zip(zip_file_path, LambdaClient.package_files(file_path, bundle_folder))
+        print(f"built lambda zip {zip_file_path.name} ({lambda_code_sha256(zip_file_path)})")
+        return zip_file_path
+
+    @staticmethod
+    def package_code_sha256(file_path: Path, bundle_folder: Path = None) -> str:
+        """
+        the `CodeSha256` the package would have, built in memory so nothing is written
+        """
+        buffer = io.BytesIO()
+        write_deterministic_zip(buffer, LambdaClient.package_files(file_path, bundle_folder))
+        return base64.b64encode(hashlib.sha256(buffer.getvalue()).digest()).decode("utf-8")
+
+    @staticmethod
+    def configuration_changes(configuration: dict, layer_arn: str) -> dict:
+        changes = {key: value for key, value in LAMBDA_CONFIGURATION.items() if configuration.get(key) != value}
+        if [layer["Arn"] for layer in configuration.get("Layers", [])] != [layer_arn]:
+            changes["Layers"] = [layer_arn]
+        return changes
+
+    @staticmethod
+    def deploy_lambda(lambda_name: str, bucket_name: str, layer_arn: str, file_path: Path, bundle_folder: Path = None) -> str:
+        """
+        creates the function if it doesn't exist yet, otherwise only updates the code and configuration that changed. an unchanged function keeps its warm execution environments
+        """
+        if not LambdaClient.lambda_exists(lambda_name):
+            return LambdaClient.create_lambda(lambda_name, bucket_name, layer_arn, file_path, bundle_folder)
+
+        print(f"{Fore.GREEN}updating lambda function {lambda_name}{Style.RESET_ALL}")
+        zip_file_path = LambdaClient.build_package(file_path, bundle_folder)
+        configuration = LambdaClient.c.get_function_configuration(FunctionName=lambda_name)
+
+        if configuration["CodeSha256"] != lambda_code_sha256(zip_file_path):
+            response = LambdaClient.c.update_function_code(FunctionName=lambda_name, ZipFile=zip_file_path.read_bytes())
+            assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
+            LambdaClient.c.get_waiter("function_updated_v2").wait(FunctionName=lambda_name, WaiterConfig=WAITER_CONFIG)
+            print(f"updated code of {lambda_name}")
+        else:
+            print(f"code of {lambda_name} unchanged")
+
+        changes = LambdaClient.configuration_changes(configuration, layer_arn)
+        if changes:
+            response = LambdaClient.c.update_function_configuration(FunctionName=lambda_name, **changes)
+            assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
+            LambdaClient.c.get_waiter("function_updated_v2").wait(FunctionName=lambda_name, WaiterConfig=WAITER_CONFIG)
+            print(f"updated configuration of {lambda_name}: {', '.join(changes)}")
+        else:
+            print(f"configuration of {lambda_name} unchanged")
+
+        return configuration["FunctionArn"]
+
+    @staticmethod
+    def find_layer_version(layer_name: str, content_hash: str) -> str:
+        """
+        returns the arn of the newest layer version that was published from the same content, or None
+        """
+        if not LambdaClient.layer_exists(layer_name):
+            return None
+        for page in LambdaClient.c.get_paginator("list_layer_versions").paginate(LayerName=layer_name):
+            for version in page["LayerVersions"]:
+                if version.get("Description") == f"sha256:{content_hash}":
+                    return version["LayerVersionArn"]
+        return None
+
     @staticmethod
     def delete_layer(layer_name: str) -> None:
         print(f"{Fore.GREEN}deleting lambda layer {layer_name}{Style.RESET_ALL}")
@@ -429,18 +684,19 @@ class LambdaClient:
         assert not LambdaClient.layer_exists(layer_name)
 
     @staticmethod
-    def publish_layer(layer_name: str, bucket_name: str, file_name: str) -> str:
+    def publish_layer(layer_name: str, bucket_name: str, file_name: str, content_hash: str) -> str:
         print(f"{Fore.GREEN}publishing lambda layer {layer_name}{Style.RESET_ALL}")
 
-        if LambdaClient.layer_exists(layer_name):
-            print(f"layer function {layer_name} already exists, deleting first")
-            LambdaClient.delete_layer(layer_name)
-            print(f"deleted existing layer function - back to creating")
+        existing_arn = LambdaClient.find_layer_version(layer_name, content_hash)
+        if existing_arn is not None:
+            print(f"layer {layer_name} unchanged, reusing {existing_arn}")
+            return existing_arn
 
         response = LambdaClient.c.publish_layer_version(
             LayerName=layer_name,
+            Description=f"sha256:{content_hash}",
             Content={"S3Bucket": bucket_name, "S3Key": file_name},
-            CompatibleRuntimes=["python3.10"],
+            CompatibleRuntimes=[LAMBDA_CONFIGURATION["Runtime"]],
         )
         assert response["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2
         print(json.dumps(response, indent=2))
@@ -453,17 +709,8 @@ class LambdaClient:
         print(f"{Fore.GREEN}invoking lambda function {lambda_name}{Style.RESET_ALL}")
         assert LambdaClient.lambda_exists(lambda_name)
 
-        def wait_until_ready(lambda_name):
-            while True:
-                try:
-                    response = LambdaClient.c.get_function(FunctionName=lambda_name)
-                    if response["Configuration"]["State"] == "Active":
-                        break
-                    print(f"waiting for lambda function {lambda_name} to be ready")
-                except botocore.ClientError:
-                    pass
-
-        wait_until_ready(lambda_name)
+        print(f"waiting for lambda function {lambda_name} to be ready")
+        LambdaClient.c.get_waiter("function_active_v2").wait(FunctionName=lambda_name, WaiterConfig=WAITER_CONFIG)
 
         response = LambdaClient.c.invoke(FunctionName=lambda_name, Payload=json.dumps(payload))
 
@@ -471,11 +718,91 @@ class LambdaClient:
         print(json.dumps(decoded_response, indent=2))
 
 
+def plan_deployment(table_name: str, bucket_name: str, layer_name: str, layer_path: Path, lambda_name: str, lambda_path: Path, configs_path: Path, bundle_model: bool) -> list:
+    """
+    compares the local build artifacts with what's deployed and returns a list of (resource, action) tuples without changing anything
+    """
+    plan = []
+    plan.append((f"table {table_name}", "unchanged" if DynamoDBClient.table_exists(table_name) else "create"))
+
+    bucket_exists = S3Client.bucket_exists(bucket_name)
+    plan.append((f"bucket {bucket_name}", "unchanged" if bucket_exists else "create"))
+
+    layer_hash = sha256_file(layer_path)
+    layer_uploaded = bucket_exists and S3Client.object_unchanged(bucket_name, layer_path.name, layer_hash)
+    plan.append((f"s3://{bucket_name}/{layer_path.name}", "unchanged" if layer_uploaded else "upload"))
+    layer_arn = LambdaClient.find_layer_version(layer_name, layer_hash)
+    plan.append((f"layer {layer_name}", "unchanged" if layer_arn else "publish new version"))
+
+    if not LambdaClient.lambda_exists(lambda_name):
+        plan.append((f"function {lambda_name}", "create"))
+    else:
+        configuration = LambdaClient.c.get_function_configuration(FunctionName=lambda_name)
+        code_changed = configuration["CodeSha256"] != LambdaClient.package_code_sha256(lambda_path, configs_path if bundle_model else None)
+        plan.append((f"function {lambda_name} code", "update" if code_changed else "unchanged"))
+        changes = LambdaClient.configuration_changes(configuration, layer_arn) if layer_arn else {"Layers": "new layer version"}
+        plan.append((f"function {lambda_name} configuration", f"update {', '.join(changes)}" if changes else "unchanged"))
+
+    if not bundle_model:
+        changed = S3Client.changed_files(bucket_name, configs_path, configs_path.name) if bucket_exists else [p for p in configs_path.rglob("*") if p.is_file()]
+        plan.append((f"s3://{bucket_name}/{configs_path.name}", f"upload {len(changed)} files" if changed else "unchanged"))
+    return plan
+
+
+def print_plan(plan: list) -> None:
+    print(f"{Fore.GREEN}deployment plan{Style.RESET_ALL}")
+    for resource, action in plan:
+        color = Style.DIM if action == "unchanged" else Fore.YELLOW
+        print(f"\t{resource:<60}{color}{action}{Style.RESET_ALL}")
+
+
+def provision(table_name: str, bucket_name: str, layer_name: str, layer_path: Path, lambda_name: str, lambda_path: Path, configs_path: Path, bundle_model: bool, fresh: bool = False) -> dict:
+    """
+    creates or updates everything, existing resources are kept unless `fresh` is set. returns the results of the steps
+    """
+    provisioner = Provisioner()
+    bundle_folder = configs_path if bundle_model else None
+
+    # Create services, existing ones are kept unless --fresh is set
+    provisioner.add("table", lambda results: DynamoDBClient.create_table(table_name, fresh=fresh))
+    provisioner.add("bucket", lambda results: S3Client.create_bucket(bucket_name, fresh=fresh))
+
+    # Upload dependencies to S3, unchanged artifacts are skipped based on their content hash
+    provisioner.add("layer upload", lambda results: S3Client.upload_file(bucket_name, layer_path, only_if_changed=True), depends_on=["bucket"])
+    provisioner.add("layer", lambda results: LambdaClient.publish_layer(layer_name, bucket_name, layer_path.name, sha256_file(layer_path)), depends_on=["layer upload"])
+    if fresh:
+        provisioner.add("function", lambda results: LambdaClient.create_lambda(lambda_name, bucket_name, results["layer"], lambda_path, bundle_folder=bundle_folder), depends_on=["layer"])
+    else:
+        provisioner.add("function", lambda results: LambdaClient.deploy_lambda(lambda_name, bucket_name, results["layer"], lambda_path, bundle_folder=bundle_folder), depends_on=["layer"])
+
+    # Upload Model Configs
+    if not bundle_model:
+        provisioner.add("model configs", lambda results: S3Client.upload_folder(bucket_name, configs_path, configs_path.name, only_if_changed=True), depends_on=["bucket"])
+
+    # Hooking up Lambda to S3
+    def hook_up_trigger(results):
+        S3Client.add_invoke_permission(results["function"], bucket_name)
+        S3Client.set_bucket_notification(bucket_name, results["function"])
+        S3Client.get_bucket_notification(bucket_name)
+
+    provisioner.add("trigger", hook_up_trigger, depends_on=["function", "bucket"])
+    return provisioner.run()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Deploy the object detection pipeline to AWS")
+    parser.add_argument("--plan", action="store_true", help="Only show what would change, without deploying")
+    parser.add_argument("--fresh", action="store_true", help="Delete and recreate the table, bucket and function")
+    parser.add_argument("--skip-data", action="store_true", help="Only deploy, don't upload the images in data/input_folder")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = get_args()
     assert_user_authenticated()
 
     table_name = TABLE_NAME
-    download_results = True
+    download_results = not args.skip_data
 
     bucket_name = "wolke-sieben-bucket-paul"
     data_path = Path.cwd() / "data" / "input_folder"
@@ -487,36 +814,28 @@ if __name__ == "__main__":
     lambda_path = Path.cwd() / "src" / "aws" / "lambda_function.py"
 
     yolo_tiny_configs = Path.cwd() / "yolo_tiny_configs"
-
-    # Create services
-    DynamoDBClient.create_table(table_name)
-    S3Client.create_bucket(bucket_name)
-
-    # Upload dependencies to S3
-    S3Client.upload_file(bucket_name, layer_path)
-    layer_arn_name = LambdaClient.publish_layer(layer_name, bucket_name, layer_path.name)
-    lambda_arn_name = LambdaClient.create_lambda(lambda_name, bucket_name, layer_arn_name, lambda_path)
-
-    # Upload Model Configs
-    S3Client.upload_folder(bucket_name, yolo_tiny_configs, yolo_tiny_configs.name)
-
-    # Hooking up Lambda to S3
-    S3Client.add_invoke_permission(lambda_arn_name, bucket_name)
-    S3Client.set_bucket_notification(bucket_name, lambda_arn_name)
-    S3Client.get_bucket_notification(bucket_name)
-
-    # Invoke lambda with s3 event for each file in the data folder
-    transfer_time = []
-    for file in data_path.rglob("*"):
+    bundle_model = (yolo_tiny_configs / "yolov3-tiny.weights").exists()  # ship the model inside the function package, S3 is the fallback
+
+    print_plan(plan_deployment(table_name, bucket_name, layer_name, layer_path, lambda_name, lambda_path, yolo_tiny_configs, bundle_model))
+    if args.plan:
+        exit(0)
+    deploy_start_time = time.time()
+    provision(table_name, bucket_name, layer_name, layer_path, lambda_name, lambda_path, yolo_tiny_configs, bundle_model, fresh=args.fresh)
+    print(f"{Fore.GREEN}deployment took {time.time() - deploy_start_time:.2f} seconds{Style.RESET_ALL}")
+
+    # Invoke lambda with s3 event for each file in the data folder, every upload gets a trace id the handler picks up
+    uploads = {}
+    for file in data_path.rglob("*") if not args.skip_data else []:
+        trace_id = uuid.uuid4().hex
         start_time = time.time()
-        S3Client.upload_file(bucket_name, file)
-        transfer_time.append(time.time() - start_time)
+        S3Client.upload_file(bucket_name, file, metadata={"trace-id": trace_id, "upload-start": repr(start_time)})
+        uploads[trace_id] = {"name": "upload", "start": start_time, "duration": time.time() - start_time}
 
     # Download data from dynamodb
     if download_results:
         time.sleep(40)  # wait until DynamoDB is populated
         dynamodb_client = DynamoDBClient()
-        dynamodb_client.download_table(table_name, Path("aws_results.csv"), transfer_times=transfer_time)
+        dynamodb_client.download_table(table_name, Path("aws_results.csv"), uploads=uploads, traces_path=Path("aws_traces.jsonl"))
 
     # Show results in dynamodb
     # DynamoDBClient.list_tables() # doesn't work because it's async, results can be seen in the AWS console
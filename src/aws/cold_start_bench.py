@@ -0,0 +1,102 @@
+"""
+Local cold start benchmark for the lambda function.
+
+Every run starts a fresh python process (like a new lambda execution environment) and measures
+how long the cold start phases take: imports, fetching the model artifacts, loading the net and the first inference.
+
+$ python3 ./src/aws/cold_start_bench.py ./data/input_folder/000000000968.jpg --runs 5
+$ python3 ./src/aws/cold_start_bench.py ./data/input_folder/000000000968.jpg --runs 5 --s3  # fetch artifacts from S3 instead
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from colorama import Fore, Style
+
+PHASES = ["import_boto3", "import_numpy", "import_cv2", "import_total", "artifact_fetch", "net_load", "first_inference", "warm_inference", "process_total"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Lambda cold start benchmark")
+    parser.add_argument("image_path", type=str, help="Path to an image used for the first inference")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh processes to start")
+    parser.add_argument("--s3", action="store_true", help="Download the model artifacts from S3 instead of using the bundled ones")
+    parser.add_argument("--model-dir", type=str, default=str(Path.cwd() / "yolo_tiny_configs"), help="Folder with the bundled model artifacts")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not Path(args.image_path).exists():
+        parser.error(f"image not found: {args.image_path}")
+    return args
+
+
+def profile_cold_start(image_path: str, use_s3: bool) -> dict:
+    """
+    runs inside the fresh process, mirrors what `lambda_function.main` does on a cold start
+    """
+    start_time = time.perf_counter()
+    import lambda_function
+
+    timings = {"import_total": time.perf_counter() - start_time}
+
+    boto3_client = lambda_function.Boto3Client() if use_s3 else None
+    detector, _ = lambda_function.get_detector(boto3_client)
+
+    with open(image_path, "rb") as image_file:
+        image_data = image_file.read()
+
+    start_time = time.perf_counter()
+    detector.detect_objects(image_data, confidence_threshold=0.5)
+    lambda_function.INIT_TIMINGS["first_inference"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    detector.detect_objects(image_data, confidence_threshold=0.5)
+    timings["warm_inference"] = time.perf_counter() - start_time
+
+    timings.update(lambda_function.INIT_TIMINGS)
+    return timings
+
+
+def run_fresh_process(args) -> dict:
+    env = dict(os.environ)
+    if args.s3:
+        # hide the bundled artifacts and drop the /tmp cache, so the process has to download everything
+        env.pop("MODEL_DIR", None)
+        env["LAMBDA_TASK_ROOT"] = "/nonexistent"
+        shutil.rmtree("/tmp/yolo_tiny_configs", ignore_errors=True)
+    else:
+        env["MODEL_DIR"] = args.model_dir
+
+    cmd = [sys.executable, str(Path(__file__).resolve()), args.image_path, "--child"] + (["--s3"] if args.s3 else [])
+    start_time = time.perf_counter()
+    result = subprocess.run(cmd, env=env, cwd=Path(__file__).resolve().parent, capture_output=True, text=True)
+    process_total = time.perf_counter() - start_time
+    assert result.returncode == 0, f"cold start process failed:\n{result.stderr}"
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_total"] = process_total
+    return timings
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    if args.child:
+        print(json.dumps(profile_cold_start(args.image_path, args.s3)))
+        sys.exit(0)
+
+    print(f"{Fore.GREEN}running {args.runs} cold starts with artifacts from {'S3' if args.s3 else args.model_dir}{Style.RESET_ALL}")
+    runs = [run_fresh_process(args) for _ in range(args.runs)]
+
+    print(f"\n{'phase':<18}{'median':>10}{'min':>10}{'max':>10}")
+    for phase in PHASES:
+        values = [run[phase] for run in runs if phase in run]
+        if values:
+            print(f"{phase:<18}{statistics.median(values):>10.4f}{min(values):>10.4f}{max(values):>10.4f}")
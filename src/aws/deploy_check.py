@@ -0,0 +1,132 @@
+"""
+Runs the provisioning of `aws.py` against moto's in-process AWS mock, no account or network needed.
+
+Goes through a first deploy, a redeploy without changes, a code change, `--fresh` and a failing step, and checks
+`plan_deployment`, the waiters and the per-step timings on the way. The build artifacts are written to a temporary
+folder, the model configs are small stand-ins unless `--model-dir` is given.
+
+$ pip install "moto[all]"
+$ python3 ./src/aws/deploy_check.py
+$ python3 ./src/aws/deploy_check.py --model-dir ./yolo_tiny_configs --s3-models  # upload the real configs instead of bundling them
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from colorama import Fore, Style
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Check the deployment against a mocked AWS")
+    parser.add_argument("--model-dir", type=str, default=None, help="Model configs to deploy, defaults to small stand-in files")
+    parser.add_argument("--s3-models", action="store_true", help="Upload the model configs to S3 instead of bundling them into the function")
+    args = parser.parse_args()
+
+    if args.model_dir and not Path(args.model_dir).is_dir():
+        parser.error(f"model folder not found: {args.model_dir}")
+    return args
+
+
+def pending(plan: list) -> list:
+    return [(resource, action) for resource, action in plan if action != "unchanged"]
+
+
+def check(name: str, ok: bool, detail: str = "") -> bool:
+    color = Fore.GREEN if ok else Fore.RED
+    print(f"{color}{'ok' if ok else 'FAILED':<8}{name}{Style.RESET_ALL}{f'  {detail}' if detail and not ok else ''}")
+    return ok
+
+
+def run_checks(work_dir: Path, model_dir: Path, bundle_model: bool) -> bool:
+    import boto3
+
+    import aws  # the clients are created on import, inside the mock
+
+    names = {"table_name": aws.TABLE_NAME, "bucket_name": "deploy-check-bucket", "layer_name": "deploy-check-layer", "lambda_name": "deploy-check-lambda"}
+    layer_path = work_dir / "packages.zip"
+    aws.write_deterministic_zip(layer_path, {"python/placeholder.txt": Path(aws.__file__)})
+    lambda_path = work_dir / "lambda_function.py"
+    shutil.copy(Path(aws.__file__).parent / "lambda_function.py", lambda_path)
+    artifacts = {"layer_path": layer_path, "lambda_path": lambda_path, "configs_path": model_dir, "bundle_model": bundle_model}
+
+    boto3.client("iam").create_role(RoleName="LabRole", AssumeRolePolicyDocument='{"Version":"2012-10-17","Statement":[{"Effect":"Allow","Principal":{"Service":"lambda.amazonaws.com"},"Action":"sts:AssumeRole"}]}')
+    lambda_client = boto3.client("lambda")
+    plan = lambda: aws.plan_deployment(names["table_name"], names["bucket_name"], names["layer_name"], layer_path, names["lambda_name"], lambda_path, model_dir, bundle_model)
+    provision = lambda fresh=False: aws.provision(**names, **artifacts, fresh=fresh)
+    results = []
+
+    first_plan = plan()
+    aws.print_plan(first_plan)
+    results.append(check("plan of an empty account creates everything", all(action != "unchanged" for _, action in first_plan), str(first_plan)))
+    if not bundle_model:
+        model_files = sum(1 for path in model_dir.rglob("*") if path.is_file())
+        results.append(check("plan counts the model files to upload", (f"s3://{names['bucket_name']}/{model_dir.name}", f"upload {model_files} files") in first_plan, str(first_plan)))
+
+    arn = provision()["function"]
+    configuration = lambda_client.get_function_configuration(FunctionName=names["lambda_name"])
+    results.append(check("first deploy creates an active function", configuration["State"] == "Active" and configuration["FunctionArn"] == arn, str(configuration)))
+    results.append(check("first deploy hooks up the trigger", aws.S3Client.bucket_notification_exists(names["bucket_name"], arn)))
+
+    results.append(check("plan after the deploy has nothing to do", not pending(plan()), str(pending(plan()))))
+    code_sha = configuration["CodeSha256"]
+    provision()
+    configuration = lambda_client.get_function_configuration(FunctionName=names["lambda_name"])
+    layer_versions = lambda_client.list_layer_versions(LayerName=names["layer_name"])["LayerVersions"]
+    results.append(check("redeploy keeps the code and the layer", configuration["CodeSha256"] == code_sha and len(layer_versions) == 1, f"{configuration['CodeSha256']} {len(layer_versions)} layer versions"))
+
+    with open(lambda_path, "a") as f:
+        f.write("\n# changed\n")
+    lambda_path.with_suffix(".zip").unlink()
+    changes = pending(plan())
+    results.append(check("plan after a code change only updates the code", [action for _, action in changes] == ["update"], str(changes)))
+    results.append(check("plan doesn't write the package", not lambda_path.with_suffix(".zip").exists()))
+    provision()
+    configuration = lambda_client.get_function_configuration(FunctionName=names["lambda_name"])
+    results.append(check("code change is deployed in place", configuration["CodeSha256"] != code_sha and configuration["FunctionArn"] == arn))
+
+    aws.S3Client.c.put_object(Bucket=names["bucket_name"], Key="leftover.txt", Body=b"x")
+    provision(fresh=True)
+    keys = [obj["Key"] for obj in aws.S3Client.c.list_objects_v2(Bucket=names["bucket_name"]).get("Contents", [])]
+    results.append(check("--fresh recreates the bucket", "leftover.txt" not in keys, str(keys)))
+    results.append(check("plan after --fresh has nothing to do", not pending(plan()), str(pending(plan()))))
+
+    provisioner = aws.Provisioner()
+    provisioner.add("table", lambda _: aws.DynamoDBClient.create_table(names["table_name"]))
+    provisioner.add("broken", lambda _: aws.S3Client.c.head_bucket(Bucket="deploy-check-missing-bucket"))
+    provisioner.add("after broken", lambda _: None, depends_on=["broken"])
+    try:
+        provisioner.run()
+        failed = False
+    except aws.ClientError:
+        failed = True
+    results.append(check("a failing step raises and still reports the timings", failed and "broken" in provisioner.timings and provisioner.failed == {"broken"}, str(provisioner.timings)))
+    return all(results)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    os.environ.update({"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test", "AWS_DEFAULT_REGION": "us-east-1"})
+    os.environ.pop("AWS_ENDPOINT_URL", None)
+    from moto import mock_aws
+
+    with tempfile.TemporaryDirectory(prefix="deploy-check-") as tmp:
+        work_dir = Path(tmp)
+        model_dir = Path(args.model_dir).resolve() if args.model_dir else work_dir / "yolo_tiny_configs"
+        if not args.model_dir:
+            model_dir.mkdir()
+            for name in ("yolov3-tiny.cfg", "yolov3-tiny.weights", "coco.names"):
+                (model_dir / name).write_text(f"stand-in for {name}\n")
+            (model_dir / "empty").mkdir()  # folders aren't uploaded or counted
+
+        start_time = time.time()
+        with mock_aws():
+            ok = run_checks(work_dir, model_dir, bundle_model=not args.s3_models)
+        print(f"\nchecks took {time.time() - start_time:.2f}s")
+    sys.exit(0 if ok else 1)
@@ -2,19 +2,85 @@
 content of this file is deployed as AWS Lambda function
 """
 
-import boto3
-import datetime
+import os
 import time
+
+# seconds spent in each phase of the cold start, filled in once per execution environment
+INIT_TIMINGS = {}
+
+_t = time.perf_counter()
+import boto3
+
+INIT_TIMINGS["import_boto3"] = time.perf_counter() - _t
+_t = time.perf_counter()
 import numpy as np
+
+INIT_TIMINGS["import_numpy"] = time.perf_counter() - _t
+_t = time.perf_counter()
 import cv2
-import os
+
+INIT_TIMINGS["import_cv2"] = time.perf_counter() - _t
+
+import datetime
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 
 from pathlib import Path
 
 TABLE_NAME = "wolke-sieben-table"
 BUCKET_NAME = "wolke-sieben-bucket-paul"  # Replace with your bucket name
 S3_FOLDER = "yolo_tiny_configs"
-LOCAL_TMP_FOLDER = "/tmp/yolo_tiny_configs/"
+TMP_FOLDER = os.environ.get("LAMBDA_TMP_FOLDER", "/tmp")  # overridden by the local emulation harness, so environments don't share /tmp
+LOCAL_TMP_FOLDER = os.path.join(TMP_FOLDER, "yolo_tiny_configs/")
+MODEL_FILES = ["yolov3-tiny.cfg", "yolov3-tiny.weights", "coco.names"]
+DOWNLOAD_WORKERS = 8
+
+# model artifacts bundled with the deployment are preferred over downloading them from S3:
+# the function package is extracted to $LAMBDA_TASK_ROOT, layers are extracted to /opt
+BUNDLED_MODEL_FOLDERS = [
+    Path(os.environ["MODEL_DIR"]) if "MODEL_DIR" in os.environ else None,
+    Path(os.environ.get("LAMBDA_TASK_ROOT", "/var/task")) / S3_FOLDER,
+    Path("/opt") / S3_FOLDER,
+]
+
+# detector is cached across warm invocations of the same execution environment
+_detector = None
+
+
+class Trace:
+    """
+    spans of one image under the trace id the uploader put into the object metadata (`trace-id`), same format as
+    src/local/tracing.py: `start` is wall clock time, so the spans line up with the upload and the S3 event time
+    """
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans = []
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        self.spans.append({"name": name, "start": start, "duration": duration})
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.time()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start_time)
+
+    def as_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "spans": sorted(self.spans, key=lambda span: span["start"])}
+
+
+def span(trace: Trace, name: str):
+    return trace.span(name) if trace is not None else nullcontext()
+
+
+def span_item(span: dict) -> dict:
+    return {"M": {"name": {"S": span["name"]}, "start": {"N": repr(span["start"])}, "duration": {"N": repr(span["duration"])}}}
 
 
 class Boto3Client:
@@ -22,13 +88,24 @@ class Boto3Client:
         self.s3 = boto3.client("s3")
 
     def download_from_s3(self, bucket_name, s3_key, local_path):
-        self.s3.download_file(bucket_name, s3_key, local_path)
+        # download next to the target and rename, so a failed download never leaves a truncated file behind
+        tmp_path = f"{local_path}.part"
+        self.s3.download_file(bucket_name, s3_key, tmp_path)
+        os.replace(tmp_path, local_path)
         print(f"Downloaded {s3_key} from bucket {bucket_name} to {local_path}")
 
+    def get_object(self, bucket_name, s3_key):
+        """
+        returns the content and the user metadata of an object, in one request
+        """
+        response = self.s3.get_object(Bucket=bucket_name, Key=s3_key)
+        return response["Body"].read(), response.get("Metadata", {})
+
     def download_all_files_in_folder(self, bucket_name, s3_folder, local_folder):
         paginator = self.s3.get_paginator("list_objects_v2")
         pages = paginator.paginate(Bucket=bucket_name, Prefix=s3_folder)
 
+        downloads = []
         for page in pages:
             if "Contents" in page:
                 for obj in page["Contents"]:
@@ -41,15 +118,43 @@ class Boto3Client:
                         os.makedirs(local_dir)
 
                     if not os.path.exists(local_path):
-                        self.download_from_s3(bucket_name, s3_key, local_path)
+                        downloads.append((s3_key, local_path))
+
+        # the weights dominate the transfer, fetching all files at once hides the latency of the small ones
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = [executor.submit(self.download_from_s3, bucket_name, s3_key, local_path) for s3_key, local_path in downloads]
+            for future in futures:
+                future.result()
+
+
+def find_bundled_model_folder():
+    for folder in BUNDLED_MODEL_FOLDERS:
+        if folder is not None and all((folder / name).exists() for name in MODEL_FILES):
+            return folder
+    return None
+
+
+def fetch_model_artifacts(boto3_client) -> Path:
+    """
+    returns the folder containing the model files, downloading them from S3 only if they weren't bundled with the deployment
+    """
+    bundled_folder = find_bundled_model_folder()
+    if bundled_folder is not None:
+        return bundled_folder
+
+    local_folder = Path(LOCAL_TMP_FOLDER)
+    if not all((local_folder / name).exists() for name in MODEL_FILES):
+        os.makedirs(local_folder, exist_ok=True)
+        boto3_client.download_all_files_in_folder(BUCKET_NAME, S3_FOLDER, LOCAL_TMP_FOLDER)
+    return local_folder
 
 
 class ObjectDetection:
-    def __init__(self):
-        self.root = Path("/tmp")
-        self.MODEL_CONFIG = self.root / "yolo_tiny_configs" / "yolov3-tiny.cfg"
-        self.MODEL_WEIGHTS = self.root / "yolo_tiny_configs" / "yolov3-tiny.weights"
-        self.COCO_NAMES = self.root / "yolo_tiny_configs" / "coco.names"
+    def __init__(self, model_folder=Path(LOCAL_TMP_FOLDER)):
+        self.root = Path(model_folder)
+        self.MODEL_CONFIG = self.root / "yolov3-tiny.cfg"
+        self.MODEL_WEIGHTS = self.root / "yolov3-tiny.weights"
+        self.COCO_NAMES = self.root / "coco.names"
 
         self.net = cv2.dnn.readNet(str(self.MODEL_WEIGHTS), str(self.MODEL_CONFIG))
 
@@ -69,22 +174,29 @@ class ObjectDetection:
 
         self.output_layers = self.net.getUnconnectedOutLayersNames()
 
-    def detect_objects(self, image_data, confidence_threshold=0.5, return_image=False):
-        # Convert to a numpy array and decode to an image
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        height, width, _ = img.shape
+    def detect_objects(self, image_data, confidence_threshold=0.5, return_image=False, trace=None):
+        with span(trace, "preprocess"):
+            # Convert to a numpy array and decode to an image
+            nparr = np.frombuffer(image_data, np.uint8)
+            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            height, width, _ = img.shape
 
-        # Prepare the image for YOLO
-        blob = cv2.dnn.blobFromImage(img, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+            # Prepare the image for YOLO
+            blob = cv2.dnn.blobFromImage(img, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
 
         # Run the YOLO network
-        self.net.setInput(blob)
-        start_time = time.time()
-        outs = self.net.forward(self.output_layers)
-        end_time = time.time()
-        inference_time = end_time - start_time
+        with span(trace, "forward"):
+            self.net.setInput(blob)
+            start_time = time.time()
+            outs = self.net.forward(self.output_layers)
+            end_time = time.time()
+            inference_time = end_time - start_time
+
+        with span(trace, "postprocess"):
+            detected_objects = self.parse_outputs(outs, width, height, confidence_threshold)
+        return detected_objects, inference_time
 
+    def parse_outputs(self, outs, width, height, confidence_threshold):
         class_ids = []
         confidences = []
         boxes = []
@@ -120,21 +232,49 @@ class ObjectDetection:
                 if confidence > confidence_threshold:
                     detected_objects.append({"label": label, "accuracy": confidence})
 
-        return detected_objects, inference_time
+        return detected_objects
+
+
+def get_detector(boto3_client):
+    """
+    loads the model once per execution environment and records how long each step of the cold start took
+    """
+    global _detector
+    if _detector is not None:
+        return _detector, False
+
+    start_time = time.perf_counter()
+    model_folder = fetch_model_artifacts(boto3_client)
+    INIT_TIMINGS["artifact_fetch"] = time.perf_counter() - start_time
+    INIT_TIMINGS["artifact_source"] = "bundled" if model_folder != Path(LOCAL_TMP_FOLDER) else "s3"
+
+    start_time = time.perf_counter()
+    _detector = ObjectDetection(model_folder)
+    INIT_TIMINGS["net_load"] = time.perf_counter() - start_time
+    return _detector, True
+
+
+def event_timestamp(event_time: str) -> float:
+    # s3 event times are UTC, e.g. "2024-07-07T20:17:34.912Z"
+    return datetime.datetime.fromisoformat(event_time.rstrip("Z")).replace(tzinfo=datetime.timezone.utc).timestamp()
 
 
 def main(event, context) -> dict:
+    handler_start = time.time()
     print("Lambda Function invoked with event:", event)
 
+    # seconds spent in each phase of this invocation
+    timings = {}
+    trace = Trace()
+
     # Initialize Boto3 client
     boto3_client = Boto3Client()
 
-    # Ensure the local directory exists, only download files if they don't exist, otherwise use the cached files
-    if not os.path.exists(LOCAL_TMP_FOLDER):
-        os.makedirs(LOCAL_TMP_FOLDER)
-
-        # Download all files in the specified S3 folder to /tmp when the container is initialized
-        boto3_client.download_all_files_in_folder(BUCKET_NAME, S3_FOLDER, LOCAL_TMP_FOLDER)
+    # Model files are bundled or downloaded to /tmp once, the loaded net is reused by warm invocations
+    start_time = time.perf_counter()
+    with trace.span("model_init"):
+        obj_detect, cold_start = get_detector(boto3_client)
+    timings["init"] = time.perf_counter() - start_time
 
     # Extract S3 event details
     if "Records" in event and len(event["Records"]) > 0:
@@ -143,18 +283,27 @@ def main(event, context) -> dict:
         bucket_name = s3_event["bucket"]["name"]
         object_key = s3_event["object"]["key"]
 
-    # Download the file from S3
-    image_path = f"/tmp/{object_key}"
-    boto3_client.download_from_s3(bucket_name, object_key, image_path)
-
-    # Read the image file
-    with open(image_path, "rb") as image_file:
-        image_data = image_file.read()
-
-    # Initialize ObjectDetection class
-    obj_detect = ObjectDetection()
-    detected_objects, inference_time = obj_detect.detect_objects(image_data, confidence_threshold=0.5)
-
+    # Download the file from S3, the uploader put the trace id and the upload start into its metadata
+    start_time = time.perf_counter()
+    with trace.span("s3_fetch"):
+        image_data, metadata = boto3_client.get_object(bucket_name, object_key)
+    timings["download"] = time.perf_counter() - start_time
+    trace.trace_id = metadata.get("trace-id", trace.trace_id)
+    trace.add("s3_event", event_timestamp(event_time), 0.0)
+    if "upload-start" in metadata:
+        trace.add("upload_start", float(metadata["upload-start"]), 0.0)
+    trace.add("handler_start", handler_start, 0.0)
+
+    start_time = time.perf_counter()
+    detected_objects, inference_time = obj_detect.detect_objects(image_data, confidence_threshold=0.5, trace=trace)
+    timings["inference"] = time.perf_counter() - start_time
+    if cold_start:
+        INIT_TIMINGS["first_inference"] = timings["inference"]
+        print("Cold start breakdown:", INIT_TIMINGS)
+
+    # the item can't contain its own write time, it only records when the write started. the full `dynamodb_write`
+    # span is in the response and the log
+    trace.add("write_start", time.time(), 0.0)
     dynamodb_item = {
         "timestamp": {"S": datetime.datetime.now().isoformat()},
         "s3_eventTime": {"S": event_time},
@@ -175,14 +324,23 @@ def main(event, context) -> dict:
                 "inference_time": {"N": str(inference_time)},
             }
         },
+        "trace": {"M": {"trace_id": {"S": trace.trace_id}, "spans": {"L": [span_item(span) for span in trace.as_dict()["spans"]]}}},
     }
+    if cold_start:
+        dynamodb_item["cold_start"] = {"M": {k: {"S": v} if isinstance(v, str) else {"N": str(v)} for k, v in INIT_TIMINGS.items()}}
 
     print("DynamoDB PutItem Request: ", dynamodb_item)
 
     # Write output to DynamoDB
+    start_time = time.perf_counter()
     dynamodb = boto3.client("dynamodb")
-    res = dynamodb.put_item(
-        TableName=TABLE_NAME,
-        Item=dynamodb_item,
-    )
+    with trace.span("dynamodb_write"):
+        res = dynamodb.put_item(
+            TableName=TABLE_NAME,
+            Item=dynamodb_item,
+        )
     assert res["ResponseMetadata"]["HTTPStatusCode"] // 100 == 2, f"Failed to write to DynamoDB: {res}"
+    timings["write"] = time.perf_counter() - start_time
+    print("Trace:", json.dumps(trace.as_dict()))
+
+    return {"cold_start": cold_start, "timings": timings, "detected_objects": detected_objects, "trace": trace.as_dict()}
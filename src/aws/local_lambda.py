@@ -0,0 +1,358 @@
+"""
+Local emulation harness for the lambda function.
+
+Replays S3 `ObjectCreated` events for every image in a folder through `lambda_function.main`, without deploying to AWS.
+Every execution environment is a separate process with its own /tmp folder, that is reused for later events (warm start)
+or started on demand (cold start), just like lambda does during a burst. S3 is emulated by a folder and DynamoDB by a SQLite file.
+
+$ python3 ./src/aws/local_lambda.py ./data/input_folder --max-concurrency 4
+$ python3 ./src/aws/local_lambda.py ./data/input_folder --max-concurrency 4 --rate 20 --s3-models
+$ python3 ./src/aws/local_lambda.py ./data/input_folder --fresh  # every invocation gets a new environment
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from colorama import Fore, Style
+
+PHASES = ["import", "init", "download", "inference", "write", "total"]
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+class LocalS3:
+    """
+    filesystem-backed stand-in for the S3 client methods used by the lambda, every bucket is a folder in `root`,
+    user metadata is kept in `root/.metadata/<bucket>/<key>.json`
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def __path(self, bucket_name: str, key: str) -> Path:
+        return self.root / bucket_name / key
+
+    def __metadata_path(self, bucket_name: str, key: str) -> Path:
+        return self.root / ".metadata" / bucket_name / f"{key}.json"
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        path = self.__path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Filename, path)
+        metadata_path = self.__metadata_path(Bucket, Key)
+        metadata_path.parent.mkdir(parents=True, exist_ok=True)
+        metadata_path.write_text(json.dumps((ExtraArgs or {}).get("Metadata", {})))
+
+    def get_object(self, Bucket, Key):
+        path = self.__path(Bucket, Key)
+        if not path.exists():
+            raise FileNotFoundError(f"s3://{Bucket}/{Key} does not exist")
+        metadata_path = self.__metadata_path(Bucket, Key)
+        metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {}
+        return {"Body": io.BytesIO(path.read_bytes()), "Metadata": metadata}
+
+    def download_file(self, Bucket, Key, Filename):
+        path = self.__path(Bucket, Key)
+        if not path.exists():
+            raise FileNotFoundError(f"s3://{Bucket}/{Key} does not exist")
+        shutil.copyfile(path, Filename)
+
+    def get_paginator(self, operation_name: str):
+        assert operation_name == "list_objects_v2", f"{operation_name} is not emulated"
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        bucket_path = self.root / Bucket
+        keys = sorted(str(p.relative_to(bucket_path)) for p in bucket_path.rglob("*") if p.is_file())
+        contents = [{"Key": key, "Size": (bucket_path / key).stat().st_size} for key in keys if key.startswith(Prefix)]
+        yield {"KeyCount": len(contents), "Contents": contents} if contents else {"KeyCount": 0}
+
+
+class LocalDynamoDB:
+    """
+    SQLite-backed stand-in for the DynamoDB client methods used by the lambda, items are stored in DynamoDB JSON
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS items (table_name TEXT, key TEXT, item TEXT, PRIMARY KEY (table_name, key))")
+
+    def put_item(self, TableName, Item):
+        key = Item["timestamp"]["S"]
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            conn.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?)", (TableName, key, json.dumps(Item)))
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def scan(self, TableName, **kwargs):
+        with sqlite3.connect(self.path, timeout=30) as conn:
+            items = [json.loads(row[0]) for row in conn.execute("SELECT item FROM items WHERE table_name = ?", (TableName,))]
+        return {"Items": items, "Count": len(items), "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+class LocalClientFactory:
+    """
+    replaces `boto3.client` inside an execution environment
+    """
+
+    def __init__(self, state_dir: Path):
+        self.state_dir = Path(state_dir)
+
+    def __call__(self, service_name, *args, **kwargs):
+        if service_name == "s3":
+            return LocalS3(self.state_dir / "s3")
+        if service_name == "dynamodb":
+            return LocalDynamoDB(self.state_dir / "dynamodb.sqlite")
+        raise NotImplementedError(f"{service_name} is not emulated")
+
+
+class LocalContext:
+    """
+    mirrors the attributes of the lambda context object that the handler reads
+    """
+
+    def __init__(self, function_name: str, memory_limit_in_mb: int, timeout: float):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self.log_stream_name = "local"
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def environment_loop(conn, env_id: int, state_dir: str, model_dir: str, memory_limit_in_mb: int, timeout: float) -> None:
+    """
+    body of an execution environment process: imports the handler once, then serves events until the pipe is closed
+    """
+    tmp_folder = Path(state_dir) / "environments" / str(env_id) / "tmp"
+    tmp_folder.mkdir(parents=True, exist_ok=True)
+    os.environ["LAMBDA_TMP_FOLDER"] = str(tmp_folder)
+    os.environ["LAMBDA_TASK_ROOT"] = str(Path(state_dir) / "task")
+    if model_dir:
+        os.environ["MODEL_DIR"] = model_dir
+    sys.stdout = open(tmp_folder.parent / "stdout.log", "a", buffering=1)  # the handler prints a lot, keep it out of the report
+
+    start_time = time.perf_counter()
+    import lambda_function
+
+    import_time = time.perf_counter() - start_time
+    lambda_function.boto3.client = LocalClientFactory(Path(state_dir))
+
+    first_invocation = True
+    while True:
+        try:
+            event = conn.recv()
+        except EOFError:
+            return
+
+        context = LocalContext("wolke-sieben-lambda-local", memory_limit_in_mb, timeout)
+        try:
+            response = lambda_function.main(event, context)
+            result = {"status": "ok", "cold_start": response["cold_start"], "timings": response["timings"], "trace": response["trace"]}
+        except Exception as e:
+            result = {"status": "error", "error": repr(e), "cold_start": first_invocation, "timings": {}}
+        if first_invocation:
+            result["timings"]["import"] = import_time
+            result["init_timings"] = dict(lambda_function.INIT_TIMINGS)
+        first_invocation = False
+
+        # lambda kills environments that exceed their memory limit, ru_maxrss is in KiB on linux
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        result["max_rss_mb"] = max_rss_mb
+        if max_rss_mb > memory_limit_in_mb:
+            result["status"] = "memory limit exceeded"
+            conn.send(result)
+            return
+        conn.send(result)
+
+
+class ExecutionEnvironment:
+    def __init__(self, env_id: int, args):
+        self.env_id = env_id
+        self.conn, child_conn = multiprocessing.Pipe()
+        model_dir = None if args.s3_models else args.model_dir
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=environment_loop, args=(child_conn, env_id, args.state_dir, model_dir, args.memory, args.timeout), daemon=True
+        )
+        self.process.start()
+
+    def invoke(self, event: dict, timeout: float) -> dict:
+        self.conn.send(event)
+        if not self.conn.poll(timeout):
+            self.kill()
+            return {"status": "timeout", "cold_start": None, "timings": {}}
+        try:
+            return self.conn.recv()
+        except EOFError:
+            return {"status": f"environment crashed with exit code {self.process.exitcode}", "cold_start": None, "timings": {}}
+
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self) -> None:
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+
+class EnvironmentPool:
+    """
+    hands out idle (warm) environments first and starts new (cold) ones when all existing environments are busy
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.idle = []
+        self.all = []
+
+    def acquire(self) -> ExecutionEnvironment:
+        with self.lock:
+            while self.idle and not self.args.fresh:
+                env = self.idle.pop()
+                if env.alive():
+                    return env
+            env = ExecutionEnvironment(len(self.all), self.args)
+            self.all.append(env)
+            return env
+
+    def release(self, env: ExecutionEnvironment) -> None:
+        if self.args.fresh or not env.alive():
+            env.kill()
+            return
+        with self.lock:
+            self.idle.append(env)
+
+    def shutdown(self) -> None:
+        for env in self.all:
+            if env.alive():
+                env.kill()
+
+
+def s3_put_event(bucket_name: str, key: str, size: int) -> dict:
+    return {
+        "Records": [
+            {
+                "eventVersion": "2.1",
+                "eventSource": "aws:s3",
+                "eventTime": datetime.datetime.utcnow().isoformat(timespec="milliseconds") + "Z",
+                "eventName": "ObjectCreated:Put",
+                "s3": {"bucket": {"name": bucket_name, "arn": f"arn:aws:s3:::{bucket_name}"}, "object": {"key": key, "size": size}},
+            }
+        ]
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Local Lambda emulation harness")
+    parser.add_argument("input_folder", type=str, help="Folder with the images to replay as S3 events")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Maximum number of concurrent execution environments")
+    parser.add_argument("--rate", type=float, default=0, help="Events per second, 0 sends the whole folder as one burst")
+    parser.add_argument("--fresh", action="store_true", help="Start a new environment for every invocation (always cold)")
+    parser.add_argument("--memory", type=int, default=1024, help="Memory limit in MB")
+    parser.add_argument("--timeout", type=float, default=900, help="Invocation timeout in seconds")
+    parser.add_argument("--s3-models", action="store_true", help="Fetch the model from the local S3 stand-in instead of the bundled folder")
+    parser.add_argument("--model-dir", type=str, default=str(Path.cwd() / "yolo_tiny_configs"), help="Folder with the bundled model artifacts")
+    parser.add_argument("--state-dir", type=str, default=str(Path.cwd() / ".local_aws"), help="Folder for the S3/DynamoDB stand-ins and the environments' /tmp")
+    parser.add_argument("--output", type=str, default="local_lambda_results.csv", help="Per-invocation results")
+    parser.add_argument("--traces", type=str, default="local_lambda_traces.jsonl", help="Per-image traces from upload to the persisted result (see src/bench/trace_report.py)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_folder):
+        parser.error("Invalid input folder")
+    if not any(p.suffix in IMAGE_SUFFIXES for p in Path(args.input_folder).iterdir()):
+        parser.error(f"no {', '.join(IMAGE_SUFFIXES)} images in {args.input_folder}, nothing to replay")
+    return args
+
+
+def print_summary(results: list) -> None:
+    print(f"\n{Fore.GREEN}**** Local Lambda Summary ****{Style.RESET_ALL}")
+    for cold_start in [True, False]:
+        runs = [r for r in results if r["status"] == "ok" and r["cold_start"] == cold_start]
+        print(f"{'cold' if cold_start else 'warm'} invocations: {len(runs)}")
+        for phase in PHASES:
+            values = [r[phase] for r in runs if r.get(phase) is not None]
+            if values:
+                print(f"\t{phase:<10} mean {statistics.mean(values):.4f}s  median {statistics.median(values):.4f}s  max {max(values):.4f}s")
+    failed = [r for r in results if r["status"] != "ok"]
+    if failed:
+        print(f"{Fore.RED}failed invocations: {len(failed)} ({', '.join(sorted(set(r['status'] for r in failed)))}){Style.RESET_ALL}")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    sys.path.insert(0, str(Path(__file__).resolve().parent))  # environments import lambda_function from this folder
+
+    from lambda_function import BUCKET_NAME, S3_FOLDER
+
+    s3 = LocalS3(Path(args.state_dir) / "s3")
+    if args.s3_models:
+        for file_path in Path(args.model_dir).glob("*"):
+            s3.upload_file(str(file_path), BUCKET_NAME, f"{S3_FOLDER}/{file_path.name}")
+
+    images = sorted(p for p in Path(args.input_folder).iterdir() if p.suffix in IMAGE_SUFFIXES)
+    print(f"{Fore.GREEN}replaying {len(images)} events with up to {args.max_concurrency} environments{Style.RESET_ALL}")
+
+    pool = EnvironmentPool(args)
+
+    traces = open(args.traces, "w")
+
+    def invoke(image_path: Path) -> dict:
+        # like aws.py, the trace id and the upload start travel with the object
+        trace_id = uuid.uuid4().hex
+        upload_start = time.time()
+        s3.upload_file(str(image_path), BUCKET_NAME, image_path.name, ExtraArgs={"Metadata": {"trace-id": trace_id, "upload-start": repr(upload_start)}})
+        upload = {"name": "upload", "start": upload_start, "duration": time.time() - upload_start}
+        event = s3_put_event(BUCKET_NAME, image_path.name, image_path.stat().st_size)
+
+        start_time = time.perf_counter()
+        env = pool.acquire()
+        response = env.invoke(event, args.timeout)
+        total = time.perf_counter() - start_time
+        pool.release(env)
+
+        if "trace" in response:
+            trace = response["trace"]
+            traces.write(json.dumps({**trace, "spans": sorted([upload] + trace["spans"], key=lambda span: span["start"]), "image": image_path.name}) + "\n")
+
+        result = {"key": image_path.name, "trace_id": trace_id, "environment": env.env_id, "status": response["status"], "cold_start": response["cold_start"], "total": total}
+        result.update({phase: response["timings"].get(phase) for phase in PHASES if phase != "total"})
+        result["max_rss_mb"] = response.get("max_rss_mb")
+        return result
+
+    futures = []
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.max_concurrency) as executor:
+        for i, image_path in enumerate(images):
+            if args.rate > 0:
+                time.sleep(max(0, start_time + i / args.rate - time.time()))
+            futures.append(executor.submit(invoke, image_path))
+        results = [future.result() for future in futures]
+    pool.shutdown()
+    traces.close()
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"per-invocation results written to {args.output}")
+    print(f"environments started: {len(pool.all)}, wall time: {time.time() - start_time:.2f}s")
+    print_summary(results)
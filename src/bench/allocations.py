@@ -0,0 +1,117 @@
+"""
+Allocations, steady-state RSS and latency of `detect_objects` with and without the reused buffers (see `Scratch` in
+src/local/object_detection.py).
+
+Every path runs in a fresh process over the same images:
+
+- transient memory per request: the peak of tracemalloc (numpy and OpenCV's numpy allocator report to it) above the
+  memory held before the request, so the blob, the output arrays and the parsing temporaries are included
+- retained memory: what tracemalloc still holds after all requests, a leak shows up here
+- RSS after the warm-up and after all requests
+- latency percentiles, measured in a separate untraced pass since tracing slows every allocation down
+
+$ python3 ./src/bench/allocations.py ./data/input_folder --requests 500
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import psutil
+from colorama import Fore, Style
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+from object_detection import ObjectDetection  # noqa: E402
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Allocations, RSS and latency of the pooled buffers against per-request allocation")
+    parser.add_argument("input_folder", type=str, help="Path to the sample images")
+    parser.add_argument("--images", type=int, default=20, help="Number of distinct images")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per path")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests before measuring")
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads for the run")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Confidence threshold")
+    args = parser.parse_args()
+
+    if not Path(args.input_folder).is_dir():
+        parser.error("Invalid input folder")
+    return args
+
+
+def measure(reuse_buffers: bool, args, results) -> None:
+    """
+    runs in a fresh process per path
+    """
+    cv2.setNumThreads(args.threads)
+    paths = sorted(p for p in Path(args.input_folder).iterdir() if p.suffix in (".jpg", ".jpeg", ".png"))[: args.images]
+    images = [p.read_bytes() for p in paths]
+    detector = ObjectDetection(reuse_buffers=reuse_buffers)
+    process = psutil.Process()
+
+    for i in range(args.warmup):
+        detector.detect_objects(images[i % len(images)], args.confidence)
+    rss_warm = process.memory_info().rss
+
+    latencies = []
+    for i in range(args.requests):
+        start_time = time.perf_counter()
+        detector.detect_objects(images[i % len(images)], args.confidence)
+        latencies.append(time.perf_counter() - start_time)
+    rss_steady = process.memory_info().rss
+
+    tracemalloc.start()
+    transient = []
+    retained_before = tracemalloc.get_traced_memory()[0]
+    for i in range(args.requests):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        detector.detect_objects(images[i % len(images)], args.confidence)
+        transient.append(tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - retained_before
+    tracemalloc.stop()
+
+    results.put(
+        {
+            "transient_kb": float(np.mean(transient)) / 1024,
+            "retained_kb": retained / 1024,
+            "rss_warm_mb": rss_warm / 1024**2,
+            "rss_steady_mb": rss_steady / 1024**2,
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+        }
+    )
+
+
+def run_path(reuse_buffers: bool, args) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=measure, args=(reuse_buffers, args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    args = get_args()
+    print(f"{args.requests} requests per path after {args.warmup} warm-up requests")
+    print(f"{'path':>10}{'transient kb':>14}{'retained kb':>13}{'rss warm mb':>13}{'rss steady mb':>15}{'p50 ms':>9}{'p99 ms':>9}")
+
+    measured = {}
+    for name, reuse_buffers in (("allocate", False), ("reuse", True)):
+        result = measured[name] = run_path(reuse_buffers, args)
+        print(
+            f"{name:>10}{result['transient_kb']:>14.1f}{result['retained_kb']:>13.1f}{result['rss_warm_mb']:>13.1f}{result['rss_steady_mb']:>15.1f}"
+            f"{result['p50'] * 1000:>9.2f}{result['p99'] * 1000:>9.2f}"
+        )
+
+    saved = 1 - measured["reuse"]["transient_kb"] / measured["allocate"]["transient_kb"]
+    speedup = measured["allocate"]["p50"] / measured["reuse"]["p50"]
+    color = Fore.GREEN if saved > 0 and speedup >= 1 else Fore.YELLOW
+    print(f"{color}reused buffers: {saved:.0%} less transient memory per request, p50 {speedup:.2f}x{Style.RESET_ALL}")
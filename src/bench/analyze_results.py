@@ -0,0 +1,244 @@
+"""
+Analyzes benchmark result files of local and cloud runs.
+
+Reads `local_results.csv` (client.py), `aws_results.csv` (aws.py), `local_lambda_results.csv` (local_lambda.py)
+and DynamoDB exports (JSON lines with one `{"Item": ...}` per line, or the output of `aws dynamodb scan`).
+Rows are streamed, only the numeric columns are kept in memory, so files with millions of rows are fine.
+
+For every run it reports p50/p90/p99/max with bootstrap confidence intervals, the throughput over time and
+which invocations were cold starts. Given more than one run, the first one is the baseline the others are compared to.
+
+$ python3 ./src/bench/analyze_results.py local_results.csv aws_results.csv
+$ python3 ./src/bench/analyze_results.py aws_results.csv aws_results_after.csv --json report.json
+"""
+
+import argparse
+import csv
+import json
+import sys
+from array import array
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+PERCENTILES = [50, 90, 99]
+BOOTSTRAP_SAMPLES = 1000
+BOOTSTRAP_MAX_SIZE = 20_000  # larger runs are subsampled for the bootstrap (wider, i.e. conservative intervals), the point estimates still use every row
+COLD_START_MAD_FACTOR = 5  # gaps above median + factor * MAD are classified as cold starts
+
+csv.field_size_limit(sys.maxsize)
+
+
+def parse_time(value: str) -> float:
+    # s3 event times end with "Z", the handler's timestamps are naive, both are UTC
+    if not value:
+        return float("nan")
+    return datetime.fromisoformat(value.rstrip("Z")).timestamp()
+
+
+def parse_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class Run:
+    """
+    column store of one result file, every column has one value per row (NaN if missing)
+    """
+
+    COLUMNS = ["inference_time", "transfer_time", "total_time", "event_time", "handler_time", "labelled_cold"]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.columns = {column: array("d") for column in self.COLUMNS}
+
+    def append(self, **values) -> None:
+        for column in self.COLUMNS:
+            self.columns[column].append(values.get(column, float("nan")))
+
+    def __len__(self) -> int:
+        return len(self.columns["inference_time"])
+
+    def column(self, name: str) -> np.ndarray:
+        return np.frombuffer(self.columns[name], dtype=np.float64)
+
+
+def read_csv(path: Path, run: Run) -> None:
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        fields = set(reader.fieldnames or [])
+
+        if "s3_eventTime" in fields:  # aws.py
+            for row in reader:
+                event_time, handler_time = parse_time(row["s3_eventTime"]), parse_time(row["timestamp"])
+                run.append(
+                    inference_time=parse_float(row["inference_time"]),
+                    transfer_time=parse_float(row.get("transfer_time")),
+                    total_time=handler_time - event_time,
+                    event_time=event_time,
+                    handler_time=handler_time,
+                )
+        elif "transfertime" in fields:  # client.py
+            for row in reader:
+                run.append(inference_time=parse_float(row["inference_time"]), transfer_time=parse_float(row["transfertime"]), total_time=parse_float(row["transfertime"]))
+        elif "cold_start" in fields and "environment" in fields:  # local_lambda.py
+            for row in reader:
+                if row["status"] != "ok":
+                    continue
+                run.append(inference_time=parse_float(row["inference"]), total_time=parse_float(row["total"]), labelled_cold=float(row["cold_start"] == "True"))
+        else:
+            raise ValueError(f"unknown result format in {path}: {sorted(fields)}")
+
+
+def append_dynamodb_item(item: dict, run: Run) -> None:
+    detection = item.get("yolo_detection", {}).get("M", {})
+    event_time, handler_time = parse_time(item.get("s3_eventTime", {}).get("S", "")), parse_time(item.get("timestamp", {}).get("S", ""))
+    run.append(
+        inference_time=parse_float(detection.get("inference_time", {}).get("N")),
+        total_time=handler_time - event_time,
+        event_time=event_time,
+        handler_time=handler_time,
+        labelled_cold=float("cold_start" in item),  # the handler only attaches the breakdown on a cold start
+    )
+
+
+def read_dynamodb_export(path: Path, run: Run) -> None:
+    with open(path) as f:
+        first_line = f.readline()
+        f.seek(0)
+        if first_line.strip().startswith('{"Item"'):
+            for line in f:
+                if line.strip():
+                    append_dynamodb_item(json.loads(line)["Item"], run)
+        else:
+            for item in json.load(f)["Items"]:
+                append_dynamodb_item(item, run)
+
+
+def read_run(path: Path) -> Run:
+    run = Run(path.name)
+    if path.suffix == ".csv":
+        read_csv(path, run)
+    else:
+        read_dynamodb_export(path, run)
+    return run
+
+
+def bootstrap_ci(values: np.ndarray, statistic, confidence: float = 0.95, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    if len(values) > BOOTSTRAP_MAX_SIZE:
+        values = rng.choice(values, BOOTSTRAP_MAX_SIZE, replace=False)
+    estimates = [statistic(rng.choice(values, len(values), replace=True)) for _ in range(BOOTSTRAP_SAMPLES)]
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(estimates, alpha)), float(np.quantile(estimates, 1 - alpha))
+
+
+def summarize(values: np.ndarray) -> dict:
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None
+    summary = {"count": int(len(values)), "mean": float(values.mean()), "max": float(values.max())}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = float(np.percentile(values, p))
+        summary[f"p{p}_ci"] = bootstrap_ci(values, lambda sample: np.percentile(sample, p))
+    return summary
+
+
+def classify_cold_starts(run: Run) -> np.ndarray:
+    """
+    boolean mask of cold starts. uses the handler's own label if the file has one, otherwise the gap between the
+    S3 event and the handler's timestamp: a cold start adds the init phase to that gap, which makes it a robust outlier
+    """
+    labelled = run.column("labelled_cold")
+    if not np.isnan(labelled).all():
+        return labelled == 1.0
+
+    gaps = run.column("handler_time") - run.column("event_time")
+    if np.isnan(gaps).all():
+        return np.zeros(len(run), dtype=bool)
+    median = np.nanmedian(gaps)
+    mad = np.nanmedian(np.abs(gaps - median))
+    return gaps > median + COLD_START_MAD_FACTOR * max(mad, 1e-3)
+
+
+def throughput(run: Run, bucket_seconds: float) -> dict:
+    times = run.column("handler_time")
+    times = times[~np.isnan(times)]
+    if len(times) == 0:
+        return None
+    per_bucket = np.bincount(((times - times.min()) // bucket_seconds).astype(np.int64)) / bucket_seconds
+    return {"bucket_seconds": bucket_seconds, "duration": float(times.max() - times.min()), "mean": float(per_bucket.mean()), "peak": float(per_bucket.max()), "timeline": per_bucket.tolist()}
+
+
+def analyze(run: Run, bucket_seconds: float) -> dict:
+    cold = classify_cold_starts(run)
+    report = {"name": run.name, "rows": len(run), "cold_starts": int(cold.sum()), "metrics": {}, "warm_metrics": {}}
+    for metric in ["inference_time", "transfer_time", "total_time"]:
+        values = run.column(metric)
+        report["metrics"][metric] = summarize(values)
+        report["warm_metrics"][metric] = summarize(values[~cold]) if cold.any() else None
+    report["throughput"] = throughput(run, bucket_seconds)
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"\n**** {report['name']} ({report['rows']} rows, {report['cold_starts']} cold starts) ****")
+    print(f"{'metric':<22}{'count':>8}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   p99 95% CI")
+    for scope, metrics in [("", report["metrics"]), ("warm ", report["warm_metrics"])]:
+        for metric, s in metrics.items():
+            if s is None:
+                continue
+            ci = s["p99_ci"]
+            print(f"{scope + metric:<22}{s['count']:>8}{s['mean']:>9.4f}{s['p50']:>9.4f}{s['p90']:>9.4f}{s['p99']:>9.4f}{s['max']:>9.4f}   [{ci[0]:.4f}, {ci[1]:.4f}]")
+    if report["throughput"]:
+        t = report["throughput"]
+        print(f"throughput: {t['mean']:.2f}/s mean, {t['peak']:.2f}/s peak over {t['duration']:.1f}s ({t['bucket_seconds']}s buckets)")
+
+
+def print_comparison(baseline: dict, others: list) -> None:
+    """
+    a change counts as significant when the confidence intervals of baseline and candidate don't overlap
+    """
+    print(f"\n**** comparison against {baseline['name']} ****")
+    print(f"{'run':<28}{'metric':<18}{'stat':>5}{'baseline':>10}{'run':>10}{'change':>9}  significant")
+    for other in others:
+        for metric, b in baseline["metrics"].items():
+            o = other["metrics"].get(metric)
+            if b is None or o is None:
+                continue
+            for p in PERCENTILES:
+                change = (o[f"p{p}"] - b[f"p{p}"]) / b[f"p{p}"] * 100 if b[f"p{p}"] else float("nan")
+                (b_low, b_high), (o_low, o_high) = b[f"p{p}_ci"], o[f"p{p}_ci"]
+                significant = o_high < b_low or o_low > b_high
+                print(f"{other['name']:<28}{metric:<18}{'p' + str(p):>5}{b[f'p{p}']:>10.4f}{o[f'p{p}']:>10.4f}{change:>+8.1f}%  {'yes' if significant else 'no'}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark results analytics")
+    parser.add_argument("result_files", nargs="+", type=str, help="Result files, the first one is the baseline")
+    parser.add_argument("--bucket-seconds", type=float, default=1.0, help="Bucket width for the throughput timeline")
+    parser.add_argument("--json", type=str, default=None, help="Write the full report (including timelines) to this file")
+    args = parser.parse_args()
+
+    for result_file in args.result_files:
+        if not Path(result_file).is_file():
+            parser.error(f"result file not found: {result_file}")
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    reports = [analyze(read_run(Path(result_file)), args.bucket_seconds) for result_file in args.result_files]
+    for report in reports:
+        print_report(report)
+    if len(reports) > 1:
+        print_comparison(reports[0], reports[1:])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nreport written to {args.json}")
@@ -0,0 +1,89 @@
+"""
+Pure inference throughput over a dataset cache (see src/local/dataset_cache.py).
+
+Every process opens the same memory-mapped cache, so the blobs are read from disk at most once and shared through the
+page cache, and neither jpeg decoding nor resizing is part of the measurement. `--compare-decode` runs the full
+`detect_objects` path from the original files as well, to show what decoding adds.
+
+$ python3 ./src/local/dataset_cache.py ./data/input_folder /tmp/coco
+$ python3 ./src/bench/cached_inference.py /tmp/coco --processes 1 2 4 --threads 1
+"""
+
+import argparse
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+from dataset_cache import DatasetCache  # noqa: E402
+from object_detection import ObjectDetection  # noqa: E402
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Inference throughput over a memory-mapped dataset cache")
+    parser.add_argument("prefix", type=str, help="Cache path without extension")
+    parser.add_argument("--processes", nargs="+", type=int, default=[1], help="Process counts to compare")
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads per process")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the cache per process")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Confidence threshold")
+    parser.add_argument("--compare-decode", action="store_true", help="Also run detect_objects on the original files")
+    return parser.parse_args()
+
+
+def run_worker(prefix: str, threads: int, repeat: int, confidence: float, decode: bool, start, results) -> None:
+    cv2.setNumThreads(threads)
+    cache = DatasetCache(prefix)
+    detector = ObjectDetection()
+    files = [Path(cache.path(i)).read_bytes() for i in range(len(cache))] if decode else None
+
+    # warm-up, also pulls the cache into the page cache if another process didn't already
+    detector.detect_preprocessed(cache.blob(0), *cache.size(0), confidence)
+    start.wait()
+
+    latencies = []
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for i in range(len(cache)):
+            image_start_time = time.perf_counter()
+            if decode:
+                detector.detect_objects(files[i], confidence)
+            else:
+                detector.detect_preprocessed(cache.blob(i), *cache.size(i), confidence)
+            latencies.append(time.perf_counter() - image_start_time)
+    results.put((time.perf_counter() - start_time, latencies))
+
+
+def run_level(args, processes: int, decode: bool) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    start, results = ctx.Barrier(processes + 1), ctx.Queue()
+    workers = [ctx.Process(target=run_worker, args=(args.prefix, args.threads, args.repeat, args.confidence, decode, start, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    start.wait()  # all models are loaded, start the clock together
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    wall_time = max(seconds for seconds, _ in outcomes)
+    latencies = np.array([latency for _, worker_latencies in outcomes for latency in worker_latencies])
+    return {"images": len(latencies), "images_per_second": len(latencies) / wall_time, "p50": float(np.percentile(latencies, 50)), "p99": float(np.percentile(latencies, 99))}
+
+
+if __name__ == "__main__":
+    args = get_args()
+    cache = DatasetCache(args.prefix)
+    stale = cache.stale()
+    if stale:
+        print(f"warning: {len(stale)} images changed since the cache was built, e.g. {stale[0]}")
+    print(f"{len(cache)} cached images, {args.threads} cv2 threads per process, {args.repeat} passes")
+
+    modes = ["cached", "decode"] if args.compare_decode else ["cached"]
+    print(f"{'mode':<8}{'processes':>10}{'images':>8}{'images/s':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for mode in modes:
+        for processes in args.processes:
+            r = run_level(args, processes, mode == "decode")
+            print(f"{mode:<8}{processes:>10}{r['images']:>8}{r['images_per_second']:>10.2f}{r['p50'] * 1000:>9.2f}{r['p99'] * 1000:>9.2f}")
@@ -0,0 +1,88 @@
+"""
+HTTP load generator to compare serving modes of the detection API.
+
+Sends the sample images to every endpoint with a fixed number of concurrent clients (each with its own keep-alive session)
+and reports requests/s and latency percentiles per concurrency level.
+
+$ python3 ./src/local/server.py &                                  # flask, port 5000
+$ python3 ./src/local/asgi_server.py --port 8000 --threads 4 &     # asgi, port 8000
+$ python3 ./src/bench/http_load.py ./data/input_folder http://127.0.0.1:5000/api http://127.0.0.1:8000/api --concurrency 1 16 128
+"""
+
+import argparse
+import base64
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Load test the detection API")
+    parser.add_argument("input_folder", type=str, help="Path to the sample images")
+    parser.add_argument("endpoints", nargs="+", type=str, help="API endpoints to compare, e.g. http://127.0.0.1:5000/api")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16, 128], help="Concurrent clients per run")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per run")
+    parser.add_argument("--raw", action="store_true", help="Send raw image bytes instead of base64 JSON (asgi_server only)")
+    args = parser.parse_args()
+
+    if not Path(args.input_folder).is_dir():
+        parser.error("Invalid input folder")
+    return args
+
+
+def load_images(input_folder: str) -> list:
+    return [p.read_bytes() for p in sorted(Path(input_folder).iterdir()) if p.suffix in (".jpg", ".jpeg", ".png")]
+
+
+def run_client(endpoint: str, images: list, deadline: float, raw: bool, offset: int) -> tuple:
+    session = requests.Session()
+    latencies, errors = [], 0
+    i = offset
+    while time.time() < deadline:
+        image_data = images[i % len(images)]
+        image_id = str(uuid.uuid4())
+        start_time = time.perf_counter()
+        try:
+            if raw:
+                response = session.post(f"{endpoint}/object_detection", data=image_data, headers={"Content-Type": "image/jpeg", "X-Image-Id": image_id})
+            else:
+                response = session.post(f"{endpoint}/object_detection", json={"id": image_id, "image_data": base64.b64encode(image_data).decode("utf-8")})
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start_time)
+        else:
+            errors += 1
+        i += 1
+    return latencies, errors
+
+
+def run_level(endpoint: str, images: list, concurrency: int, duration: float, raw: bool) -> dict:
+    deadline = time.time() + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_client, endpoint, images, deadline, raw, i) for i in range(concurrency)]
+        results = [future.result() for future in futures]
+
+    latencies = np.array([latency for client_latencies, _ in results for latency in client_latencies])
+    errors = sum(client_errors for _, client_errors in results)
+    if len(latencies) == 0:
+        return {"requests": 0, "errors": errors, "rps": 0.0, "p50": float("nan"), "p99": float("nan")}
+    return {"requests": len(latencies), "errors": errors, "rps": len(latencies) / duration, "p50": float(np.percentile(latencies, 50)), "p99": float(np.percentile(latencies, 99))}
+
+
+if __name__ == "__main__":
+    args = get_args()
+    images = load_images(args.input_folder)
+    threading.stack_size(256 * 1024)  # 128 client threads don't need the default stack each
+
+    print(f"{'endpoint':<34}{'clients':>8}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 s':>9}{'p99 s':>9}")
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            r = run_level(endpoint, images, concurrency, args.duration, args.raw)
+            print(f"{endpoint:<34}{concurrency:>8}{r['requests']:>10}{r['errors']:>8}{r['rps']:>9.2f}{r['p50']:>9.4f}{r['p99']:>9.4f}")
@@ -0,0 +1,104 @@
+"""
+Effective FPS gain and detection drift of keyframe detection (see src/local/tracking.py) on a recorded sequence.
+
+The reference runs full inference on every frame. Every keyframe setting is compared against it frame by frame:
+tracked boxes are matched to the reference detections (same label, IoU >= 0.5). Recall and precision count the
+reference objects that were found and the tracked boxes that are right, and the mean IoU of the matches shows how far
+carried boxes drift, broken down by the number of frames since the last keyframe.
+
+Frames are decoded up front, so only the pipeline is timed.
+
+$ python3 ./src/bench/keyframes.py ./data/sequence.mp4 --every 2 5 10 --diff-threshold 12
+$ python3 ./src/bench/keyframes.py ./data/sequence_frames/ --every 5    # a folder of frames, sorted by name
+"""
+
+import argparse
+import itertools
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from colorama import Fore, Style
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+from object_detection import ObjectDetection  # noqa: E402
+from tracking import KeyframeDetector, iou, match, read_frames  # noqa: E402
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Keyframe detection FPS gain and drift against running every frame")
+    parser.add_argument("sequence", type=str, help="Video file or folder of frames")
+    parser.add_argument("--every", nargs="+", type=int, default=[2, 5, 10], help="Keyframe intervals to compare")
+    parser.add_argument("--diff-threshold", type=float, default=None, help="Also force a keyframe when the frame difference exceeds this (0-255)")
+    parser.add_argument("--frames", type=int, default=300, help="Maximum number of frames")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Confidence threshold")
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads for the run")
+    args = parser.parse_args()
+
+    if not Path(args.sequence).exists():
+        parser.error("Sequence not found")
+    return args
+
+
+def load_frames(sequence: str, limit: int) -> list:
+    return list(itertools.islice(read_frames(sequence), limit))
+
+
+def run_reference(detector: ObjectDetection, frames: list, confidence: float) -> tuple:
+    start_time = time.perf_counter()
+    detections = [detector.detect_frame(frame, confidence)[0] for frame in frames]
+    return detections, time.perf_counter() - start_time
+
+
+def run_keyframes(detector: ObjectDetection, frames: list, every: int, diff_threshold: float, confidence: float) -> tuple:
+    pipeline = KeyframeDetector(detector, every, diff_threshold, confidence)
+    start_time = time.perf_counter()
+    outputs = [pipeline.process(frame) for frame in frames]
+    return outputs, time.perf_counter() - start_time, pipeline.stats
+
+
+def drift(reference: list, outputs: list) -> dict:
+    matched, reference_count, tracked_count = 0, 0, 0
+    ious_by_age = {}
+    age = 0
+    for expected, (actual, keyframe) in zip(reference, outputs):
+        age = 0 if keyframe else age + 1
+        pairs = match([obj["box"] for obj in expected], [obj["label"] for obj in expected], [obj["box"] for obj in actual], [obj["label"] for obj in actual], 0.5)
+        matched += len(pairs)
+        reference_count += len(expected)
+        tracked_count += len(actual)
+        ious_by_age.setdefault(age, []).extend(iou(expected[i]["box"], actual[j]["box"]) for i, j in pairs)
+
+    all_ious = [value for values in ious_by_age.values() for value in values]
+    return {
+        "recall": matched / reference_count if reference_count else float("nan"),
+        "precision": matched / tracked_count if tracked_count else float("nan"),
+        "mean_iou": float(np.mean(all_ious)) if all_ious else float("nan"),
+        "iou_by_age": {age: float(np.mean(values)) for age, values in sorted(ious_by_age.items()) if values},
+    }
+
+
+if __name__ == "__main__":
+    args = get_args()
+    cv2.setNumThreads(args.threads)
+    frames = load_frames(args.sequence, args.frames)
+    assert frames, f"no frames in {args.sequence}"
+
+    detector = ObjectDetection()
+    detector.detect_frame(frames[0], args.confidence)  # warm-up
+
+    reference, reference_time = run_reference(detector, frames, args.confidence)
+    reference_fps = len(frames) / reference_time
+    print(f"{len(frames)} frames, {sum(len(objects) for objects in reference)} reference detections, every frame: {reference_fps:.2f} fps")
+
+    print(f"{'every':>6}{'keyframes':>10}{'by diff':>8}{'fps':>8}{'gain':>7}{'recall':>8}{'precision':>10}{'mean iou':>9}")
+    for every in args.every:
+        outputs, elapsed, stats = run_keyframes(detector, frames, every, args.diff_threshold, args.confidence)
+        fps = len(frames) / elapsed
+        result = drift(reference, outputs)
+        color = Fore.GREEN if not result["recall"] < 0.9 else Fore.YELLOW
+        print(f"{color}{every:>6}{stats['keyframes']:>10}{stats['forced_by_diff']:>8}{fps:>8.2f}{fps / reference_fps:>6.2f}x{result['recall']:>8.3f}{result['precision']:>10.3f}{result['mean_iou']:>9.3f}{Style.RESET_ALL}")
+        if result["iou_by_age"]:
+            print("       mean iou by frames since keyframe: " + ", ".join(f"{age}: {value:.3f}" for age, value in result["iou_by_age"].items()))
@@ -0,0 +1,105 @@
+"""
+Ingest rate and query latency of the result store at millions of rows.
+
+Appends synthetic results (labels from coco.names, 0-5 detections per image, confidences uniform in [0.3, 1)) through
+the same batched writer the servers use, then times first pages, deep pages (keyset cursors make them as cheap as the
+first) and full NDJSON-style streams of typical queries.
+
+$ python3 ./src/bench/result_store_bench.py --rows 2000000 --store /tmp/results.sqlite
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from colorama import Fore, Style
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+
+from result_store import ResultStore  # noqa: E402
+
+LABELS_PATH = Path(__file__).resolve().parent.parent.parent / "yolo_tiny_configs" / "coco.names"
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the result store")
+    parser.add_argument("--store", type=str, default="./results_bench.sqlite", help="SQLite file, rows are added to an existing store")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Results to ingest before querying")
+    parser.add_argument("--repeat", type=int, default=50, help="Repetitions per query")
+    parser.add_argument("--batch-size", type=int, default=512, help="Results per commit")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    return parser.parse_args()
+
+
+def load_labels() -> list:
+    if LABELS_PATH.exists():
+        return [line.strip() for line in LABELS_PATH.read_text().splitlines() if line.strip()]
+    return ["person", "car", "dog", "cat", "bicycle"]
+
+
+def ingest(store: ResultStore, rows: int, labels: list, seed: int) -> float:
+    rng = random.Random(seed)
+    weights = [20 if label == "person" else 1 for label in labels]  # people dominate real photos
+    start_time = time.perf_counter()
+    for i in range(rows):
+        objects = [{"label": label, "accuracy": rng.uniform(0.3, 1.0)} for label in rng.choices(labels, weights, k=rng.randint(0, 5))]
+        store.append(f"image-{seed}-{i}", objects, rng.uniform(0.01, 0.1), block=True)
+        if i % 100_000 == 0 and i > 0:
+            print(f"\r{i:,} results appended", end="", flush=True)
+    append_time = time.perf_counter() - start_time
+    store.flush()
+    total_time = time.perf_counter() - start_time
+    print(f"\r{rows:,} results appended in {append_time:.1f}s, committed after {total_time:.1f}s")
+    return rows / total_time
+
+
+def time_query(store: ResultStore, repeat: int, cursor: int = 0, **filters) -> tuple:
+    latencies = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        page, _ = store.query(cursor=cursor, limit=100, **filters)
+        latencies.append(time.perf_counter() - start_time)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99)), len(page)
+
+
+def time_stream(store: ResultStore, **filters) -> tuple:
+    start_time = time.perf_counter()
+    count = sum(len(json.dumps(result)) > 0 for result in store.stream(**filters))
+    return time.perf_counter() - start_time, count
+
+
+if __name__ == "__main__":
+    args = get_args()
+    labels = load_labels()
+    store = ResultStore(args.store, batch_size=args.batch_size)
+
+    rate = ingest(store, args.rows, labels, args.seed)
+    print(f"{Fore.GREEN}ingest: {rate:,.0f} results/s{Style.RESET_ALL}")
+
+    with store.connect() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        since = conn.execute("SELECT ingested_at FROM results ORDER BY id DESC LIMIT 1 OFFSET ?", (min(total - 1, 10_000),)).fetchone()[0]
+    deep_cursor = total // 2
+
+    queries = {
+        "person >= 0.8": {"label": "person", "min_confidence": 0.8},
+        "toothbrush >= 0.8": {"label": labels[-1], "min_confidence": 0.8},
+        "any >= 0.99": {"min_confidence": 0.99},
+        "last 10k ingested": {"since": since},
+    }
+
+    print(f"\nstore holds {total:,} results")
+    print(f"{'query':<22}{'page':>8}{'p50 ms':>10}{'p99 ms':>10}{'rows':>6}")
+    for name, filters in queries.items():
+        for page_name, cursor in (("first", 0), ("middle", deep_cursor)):
+            p50, p99, count = time_query(store, args.repeat, cursor, **filters)
+            print(f"{name:<22}{page_name:>8}{p50 * 1000:>10.2f}{p99 * 1000:>10.2f}{count:>6}")
+
+    print(f"\n{'stream':<22}{'seconds':>10}{'results':>12}{'results/s':>12}")
+    for name in ("toothbrush >= 0.8", "last 10k ingested"):
+        seconds, count = time_stream(store, **queries[name])
+        print(f"{name:<22}{seconds:>10.2f}{count:>12,}{count / seconds:>12,.0f}")
@@ -0,0 +1,192 @@
+"""
+Stage-level microbenchmark of `ObjectDetection.detect_objects` with regression gates.
+
+Every stage (base64 decode, imdecode, blobFromImage, forward, output parsing, NMS, annotation, encoding) is timed
+in isolation over the sample images, after a warm-up and with a pinned OpenCV thread count. The reused-buffer
+variants that `detect_objects` runs (`*_into`) are timed next to the reference stages and must give exactly their
+results (blob, net outputs and parsed boxes).
+The results can be stored as a JSON baseline, later runs fail if a stage got slower than the baseline plus a tolerance.
+The detections of `detect_objects` are checked against a golden file, so a speedup can't silently change the output.
+
+$ python3 ./src/bench/stages.py ./data/input_folder --save-baseline --save-golden  # record
+$ python3 ./src/bench/stages.py ./data/input_folder                                # exits with 1 on a regression
+"""
+
+import argparse
+import base64
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+from object_detection import ObjectDetection
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+MIN_REGRESSION_SECONDS = 50e-6  # sub-millisecond stages are noisy, smaller absolute slowdowns never fail the gate
+STAGES = ["b64decode", "imdecode", "blob", "blob_into", "forward", "forward_into", "parse_outputs", "parse_outputs_into", "nms", "annotate", "encode"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Stage-level microbenchmark of the detection pipeline")
+    parser.add_argument("input_folder", type=str, help="Path to the sample images")
+    parser.add_argument("--images", type=int, default=20, help="Number of images to benchmark")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed runs per stage and image")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per stage and image")
+    parser.add_argument("--threads", type=int, default=1, help="cv2.setNumThreads for the run")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Confidence threshold")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown per stage relative to the baseline")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_DIR / "stages.json"), help="Baseline file")
+    parser.add_argument("--golden", type=str, default=str(BASELINE_DIR / "golden_detections.json"), help="Golden detections file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--save-golden", action="store_true", help="Store the detections as the new golden output")
+    args = parser.parse_args()
+
+    if not Path(args.input_folder).is_dir():
+        parser.error("Invalid input folder")
+    return args
+
+
+def time_stage(fn, warmup: int, repeat: int, setup=None) -> list:
+    """
+    returns the durations of `repeat` calls of `fn`, `setup` runs untimed before every call and its result is passed to `fn`
+    """
+    durations = []
+    for i in range(warmup + repeat):
+        arg = setup() if setup else None
+        start_time = time.perf_counter()
+        fn(arg)
+        if i >= warmup:
+            durations.append(time.perf_counter() - start_time)
+    return durations
+
+
+def benchmark_image(detector: ObjectDetection, image_data: bytes, args) -> tuple:
+    encoded = base64.b64encode(image_data).decode("utf-8")
+
+    # run the pipeline once to get the intermediate results every stage starts from
+    img = detector.decode(image_data)
+    height, width, _ = img.shape
+    blob = detector.preprocess(img)
+    outs = [out.copy() for out in detector.forward(blob)]
+    boxes, confidences, class_ids = detector.parse_outputs(outs, width, height, args.confidence)
+    indexes = detector.suppress(boxes, confidences, args.confidence)
+
+    # the reused-buffer stages of `detect_objects` must be bit-identical to the reference stages
+    blob_into = detector.preprocess_into(img)
+    detector.forward_into(blob_into)  # the first pass allocates the output buffers
+    outs_into = detector.forward_into(blob_into)
+    mismatches = []
+    if not np.array_equal(blob_into, blob):
+        mismatches.append("preprocess_into: blob differs from preprocess")
+    if not all(np.array_equal(a, b, equal_nan=True) for a, b in zip(outs_into, outs)):
+        mismatches.append("forward_into: outputs differ from forward")
+    if detector.parse_outputs_into(outs_into, width, height, args.confidence) != (boxes, confidences, class_ids):
+        mismatches.append("parse_outputs_into: boxes differ from parse_outputs")
+
+    w, r = args.warmup, args.repeat
+    timings = {
+        "b64decode": time_stage(lambda _: base64.b64decode(encoded), w, r),
+        "imdecode": time_stage(lambda _: detector.decode(image_data), w, r),
+        "blob": time_stage(lambda _: detector.preprocess(img), w, r),
+        "blob_into": time_stage(lambda _: detector.preprocess_into(img), w, r),
+        "forward": time_stage(lambda _: detector.forward(blob), w, r),
+        "forward_into": time_stage(lambda _: detector.forward_into(blob_into), w, r),
+        "parse_outputs": time_stage(lambda _: detector.parse_outputs(outs, width, height, args.confidence), w, r),
+        "parse_outputs_into": time_stage(lambda _: detector.parse_outputs_into(outs_into, width, height, args.confidence), w, r),
+        "nms": time_stage(lambda _: detector.suppress(boxes, confidences, args.confidence), w, r),
+        "annotate": time_stage(lambda copy: detector.annotate(copy, boxes, confidences, class_ids, indexes, args.confidence), w, r, setup=img.copy),
+        "encode": time_stage(lambda _: detector.encode(img), w, r),
+    }
+
+    # the golden output is what the servers return
+    detected_objects, _, _ = detector.detect_objects(image_data, args.confidence)
+    detections = [{"label": obj["label"], "confidence": round(obj["accuracy"], 4), "box": obj["box"]} for obj in detected_objects]
+    return timings, detections, mismatches
+
+
+def summarize(timings: dict) -> dict:
+    summary = {}
+    for stage in STAGES:
+        values = sorted(timings[stage])
+        summary[stage] = {"median": statistics.median(values), "p90": values[int(0.9 * (len(values) - 1))], "runs": len(values)}
+    return summary
+
+
+def check_regressions(summary: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for stage, stats in summary.items():
+        if stage not in baseline["stages"]:
+            continue
+        allowed = max(baseline["stages"][stage]["median"] * (1 + tolerance), baseline["stages"][stage]["median"] + MIN_REGRESSION_SECONDS)
+        if stats["median"] > allowed:
+            regressions.append(f"{stage}: median {stats['median'] * 1000:.3f}ms > {allowed * 1000:.3f}ms (baseline {baseline['stages'][stage]['median'] * 1000:.3f}ms, tolerance {tolerance:.0%})")
+    return regressions
+
+
+def check_golden(detections: dict, golden: dict) -> list:
+    mismatches = []
+    for image_name, expected in golden.items():
+        if image_name not in detections:
+            continue
+        actual = detections[image_name]
+        same = len(actual) == len(expected) and all(
+            a["label"] == e["label"] and a["box"] == e["box"] and abs(a["confidence"] - e["confidence"]) <= 1e-3 for a, e in zip(actual, expected)
+        )
+        if not same:
+            mismatches.append(f"{image_name}: expected {expected}, got {actual}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    args = get_args()
+    cv2.setNumThreads(args.threads)
+
+    detector = ObjectDetection()
+    image_paths = sorted(p for p in Path(args.input_folder).iterdir() if p.suffix in (".jpg", ".jpeg", ".png"))[: args.images]
+
+    timings = {stage: [] for stage in STAGES}
+    detections = {}
+    failures = []
+    for image_path in image_paths:
+        image_timings, detections[image_path.name], mismatches = benchmark_image(detector, image_path.read_bytes(), args)
+        failures += [f"{image_path.name}: {mismatch}" for mismatch in mismatches]
+        for stage in STAGES:
+            timings[stage].extend(image_timings[stage])
+
+    summary = summarize(timings)
+    config = {"threads": args.threads, "images": len(image_paths), "repeat": args.repeat, "warmup": args.warmup, "opencv": cv2.__version__, "machine": platform.processor() or platform.machine()}
+
+    print(f"{'stage':<16}{'median ms':>12}{'p90 ms':>10}")
+    for stage, stats in summary.items():
+        print(f"{stage:<16}{stats['median'] * 1000:>12.3f}{stats['p90'] * 1000:>10.3f}")
+
+    baseline_path, golden_path = Path(args.baseline), Path(args.golden)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps({"config": config, "stages": summary}, indent=2))
+        print(f"baseline written to {baseline_path}")
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        if baseline["config"]["threads"] != config["threads"]:
+            print(f"warning: baseline was recorded with {baseline['config']['threads']} threads, this run uses {config['threads']}")
+        failures += check_regressions(summary, baseline, args.tolerance)
+
+    if args.save_golden:
+        golden_path.parent.mkdir(parents=True, exist_ok=True)
+        golden_path.write_text(json.dumps(detections, indent=2))
+        print(f"golden detections written to {golden_path}")
+    elif golden_path.exists():
+        failures += check_golden(detections, json.loads(golden_path.read_text()))
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"\t{failure}")
+        sys.exit(1)
+    print("\nno regressions")
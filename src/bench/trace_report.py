@@ -0,0 +1,116 @@
+"""
+Reconstructs per-image timelines from trace files and shows where the end-to-end time goes.
+
+Reads the JSON lines written by `client.py` (`local_traces.jsonl`), `aws.py` (`aws_traces.jsonl`) and `local_lambda.py`
+(`local_lambda_traces.jsonl`): one trace per image with its spans, e.g. for the cloud path
+
+    upload -> s3_event -> handler_start -> model_init -> s3_fetch -> preprocess -> forward -> postprocess -> dynamodb_write
+
+End-to-end is the first span start to the last span end (the result is persisted at the end of `dynamodb_write`).
+The DynamoDB item can't hold the duration of its own write, so traces read from the table (`aws.py`) end at the
+`write_start` point, the handler's response and log (and so `local_lambda.py`) have the whole `dynamodb_write` span.
+Spans that contain other spans (e.g. the client's `request` around the server spans) aren't counted twice: the time
+between the innermost spans is reported as a gap named after its neighbours, e.g. `upload -> handler_start` is the S3
+notification plus the lambda dispatch, and the gaps around the server spans inside the client's `request` are network
+and serialization.
+Spans of different hosts are compared by wall clock, so clock skew shows up in the gaps between hosts.
+
+$ python3 ./src/bench/trace_report.py aws_traces.jsonl local_traces.jsonl --timelines 3
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+from colorama import Fore, Style
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Per-image timelines and time breakdown from trace files")
+    parser.add_argument("traces", nargs="+", type=str, help="Trace files (JSON lines)")
+    parser.add_argument("--timelines", type=int, default=1, help="Number of per-image timelines to print per file")
+    args = parser.parse_args()
+
+    for path in args.traces:
+        if not Path(path).exists():
+            parser.error(f"trace file not found: {path}")
+    return args
+
+
+def load(path: str) -> list:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def end(span: dict) -> float:
+    return span["start"] + span["duration"]
+
+
+def innermost(spans: list) -> list:
+    """
+    spans that don't contain another span with a duration, points (duration 0) are always kept
+    """
+    return [
+        span
+        for span in spans
+        if span["duration"] == 0 or not any(other is not span and other["duration"] > 0 and span["start"] <= other["start"] and end(other) <= end(span) for other in spans)
+    ]
+
+
+def breakdown(trace: dict) -> dict:
+    """
+    seconds per span name and per gap between consecutive innermost spans, plus the end-to-end time
+    """
+    spans = sorted(trace["spans"], key=lambda span: span["start"])
+    parts = {"end_to_end": max(end(span) for span in spans) - spans[0]["start"]}
+    for span in spans:
+        if span["duration"] > 0:
+            parts[span["name"]] = parts.get(span["name"], 0.0) + span["duration"]
+
+    latest = None
+    for span in innermost(spans):
+        if latest is not None and span["start"] > end(latest):
+            name = f"{latest['name']} -> {span['name']}"
+            parts[name] = parts.get(name, 0.0) + span["start"] - end(latest)
+        if latest is None or end(span) >= end(latest):
+            latest = span
+    # e.g. sending the response back, inside the client's `request` but after the last server span
+    last_end = max(end(span) for span in spans)
+    if last_end > end(latest):
+        parts[f"{latest['name']} -> end"] = last_end - end(latest)
+    return parts
+
+
+def print_timeline(trace: dict) -> None:
+    spans = sorted(trace["spans"], key=lambda span: span["start"])
+    origin = spans[0]["start"]
+    print(f"\t{Style.DIM}{trace['trace_id']}  {trace.get('image', '')}{Style.RESET_ALL}")
+    for span in spans:
+        duration = f"{span['duration'] * 1000:>9.2f}ms" if span["duration"] > 0 else f"{'':>11}"
+        print(f"\t{(span['start'] - origin) * 1000:>10.2f}ms  {span['name']:<16}{duration}")
+
+
+def print_summary(traces: list) -> None:
+    parts = [breakdown(trace) for trace in traces]
+    names = sorted({name for part in parts for name in part if name != "end_to_end"}, key=lambda name: -np.mean([part.get(name, 0.0) for part in parts]))
+    end_to_end = np.array([part["end_to_end"] for part in parts])
+    print(f"\t{'':<34}{'traces':>7}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'share':>8}")
+    print(f"\t{'end to end':<34}{len(parts):>7}{end_to_end.mean() * 1000:>10.2f}{np.percentile(end_to_end, 50) * 1000:>10.2f}{np.percentile(end_to_end, 99) * 1000:>10.2f}")
+    for name in names:
+        values = np.array([part[name] for part in parts if name in part])
+        share = values.sum() / end_to_end.sum()
+        color = Fore.YELLOW if share >= 0.25 else ""
+        print(f"\t{color}{name:<34}{len(values):>7}{values.mean() * 1000:>10.2f}{np.percentile(values, 50) * 1000:>10.2f}{np.percentile(values, 99) * 1000:>10.2f}{share:>8.1%}{Style.RESET_ALL}")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    for path in args.traces:
+        traces = [trace for trace in load(path) if trace.get("spans")]
+        print(f"{Fore.GREEN}{path}: {len(traces)} traces{Style.RESET_ALL}")
+        if not traces:
+            continue
+        for trace in traces[: args.timelines]:
+            print_timeline(trace)
+        print_summary(traces)
@@ -0,0 +1,189 @@
+"""
+Finds the thread and worker settings with the best throughput on this machine and writes them for the servers.
+
+Sweeps cv2.setNumThreads x detector instances x batch size x cpu pinning over the sample images, every configuration
+in a fresh process (OpenCV's thread pool is process wide). Every instance runs forward passes on its own thread for
+`--duration` seconds like an admission worker under full load. The latency of an image is the duration of the forward
+pass of its batch, so large batches have to stay under the p99 target too.
+
+Pinning is only tried with one thread per instance, OpenCV's thread pool is shared by all instances of a process and
+would stay on the cpus of the first instance that ran a forward pass (see src/local/tuning.py).
+
+The best configuration that meets `--p99` is written to detection_config.json (see src/local/tuning.py), which
+server.py and asgi_server.py read at startup.
+
+$ python3 ./src/bench/tune.py ./data/input_folder --p99 0.5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import psutil
+from colorama import Fore, Style
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "local"))
+from object_detection import ObjectDetection  # noqa: E402
+from tuning import can_pin, config_path, core_groups, pin_current_thread, plan_affinity  # noqa: E402
+
+STARTUP_MARGIN = 60.0  # seconds a measurement may take on top of `--duration` (loading the nets, warm-up)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Sweep thread and worker settings and write the best one for the servers")
+    parser.add_argument("input_folder", type=str, help="Path to the sample images")
+    parser.add_argument("--p99", type=float, default=1.0, help="p99 latency target in seconds")
+    parser.add_argument("--threads", nargs="+", type=int, default=None, help="cv2 thread counts, defaults to powers of two up to the cpu count and the physical core count")
+    parser.add_argument("--instances", nargs="+", type=int, default=None, help="Detector instance counts, same default as --threads")
+    parser.add_argument("--batches", nargs="+", type=int, default=[1, 2, 4], help="Batch sizes")
+    parser.add_argument("--no-affinity", action="store_true", help="Don't try pinning single threaded instances to cores")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per configuration")
+    parser.add_argument("--images", type=int, default=16, help="Number of sample images")
+    parser.add_argument("--output", type=str, default=str(config_path()), help="Config file to write")
+    args = parser.parse_args()
+
+    if not Path(args.input_folder).is_dir():
+        parser.error("Invalid input folder")
+    return args
+
+
+def default_counts(logical: int, physical: int) -> list:
+    counts = {physical, logical}
+    count = 1
+    while count < logical:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def sweep(args) -> list:
+    logical = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    physical = len(core_groups())
+    pinning = [False, True] if not args.no_affinity and hasattr(os, "sched_setaffinity") and logical > 1 else [False]
+
+    configs = []
+    for threads in args.threads or default_counts(logical, physical):
+        for instances in args.instances or default_counts(logical, physical):
+            if threads * instances > logical:
+                continue  # oversubscribed, the threads would only take turns
+            for batch in args.batches:
+                for pinned in pinning if can_pin(threads) else [False]:
+                    configs.append({"threads": threads, "instances": instances, "batch": batch, "affinity": plan_affinity(instances, threads) if pinned else None})
+    return configs
+
+
+def run_instance(detector: ObjectDetection, blobs: list, cpus: list, start: threading.Barrier, deadline: list, latencies: list) -> None:
+    pin_current_thread(cpus)
+    detector.forward(blobs[0])  # warm-up
+    start.wait()
+    i = 0
+    while time.perf_counter() < deadline[0]:
+        blob = blobs[i % len(blobs)]
+        start_time = time.perf_counter()
+        detector.forward(blob)
+        latencies.append((time.perf_counter() - start_time, len(blob)))
+        i += 1
+
+
+def measure(config: dict, input_folder: str, images: int, duration: float, results) -> None:
+    """
+    runs in a fresh process per configuration
+    """
+    cv2.setNumThreads(config["threads"])
+    paths = sorted(p for p in Path(input_folder).iterdir() if p.suffix in (".jpg", ".jpeg", ".png"))[:images]
+    single = [ObjectDetection.preprocess(ObjectDetection.decode(p.read_bytes())) for p in paths]
+    batch = config["batch"]
+    blobs = [np.concatenate([single[(i + j) % len(single)] for j in range(batch)]) for i in range(0, len(single), batch)]
+
+    detectors = [ObjectDetection() for _ in range(config["instances"])]
+    start = threading.Barrier(len(detectors) + 1)
+    deadline = [float("inf")]
+    latencies = [[] for _ in detectors]
+    threads = [
+        threading.Thread(target=run_instance, args=(detector, blobs, config["affinity"][i] if config["affinity"] else None, start, deadline, latencies[i]))
+        for i, detector in enumerate(detectors)
+    ]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    start_time = time.perf_counter()
+    deadline[0] = start_time + duration
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    # every image of a batch waits for the whole batch
+    per_image = np.array([latency for instance in latencies for latency, size in instance for _ in range(size)])
+    processed = len(per_image)
+    results.put({"images_per_second": processed / elapsed, "p50": float(np.percentile(per_image, 50)), "p99": float(np.percentile(per_image, 99)), "images": processed})
+
+
+def run_config(config: dict, args) -> dict:
+    """
+    returns the measurement, or `{"error": ...}` if the process died or didn't finish in time
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=measure, args=(config, args.input_folder, args.images, args.duration, results))
+    process.start()
+    deadline = time.monotonic() + args.duration + STARTUP_MARGIN
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    result = results.get(timeout=1)  # it may have put its result right before exiting
+                except queue.Empty:
+                    result = {"error": f"exited with code {process.exitcode}"}
+            elif time.monotonic() > deadline:
+                process.kill()
+                result = {"error": f"no result after {args.duration + STARTUP_MARGIN:.0f}s"}
+    process.join()
+    if "error" not in result and process.exitcode != 0:
+        result = {"error": f"exited with code {process.exitcode}"}
+    return result
+
+
+if __name__ == "__main__":
+    args = get_args()
+    configs = sweep(args)
+    print(f"{len(configs)} configurations, {args.duration:.0f}s each, p99 target {args.p99}s")
+    print(f"{'threads':>8}{'instances':>10}{'batch':>6}{'pinned':>7}{'images/s':>10}{'p50 s':>8}{'p99 s':>8}")
+
+    measured = []
+    for config in configs:
+        result = run_config(config, args)
+        if "error" in result:
+            print(f"{Fore.RED}{config['threads']:>8}{config['instances']:>10}{config['batch']:>6}{'yes' if config['affinity'] else 'no':>7}  failed: {result['error']}{Style.RESET_ALL}")
+            continue
+        measured.append((config, result))
+        color = Fore.GREEN if result["p99"] <= args.p99 else Fore.RED
+        print(f"{color}{config['threads']:>8}{config['instances']:>10}{config['batch']:>6}{'yes' if config['affinity'] else 'no':>7}{result['images_per_second']:>10.2f}{result['p50']:>8.3f}{result['p99']:>8.3f}{Style.RESET_ALL}")
+
+    eligible = [(config, result) for config, result in measured if result["p99"] <= args.p99]
+    if not eligible:
+        print(f"{Fore.RED}no configuration meets the p99 target of {args.p99}s, nothing written{Style.RESET_ALL}")
+        sys.exit(1)
+
+    config, result = max(eligible, key=lambda entry: entry[1]["images_per_second"])
+    output = {
+        **config,
+        "images_per_second": result["images_per_second"],
+        "p99": result["p99"],
+        "p99_target": args.p99,
+        "tuned_at": time.time(),
+        "host": {"physical_cores": psutil.cpu_count(logical=False), "total_cores": psutil.cpu_count(logical=True), "memory": psutil.virtual_memory().total},
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4)
+    print(f"{Fore.GREEN}best: {config['threads']} threads x {config['instances']} instances, batch {config['batch']}, {'pinned' if config['affinity'] else 'not pinned'} -> {result['images_per_second']:.2f} images/s, written to {args.output}{Style.RESET_ALL}")
@@ -0,0 +1,121 @@
+"""
+Admission control in front of the detectors.
+
+Requests wait in a bounded priority queue, `interactive` requests are always served before `bulk` ones.
+A full queue rejects new work right away with a `Retry-After` estimate instead of letting latency grow for everyone,
+and work whose deadline passed while it was queued is dropped before it reaches the net.
+"""
+
+import itertools
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from tuning import pin_current_thread
+
+PRIORITIES = {"interactive": 0, "bulk": 1}
+
+
+class Rejected(Exception):
+    """
+    raised instead of running the work, `status` and `retry_after` are meant for the HTTP response
+    """
+
+    def __init__(self, status: int, message: str, retry_after: int = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+
+
+class AdmissionController:
+    """
+    runs `fn(state)` for submitted work on one thread per state (e.g. one detector per thread) and returns
+    a future of `(result, {"queue_time": ..., "service_time": ...})`
+
+    `bulk_share` is the fraction of the queue bulk requests may occupy, so bulk work can't lock out interactive requests,
+    `affinity` optionally lists the cpus each worker thread is pinned to (see tuning.py)
+    """
+
+    def __init__(self, states: list, max_queue_depth: int = 32, bulk_share: float = 0.5, affinity: list = None):
+        assert len(states) > 0, "at least one worker state is required"
+        self.max_queue_depth = max_queue_depth
+        self.max_bulk_depth = max(1, int(max_queue_depth * bulk_share))
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()  # keeps FIFO order within a priority class
+        self.lock = threading.Lock()
+        self.depth = {priority: 0 for priority in PRIORITIES}
+        self.workers = len(states)
+        self.service_time = 0.1  # moving average in seconds, used for the Retry-After estimate
+        self.stats = {"admitted": 0, "rejected": 0, "expired": 0}
+
+        for i, state in enumerate(states):
+            cpus = affinity[i % len(affinity)] if affinity else None
+            threading.Thread(target=self.__work, args=(state, cpus), name=f"admission-{i}", daemon=True).start()
+
+    @staticmethod
+    def deadline_from(budget_ms) -> float:
+        """
+        clients send their remaining time budget in milliseconds, a relative budget avoids clock skew between hosts
+        """
+        if budget_ms is None or budget_ms == "":
+            return None
+        try:
+            budget = float(budget_ms)
+        except (TypeError, ValueError):
+            raise Rejected(400, f"invalid deadline {budget_ms!r}, expected a number of milliseconds") from None
+        if not math.isfinite(budget):
+            raise Rejected(400, f"invalid deadline {budget_ms!r}, expected a number of milliseconds")
+        return time.monotonic() + budget / 1000
+
+    def retry_after(self) -> int:
+        queued = sum(self.depth.values())
+        return max(1, math.ceil(queued * self.service_time / self.workers))
+
+    def submit(self, fn, priority: str = "interactive", deadline: float = None) -> Future:
+        if priority not in PRIORITIES:
+            raise Rejected(400, f"unknown priority {priority}, expected one of {', '.join(PRIORITIES)}")
+        if deadline is not None and time.monotonic() >= deadline:
+            raise Rejected(504, "deadline already exceeded")
+
+        with self.lock:
+            if sum(self.depth.values()) >= self.max_queue_depth:
+                self.stats["rejected"] += 1
+                raise Rejected(503, "server saturated, admission queue is full", self.retry_after())
+            if priority == "bulk" and self.depth["bulk"] >= self.max_bulk_depth:
+                self.stats["rejected"] += 1
+                raise Rejected(429, "too many queued bulk requests", self.retry_after())
+            self.depth[priority] += 1
+            self.stats["admitted"] += 1
+
+        future = Future()
+        self.queue.put((PRIORITIES[priority], next(self.sequence), priority, fn, deadline, time.monotonic(), future))
+        return future
+
+    def __work(self, state, cpus: list = None) -> None:
+        pin_current_thread(cpus)
+        while True:
+            _, _, priority, fn, deadline, enqueued_at, future = self.queue.get()
+            with self.lock:
+                self.depth[priority] -= 1
+
+            start_time = time.monotonic()
+            queue_time = start_time - enqueued_at
+            if deadline is not None and start_time >= deadline:
+                with self.lock:
+                    self.stats["expired"] += 1
+                future.set_exception(Rejected(504, f"deadline exceeded after {queue_time:.3f}s in the queue"))
+                continue
+
+            try:
+                result = fn(state)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            service_time = time.monotonic() - start_time
+            self.service_time = 0.9 * self.service_time + 0.1 * service_time
+            future.set_result((result, {"queue_time": queue_time, "service_time": service_time}))
@@ -0,0 +1,405 @@
+"""
+ASGI serving mode for the detection API, served by uvicorn.
+
+Request bodies are read chunk by chunk on the event loop, so slow uploaders and idle keep-alive connections don't
+occupy a worker thread. Decoding runs in a thread pool, inference goes through the admission queue (see admission.py)
+to a fixed set of detection threads, each with its own net (a `cv2.dnn.Net` must not be used by two threads at once).
+
+Besides the JSON payload of `server.py`, `/api/object_detection` accepts the raw image bytes as body
+(`Content-Type: image/jpeg`) with the id in the `X-Image-Id` header and the options as query parameters,
+which avoids the base64 and JSON overhead. Annotated images are rendered on request (`/api/render/<id>`, see render.py).
+Live feeds keep one WebSocket open on `/api/stream` and push frames over it (see streaming.py).
+
+$ python3 ./src/local/asgi_server.py --workers 4 --threads 2 --port 5000
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import uvicorn
+
+from admission import PRIORITIES, AdmissionController, Rejected
+from model_registry import ModelNotFound, ModelRegistry
+from render import RenderCache, RenderNotFound
+from result_store import MAX_PAGE_SIZE, ResultStore
+from streaming import FrameStream
+from tuning import apply_threads, load_config
+from system_info import get_system_info
+from tracing import Trace
+
+# uvicorn imports this module again in every worker process, so the settings are passed as environment variables,
+# the tuned config (see tuning.py) fills in what isn't set
+CONFIG = load_config()
+THREADS = int(os.environ.get("DETECTION_THREADS", CONFIG["instances"]))
+QUEUE_DEPTH = int(os.environ.get("DETECTION_QUEUE_DEPTH", 32))
+MAX_BODY_SIZE = int(os.environ.get("DETECTION_MAX_BODY_SIZE", 32 * 1024 * 1024))
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH")
+MODEL_ROOT = os.environ.get("MODEL_ROOT")
+MODEL_MEMORY_BUDGET = int(float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 1024)) * 1024**2)
+RENDER_CACHE = int(float(os.environ.get("RENDER_CACHE_MB", 256)) * 1024**2)
+RENDER_OUTPUT_CACHE = int(float(os.environ.get("RENDER_OUTPUT_CACHE_MB", 64)) * 1024**2)
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR")  # shared by the worker processes, a render request can reach any of them
+STREAM_MAX_WINDOW = int(os.environ.get("STREAM_MAX_WINDOW", 16))
+STREAM_BUFFER = int(os.environ.get("STREAM_BUFFER", 1))
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class State:
+    admission = None
+    registry = None
+    store = None
+    renders = None
+
+
+async def read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise RequestError(499, "client disconnected")
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_SIZE:
+            raise RequestError(413, f"request body larger than {MAX_BODY_SIZE} bytes")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def send_json(send, status: int, payload: dict, headers: list = ()) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    response_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + list(headers)
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def parse_confidence(value) -> float:
+    confidence = float(value)
+    if not 0 <= confidence <= 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {value}")
+    return confidence
+
+
+def parse_request(body: bytes, content_type: str, headers: dict, query: dict) -> dict:
+    """
+    runs in the executor: JSON parsing and base64 decoding of a large payload would otherwise block the event loop.
+    a malformed request (invalid JSON or base64, missing fields, a confidence that isn't a number) raises a 400 `RequestError`
+    """
+    try:
+        return parse_fields(body, content_type, headers, query)
+    except (KeyError, TypeError, ValueError) as e:  # json and base64 errors are ValueErrors
+        message = f"missing field {e}" if isinstance(e, KeyError) else str(e)
+        raise RequestError(400, f"invalid request: {message}") from None
+
+
+def parse_fields(body: bytes, content_type: str, headers: dict, query: dict) -> dict:
+    if content_type.startswith("image/") or content_type == "application/octet-stream":
+        return {
+            "id": headers.get(b"x-image-id", b"").decode(),
+            "image_data": body,
+            "confidence": parse_confidence(query.get("confidence", ["0.5"])[0]),
+            "priority": headers.get(b"x-priority", b"interactive").decode(),
+            "deadline_ms": headers.get(b"x-deadline-ms", b"").decode(),
+            "model": headers[b"x-model"].decode() if b"x-model" in headers else query.get("model", [None])[0],
+            "trace_id": headers.get(b"x-trace-id", b"").decode() or None,
+        }
+
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("the body must be a JSON object")
+    return {
+        "id": data["id"],
+        "image_data": base64.b64decode(data["image_data"]),
+        "confidence": parse_confidence(data.get("confidence", 0.5)),
+        "priority": headers[b"x-priority"].decode() if b"x-priority" in headers else data.get("priority", "interactive"),
+        "deadline_ms": headers[b"x-deadline-ms"].decode() if b"x-deadline-ms" in headers else data.get("deadline_ms"),
+        "model": headers[b"x-model"].decode() if b"x-model" in headers else data.get("model"),
+        "trace_id": headers[b"x-trace-id"].decode() if b"x-trace-id" in headers else data.get("trace_id"),
+    }
+
+
+async def object_detection(scope, receive, send) -> None:
+    headers = dict(scope["headers"])
+    content_type = headers.get(b"content-type", b"application/json").decode()
+    query = parse_qs(scope["query_string"].decode())
+    try:
+        trace = Trace()
+        with trace.span("read_body"):
+            body = await read_body(receive)
+        with trace.span("parse_request"):
+            request = await asyncio.get_running_loop().run_in_executor(None, parse_request, body, content_type, headers, query)
+        trace.trace_id = request["trace_id"] or trace.trace_id
+
+        deadline = AdmissionController.deadline_from(request["deadline_ms"])
+        detect = lambda detector: detector.detect_objects(request["image_data"], request["confidence"], trace=trace)
+        submitted = time.time()
+        future = State.admission.submit(lambda registry: registry.run(request["model"], detect), request["priority"], deadline)
+        ((detected_objects, inference_time, _), model_version), timings = await asyncio.wrap_future(future)
+        trace.add("queue", submitted, timings["queue_time"])
+        if State.store is not None:
+            with trace.span("store"):
+                State.store.append(request["id"], detected_objects, inference_time)
+        # the annotated image is drawn when `render_url` is requested, see render.py
+        render_id = await asyncio.get_running_loop().run_in_executor(None, State.renders.put, request["image_data"], detected_objects)
+
+        response = {
+            "id": request["id"],
+            "model": model_version,
+            "objects": detected_objects,
+            "inference_time": inference_time,
+            "queue_time": timings["queue_time"],
+            "service_time": timings["service_time"],
+            "render_id": render_id,
+            "render_url": f"/api/render/{render_id}",
+            "trace": trace.as_dict(),
+        }
+        await send_json(send, 200, response, [(b"x-trace-id", trace.trace_id.encode())])
+    except Rejected as e:
+        await send_json(send, e.status, {"error": str(e)}, [(k.lower().encode(), v.encode()) for k, v in e.headers().items()])
+    except RequestError as e:
+        if e.status != 499:
+            await send_json(send, e.status, {"error": str(e)})
+    except ModelNotFound as e:
+        await send_json(send, 404, {"error": str(e)})
+    except Exception as e:
+        await send_json(send, 500, {"error": "An error occurred during object detection", "details": str(e)})
+
+
+async def render(scope, receive, send) -> None:
+    """
+    same parameters as `/api/render/<id>` of `server.py`, decoding, drawing and encoding run in the executor
+    """
+    render_id = scope["path"][len("/api/render/") :]
+    query = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+    try:
+        image, content_type = await asyncio.get_running_loop().run_in_executor(None, State.renders.render, render_id, query.get("format", "jpeg"), query.get("quality"), query.get("width"))
+    except RenderNotFound as e:
+        await send_json(send, 404, {"error": str(e)})
+        return
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+    headers = [(b"content-type", content_type.encode()), (b"content-length", str(len(image)).encode()), (b"cache-control", b"private, max-age=3600")]
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": image})
+
+
+async def render_stats(scope, receive, send) -> None:
+    await send_json(send, 200, State.renders.report())
+
+
+async def models(scope, receive, send) -> None:
+    await send_json(send, 200, State.registry.report())
+
+
+async def activate_model(scope, receive, send) -> None:
+    """
+    same as `/api/models/activate` of `server.py`, the new version is loaded in the executor while requests keep being served
+    """
+    try:
+        data = json.loads(await read_body(receive))
+        active = await asyncio.get_running_loop().run_in_executor(None, State.registry.activate, data["model"], data.get("version"))
+        await send_json(send, 200, {"active": active})
+    except ModelNotFound as e:
+        await send_json(send, 404, {"error": str(e)})
+    except (RequestError, KeyError, ValueError) as e:
+        await send_json(send, 400, {"error": str(e)})
+
+
+async def system_info(scope, receive, send) -> None:
+    # psutil.cpu_percent blocks for a second, keep it off the event loop and out of the detection threads
+    await send_json(send, 200, await asyncio.get_running_loop().run_in_executor(None, get_system_info))
+
+
+async def results(scope, receive, send) -> None:
+    """
+    same parameters as `/api/results` of `server.py`, with `stream=true` every page is sent as soon as it is read
+    """
+    if State.store is None:
+        await send_json(send, 404, {"error": "result store disabled, start the server with --result-store"})
+        return
+    query = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+    loop = asyncio.get_running_loop()
+    try:
+        filters = {
+            "label": query.get("label"),
+            "min_confidence": float(query["min_confidence"]) if "min_confidence" in query else None,
+            "since": float(query["since"]) if "since" in query else None,
+            "until": float(query["until"]) if "until" in query else None,
+        }
+        cursor = int(query.get("cursor", 0))
+        limit = int(query.get("limit", 100))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if query.get("stream", "false").lower() != "true":
+            page, next_cursor = await loop.run_in_executor(None, lambda: State.store.query(cursor=cursor, limit=limit, **filters))
+            await send_json(send, 200, {"results": page, "next_cursor": next_cursor, "store": State.store.stats})
+            return
+    except ValueError as e:
+        await send_json(send, 400, {"error": str(e)})
+        return
+
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+    while cursor is not None:
+        page, cursor = await loop.run_in_executor(None, lambda: State.store.query(cursor=cursor, limit=1000, **filters))
+        body = "".join(json.dumps(result) + "\n" for result in page).encode("utf-8")
+        await send({"type": "http.response.body", "body": body, "more_body": cursor is not None})
+
+
+async def stream(scope, receive, send) -> None:
+    """
+    frames of one client over a WebSocket, see streaming.py. query parameters: `window` (capped by the server),
+    `confidence`, `model` and `priority`. a connection may use every detection thread, frames beyond that wait in a
+    buffer of `STREAM_BUFFER` frames where newer ones replace the oldest
+    """
+    query = {k: v[0] for k, v in parse_qs(scope["query_string"].decode()).items()}
+    await receive()  # websocket.connect
+    model, priority = query.get("model"), query.get("priority", "interactive")
+    try:
+        window = max(1, min(int(query.get("window", STREAM_MAX_WINDOW)), STREAM_MAX_WINDOW))
+        confidence = float(query.get("confidence", 0.5))
+        if not 0 <= confidence <= 1:
+            raise ValueError(f"confidence must be between 0 and 1, got {query['confidence']}")
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority {priority}, expected one of {', '.join(PRIORITIES)}")
+    except ValueError as e:
+        # accepted first, a close before the handshake reaches the client as a bare 403 without the reason
+        await send({"type": "websocket.accept"})
+        await send({"type": "websocket.close", "code": 1008, "reason": str(e).encode()[:120].decode(errors="ignore")})
+        return
+
+    def submit(image_data: bytes):
+        detect = lambda detector: detector.detect_objects(image_data, confidence)
+        future = State.admission.submit(lambda registry: registry.run(model, detect), priority, None)
+
+        async def result() -> dict:
+            ((detected_objects, inference_time, _), model_version), timings = await asyncio.wrap_future(future)
+            return {"model": model_version, "objects": detected_objects, "inference_time": inference_time, "queue_time": timings["queue_time"], "service_time": timings["service_time"]}
+
+        return result()
+
+    async def send_text(text: str) -> None:
+        await send({"type": "websocket.send", "text": text})
+
+    await send({"type": "websocket.accept"})
+    connection = FrameStream(send_text, submit, window, THREADS, STREAM_BUFFER, (Rejected,))
+    try:
+        await send_text(json.dumps({"type": "hello", "window": window, "in_flight": THREADS, "buffer": STREAM_BUFFER}))
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                await connection.on_frame(message["bytes"])
+    finally:
+        await connection.close()
+
+
+ROUTES = {
+    ("POST", "/api/object_detection"): object_detection,
+    ("GET", "/api/system_info"): system_info,
+    ("GET", "/api/results"): results,
+    ("GET", "/api/models"): models,
+    ("POST", "/api/models/activate"): activate_model,
+    ("GET", "/api/render"): render_stats,
+}
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            apply_threads(CONFIG)
+            # pinned cpus would overlap between worker processes, they are only used with the tuned instance count
+            affinity = CONFIG["affinity"] if THREADS == CONFIG["instances"] and os.environ.get("DETECTION_WORKERS", "1") == "1" else None
+            State.registry = ModelRegistry(MODEL_ROOT, MODEL_MEMORY_BUDGET, THREADS)
+            State.registry.activate(*State.registry.resolve())
+            State.admission = AdmissionController([State.registry] * THREADS, max_queue_depth=QUEUE_DEPTH, affinity=affinity)
+            if RESULT_STORE_PATH:
+                State.store = ResultStore(RESULT_STORE_PATH)  # workers share the file, WAL mode lets them write and read concurrently
+            State.renders = RenderCache(RENDER_CACHE, RENDER_OUTPUT_CACHE, RENDER_CACHE_DIR)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if State.store is not None:
+                State.store.flush()
+            State.renders.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] == "websocket":
+        if scope["path"] == "/api/stream":
+            await stream(scope, receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1008})
+        return
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None and scope["method"] == "GET" and scope["path"].startswith("/api/render/"):
+        handler = render
+    if handler is None:
+        await send_json(send, 404, {"error": f"no route for {scope['method']} {scope['path']}"})
+        return
+    await handler(scope, receive, send)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="ASGI server for YOLO object detection")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind to")
+    parser.add_argument("--port", type=int, default=5000, help="Port to bind to")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each loads its own models")
+    parser.add_argument("--threads", type=int, default=None, help="Detection threads (and models) per worker, defaults to the tuned instances or 1")
+    parser.add_argument("--queue-depth", type=int, default=32, help="Requests per worker that may wait for a detection thread, more are rejected with 503")
+    parser.add_argument("--keep-alive", type=int, default=30, help="Seconds an idle keep-alive connection is kept open")
+    parser.add_argument("--model-root", type=str, default=None, help="Folder of <name>/<version>/ model folders, defaults to ./models")
+    parser.add_argument("--memory-budget", type=float, default=1024, help="MiB of loaded models per worker before the least recently used ones are evicted")
+    parser.add_argument("--result-store", type=str, default=None, help="SQLite file to keep all results in, enables /api/results")
+    parser.add_argument("--limit-concurrency", type=int, default=None, help="Maximum number of open connections per worker")
+    parser.add_argument("--render-cache", type=float, default=256, help="MiB of cached source images per worker for /api/render, the oldest can't be rendered anymore")
+    parser.add_argument("--stream-window", type=int, default=16, help="Maximum frames a /api/stream client may send ahead of the results")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.threads is not None:
+        os.environ["DETECTION_THREADS"] = str(args.threads)
+    os.environ["DETECTION_WORKERS"] = str(args.workers)
+    os.environ["DETECTION_QUEUE_DEPTH"] = str(args.queue_depth)
+    os.environ["MODEL_MEMORY_BUDGET_MB"] = str(args.memory_budget)
+    if args.model_root:
+        os.environ["MODEL_ROOT"] = str(Path(args.model_root).resolve())
+    if args.result_store:
+        os.environ["RESULT_STORE_PATH"] = str(Path(args.result_store).resolve())
+    os.environ["RENDER_CACHE_MB"] = str(args.render_cache)
+    os.environ["STREAM_MAX_WINDOW"] = str(args.stream_window)
+    if args.workers > 1 and not os.environ.get("RENDER_CACHE_DIR"):
+        os.environ["RENDER_CACHE_DIR"] = tempfile.mkdtemp(prefix="render-cache-")
+
+    uvicorn.run(
+        "asgi_server:app",
+        app_dir=str(Path(__file__).resolve().parent),
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        lifespan="on",
+        log_level="warning",
+    )
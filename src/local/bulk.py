@@ -0,0 +1,338 @@
+"""
+Offline bulk inference for backfills, without the HTTP server.
+
+- inputs: folders (searched recursively), glob patterns, `.txt` files with one image path per line, or image files
+- workers: a process pool, every worker loads its own net. paths are handed out in batches, a worker decodes a batch and
+  runs it through the net in one forward pass. threads, batch size and the number of workers default to the tuned
+  configuration (see tuning.py), so the workers don't oversubscribe the cores
+- output: JSONL (one line per image) or Parquet (a folder of part files). images that are already in the output are
+  skipped, so an interrupted run continues where it stopped. a torn last JSONL line is dropped, Parquet rows that
+  weren't written to a part file yet are processed again
+- annotation: optional, a separate writer process draws the boxes and writes the images, so jpeg encoding doesn't
+  slow down the inference workers
+- keyframes: with `--keyframes N` every input is a sequence from one camera (a video file or a folder of frames),
+  the frames of a sequence run in order in one worker through `tracking.KeyframeDetector`. one record per frame with
+  `frame`, `keyframe` and objects with a `track_id`, a sequence counts as done once its records are written
+
+$ python3 ./src/local/bulk.py ./data/input_folder --output results.jsonl
+$ python3 ./src/local/bulk.py "./data/**/*.jpg" paths.txt --output results/ --format parquet --annotate-dir ./annotated
+$ python3 ./src/local/bulk.py ./data/camera.mp4 ./data/frames/ --output tracks.jsonl --keyframes 5 --diff-threshold 12
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import psutil
+from colorama import Fore, Style
+from tqdm import tqdm
+
+from object_detection import INPUT_SIZE, SCALE, ObjectDetection
+from render import draw
+from tracking import KeyframeDetector, read_frames
+from tuning import load_config
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+VIDEO_SUFFIXES = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+detector = None  # one per worker process
+confidence_threshold = None
+keyframe_settings = None  # (every, diff_threshold) in keyframe mode
+
+
+def get_args():
+    config = load_config()
+    threads = config["threads"] or 1
+    parser = argparse.ArgumentParser(description="Offline bulk object detection")
+    parser.add_argument("inputs", nargs="+", type=str, help="Folders, glob patterns, .txt files with one path per line, or images")
+    parser.add_argument("--output", type=str, required=True, help="JSONL file or Parquet folder, appended to")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--workers", type=int, default=max(1, (psutil.cpu_count(logical=False) or 1) // threads), help="Worker processes")
+    parser.add_argument("--threads", type=int, default=threads, help="cv2.setNumThreads per worker")
+    parser.add_argument("--batch", type=int, default=config["batch"], help="Images per forward pass")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Confidence threshold")
+    parser.add_argument("--rows-per-file", type=int, default=10_000, help="Rows per Parquet part file")
+    parser.add_argument("--annotate-dir", type=str, default=None, help="Also write annotated images to this folder")
+    parser.add_argument("--keyframes", type=int, default=None, help="Treat inputs as videos or frame folders, full inference every N frames")
+    parser.add_argument("--diff-threshold", type=float, default=None, help="With --keyframes: also run inference when a frame changed by more than this (0-255)")
+    args = parser.parse_args()
+
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+    if args.workers < 1 or args.threads < 1 or args.batch < 1:
+        parser.error("--workers, --threads and --batch must be positive")
+    if args.keyframes is not None and args.keyframes < 1:
+        parser.error("--keyframes must be positive")
+    if args.keyframes is None and args.diff_threshold is not None:
+        parser.error("--diff-threshold needs --keyframes")
+    if args.keyframes is not None and args.annotate_dir:
+        parser.error("--annotate-dir isn't supported with --keyframes")
+    for pattern in args.inputs:
+        if not Path(pattern).exists() and not glob.has_magic(pattern):
+            parser.error(f"input not found: {pattern}")
+    return args
+
+
+def collect(inputs: list) -> list:
+    """
+    absolute image paths of all inputs, sorted and without duplicates
+    """
+    paths = set()
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            candidates = [Path(p) for p in glob.glob(pattern, recursive=True)]
+        elif Path(pattern).is_dir():
+            candidates = list(Path(pattern).rglob("*"))
+        elif Path(pattern).suffix == ".txt":
+            with open(pattern, "r") as f:
+                candidates = [Path(line.strip()) for line in f if line.strip()]
+        else:
+            candidates = [Path(pattern)]
+        paths.update(str(p.resolve()) for p in candidates if p.suffix.lower() in IMAGE_SUFFIXES and p.is_file())
+    return sorted(paths)
+
+
+def collect_sequences(inputs: list) -> list:
+    """
+    absolute paths of the videos and frame folders of all inputs, sorted and without duplicates
+    """
+    sequences = set()
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            candidates = [Path(p) for p in glob.glob(pattern, recursive=True)]
+        elif Path(pattern).suffix == ".txt":
+            with open(pattern, "r") as f:
+                candidates = [Path(line.strip()) for line in f if line.strip()]
+        else:
+            candidates = [Path(pattern)]
+        sequences.update(str(p.resolve()) for p in candidates if p.is_dir() or (p.is_file() and p.suffix.lower() in VIDEO_SUFFIXES))
+    return sorted(sequences)
+
+
+def annotation_root(inputs: list, paths: list) -> str:
+    """
+    the folder annotated images are written relative to: the input folders (the fixed part of a glob), and the folders
+    of images from path lists. it doesn't depend on what's left to do, so a resumed run writes the same layout
+    """
+    roots = []
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            fixed = list(itertools.takewhile(lambda part: not glob.has_magic(part), Path(pattern).parts))
+            roots.append(str(Path(*fixed).resolve() if fixed else Path.cwd()))
+        elif Path(pattern).is_dir():
+            roots.append(str(Path(pattern).resolve()))
+    return os.path.commonpath(roots + [str(Path(path).parent) for path in paths])
+
+
+class JsonlSink:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.file = None
+
+    def done(self) -> set:
+        if not self.path.exists():
+            return set()
+        paths = set()
+        with open(self.path, "rb+") as f:
+            complete = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                paths.add(json.loads(line)["path"])
+                complete += len(line)
+            f.truncate(complete)  # drop a line that was torn by a crash
+        return paths
+
+    def write(self, records: list) -> None:
+        if self.file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "a")
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+class ParquetSink:
+    def __init__(self, path: str, rows_per_file: int):
+        import pyarrow as pa  # only needed for parquet output
+
+        self.pa = pa
+        self.path = Path(path)
+        self.rows_per_file = rows_per_file
+        self.pending = []
+        self.schema = pa.schema(
+            [
+                ("path", pa.string()),
+                ("width", pa.int32()),
+                ("height", pa.int32()),
+                ("inference_time", pa.float64()),
+                ("objects", pa.list_(pa.struct([("label", pa.string()), ("accuracy", pa.float64()), ("box", pa.list_(pa.int32())), ("track_id", pa.int32())]))),
+                ("error", pa.string()),
+                ("frame", pa.int32()),
+                ("keyframe", pa.bool_()),
+            ]
+        )
+
+    def parts(self) -> list:
+        return sorted(self.path.glob("part-*.parquet")) if self.path.is_dir() else []
+
+    def done(self) -> set:
+        import pyarrow.parquet as pq
+
+        return {path for part in self.parts() for path in pq.read_table(part, columns=["path"]).column("path").to_pylist()}
+
+    def flush(self) -> None:
+        import pyarrow.parquet as pq
+
+        if not self.pending:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        parts = self.parts()
+        index = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+        table = self.pa.Table.from_pylist([{field: record.get(field) for field in self.schema.names} for record in self.pending], schema=self.schema)
+        # written under a temporary name first, a crash never leaves a half written part behind
+        tmp_path = self.path / f".part-{index:05d}.parquet.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.path / f"part-{index:05d}.parquet")
+        self.pending = []
+
+    def write(self, records: list) -> None:
+        self.pending.extend(records)
+        if len(self.pending) >= self.rows_per_file:
+            self.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+
+def init_worker(threads: int, confidence: float, keyframes: tuple = None) -> None:
+    global detector, confidence_threshold, keyframe_settings
+    cv2.setNumThreads(threads)
+    confidence_threshold = confidence
+    keyframe_settings = keyframes
+    detector = ObjectDetection()
+    # warm-up, also allocates the scratch arrays `parse_outputs_into` reuses
+    detector.detect_frame(np.zeros((INPUT_SIZE[1], INPUT_SIZE[0], 3), np.uint8), confidence)
+
+
+def run_batch(paths: list) -> list:
+    records, images = [], []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            records.append({"path": path, "error": "could not decode image"})
+        else:
+            images.append((path, img))
+    if not images:
+        return records
+
+    blob = cv2.dnn.blobFromImages([img for _, img in images], SCALE, INPUT_SIZE, (0, 0, 0), True, crop=False)
+    start_time = time.time()
+    outs = detector.forward(blob)
+    inference_time = (time.time() - start_time) / len(images)
+
+    for i, (path, img) in enumerate(images):
+        height, width, _ = img.shape
+        # a batch of one has no batch dimension
+        image_outs = [out[i] if out.ndim == 3 else out for out in outs]
+        boxes, confidences, class_ids = detector.parse_outputs_into(image_outs, width, height, confidence_threshold)
+        indexes = detector.suppress(boxes, confidences, confidence_threshold)
+        objects = detector.label(boxes, confidences, class_ids, indexes, confidence_threshold)
+        records.append({"path": path, "width": width, "height": height, "inference_time": inference_time, "objects": objects})
+    return records
+
+
+def run_sequence(sequence: str) -> list:
+    """
+    one record per frame, the tracker state doesn't outlive the sequence
+    """
+    every, diff_threshold = keyframe_settings
+    pipeline = KeyframeDetector(detector, every, diff_threshold, confidence_threshold)
+    records = []
+    for frame in read_frames(sequence):
+        height, width, _ = frame.shape
+        inference_time = pipeline.stats["inference_time"]
+        objects, keyframe = pipeline.process(frame)
+        inference_time = pipeline.stats["inference_time"] - inference_time
+        records.append({"path": sequence, "frame": pipeline.frame, "keyframe": keyframe, "width": width, "height": height, "inference_time": inference_time, "objects": objects})
+    return records or [{"path": sequence, "error": "no frames"}]
+
+
+def annotation_writer(queue, root: str, output_dir: str) -> None:
+    """
+    runs in its own process, writes `<output_dir>/<path relative to root>` for every record until it gets None
+    """
+    while (records := queue.get()) is not None:
+        for record in records:
+            if record.get("error"):
+                continue
+            img = cv2.imread(record["path"], cv2.IMREAD_COLOR)
+            target = Path(output_dir) / Path(record["path"]).relative_to(root)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(target), draw(img, record["objects"]))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    sink = ParquetSink(args.output, args.rows_per_file) if args.format == "parquet" else JsonlSink(args.output)
+
+    paths = collect(args.inputs) if args.keyframes is None else collect_sequences(args.inputs)
+    done = sink.done()
+    todo = [path for path in paths if path not in done]
+    if args.keyframes is None:
+        print(f"{len(paths)} images, {len(paths) - len(todo)} already in {args.output}, {args.workers} workers x {args.threads} threads, batches of {args.batch}")
+    else:
+        print(f"{len(paths)} sequences, {len(paths) - len(todo)} already in {args.output}, {args.workers} workers x {args.threads} threads, keyframe every {args.keyframes} frames")
+
+    ctx = multiprocessing.get_context("spawn")
+    writer, queue = None, None
+    if args.annotate_dir and todo:
+        root = annotation_root(args.inputs, paths)
+        queue = ctx.Queue(maxsize=4 * args.workers)  # bounded, inference waits if the writer falls behind
+        writer = ctx.Process(target=annotation_writer, args=(queue, root, args.annotate_dir))
+        writer.start()
+
+    if args.keyframes is None:
+        run, tasks, unit = run_batch, [todo[i : i + args.batch] for i in range(0, len(todo), args.batch)], "img"
+    else:
+        # a sequence is one task, its frames depend on each other
+        run, tasks, unit = run_sequence, todo, "sequence"
+    keyframes = (args.keyframes, args.diff_threshold) if args.keyframes is not None else None
+    errors, frames, keyframe_count = 0, 0, 0
+    start_time = time.perf_counter()
+    try:
+        with ctx.Pool(args.workers, initializer=init_worker, initargs=(args.threads, args.confidence, keyframes)) as pool:
+            with tqdm(total=len(todo), unit=unit) as progress:
+                for records in pool.imap_unordered(run, tasks):
+                    sink.write(records)
+                    if queue is not None:
+                        queue.put(records)
+                    errors += sum(1 for record in records if record.get("error"))
+                    frames += sum(1 for record in records if "frame" in record)
+                    keyframe_count += sum(1 for record in records if record.get("keyframe"))
+                    progress.update(len(records) if args.keyframes is None else 1)
+    finally:
+        sink.close()
+        if writer is not None:
+            queue.put(None)
+            writer.join()
+    elapsed = time.perf_counter() - start_time
+
+    color = Fore.GREEN if not errors else Fore.YELLOW
+    if args.keyframes is None:
+        print(f"{color}{len(todo)} images in {elapsed:.2f}s ({len(todo) / elapsed if elapsed else 0:.2f} images/s), {errors} errors{Style.RESET_ALL}")
+    else:
+        print(f"{color}{len(todo)} sequences, {frames} frames ({keyframe_count} keyframes) in {elapsed:.2f}s ({frames / elapsed if elapsed else 0:.2f} frames/s), {errors} errors{Style.RESET_ALL}")
@@ -7,18 +7,34 @@ import argparse
 import time
 import pandas as pd
 
+from tracing import HEADER, Trace
+
 
 def get_args():
     parser = argparse.ArgumentParser(description="YOLO Object Detection Client")
     parser.add_argument("input_folder", type=str, help="Path to the input folder")
     parser.add_argument("endpoint", type=str, help="API endpoint")
+    parser.add_argument("--watch", action="store_true", help="Keep running and send images as they are written to the input folder (and its subfolders)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Watch mode: maximum number of requests in flight")
+    parser.add_argument("--checkpoint", type=str, default="./ingest_checkpoint.sqlite", help="Watch mode: file that records sent images across restarts")
+    parser.add_argument("--settle", type=float, default=1.0, help="Watch mode: seconds a file must stay unchanged before it's sent")
+    parser.add_argument("--poll", action="store_true", help="Watch mode: poll the folder instead of using inotify, e.g. for network shares")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Watch mode: seconds between folder scans when polling")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Watch mode: seconds between metrics reports")
+    parser.add_argument("--max-attempts", type=int, default=8, help="Watch mode: failed sends of a file (with exponential backoff) before it's skipped until it changes")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a response before the request is retried")
+    parser.add_argument("--traces", type=str, default="local_traces.jsonl", help="Per-image traces of the client and server spans (see src/bench/trace_report.py)")
+    parser.add_argument("--stream", action="store_true", help="Send the images in a loop as frames over one WebSocket (ASGI server only, see streaming.py)")
+    parser.add_argument("--window", type=int, default=8, help="Stream mode: frames sent ahead of the results, the server may lower it")
+    parser.add_argument("--fps", type=float, default=0, help="Stream mode: frames per second to send, 0 sends as fast as the window allows")
+    parser.add_argument("--duration", type=float, default=30.0, help="Stream mode: seconds to send frames for")
     args = parser.parse_args()
 
     if not args.input_folder:
         parser.error("Invalid input folder")
     if not os.path.isdir(args.input_folder):
         parser.error("Invalid input folder")
-    if not os.listdir(args.input_folder):
+    if not args.watch and not os.listdir(args.input_folder):
         parser.error("Input folder is empty")
 
     if not args.endpoint:
@@ -34,29 +50,73 @@ def encode_image(image_path) -> str:
     return encoded_string
 
 
+def post_with_retry(url: str, payload: dict, max_retries: int = 5, headers: dict = None, timeout: float = 30.0) -> requests.Response:
+    # the server sheds load with 429/503 when its admission queue is full and tells us when to come back.
+    # a hung server times out and is retried as well, the last timeout is raised
+    for attempt in range(max_retries):
+        try:
+            response = requests.post(url, json=payload, headers=headers, timeout=timeout)
+        except requests.Timeout:
+            if attempt + 1 == max_retries:
+                raise
+            continue
+        if response.status_code not in (429, 503):
+            return response
+        time.sleep(float(response.headers.get("Retry-After", 1)))
+    return response
+
+
 if __name__ == "__main__":
     args = get_args()
     print(f"{args=}")
 
+    if args.stream:
+        import asyncio
+
+        from streaming import print_report, run_client
+
+        frames = []
+        for image_name in sorted(os.listdir(args.input_folder)):
+            if image_name.endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(args.input_folder, image_name), "rb") as f:
+                    frames.append(f.read())
+        url = "ws" + args.endpoint.rstrip("/")[len("http") :] + "/stream"
+        print_report(asyncio.run(run_client(url, frames, args.duration, args.fps, args.window)))
+        raise SystemExit(0)
+
+    if args.watch:
+        from ingest import watch
+
+        watch(args.input_folder, args.endpoint, args.checkpoint, args.concurrency, args.settle, args.poll, args.poll_interval, args.metrics_interval, timeout=args.timeout, max_attempts=args.max_attempts)
+        raise SystemExit(0)
+
     total_transfer_time = 0
     total_inference_time = 0
     num_images = 0
     collected_data = []
+    traces = open(args.traces, "w")
 
     for image_name in os.listdir(args.input_folder):
         if image_name.endswith((".jpg", ".jpeg", ".png")):
             image_path = os.path.join(args.input_folder, image_name)
             image_id = str(uuid.uuid4())
-            image_data = encode_image(image_path)
+            trace = Trace()
+            with trace.span("encode"):
+                image_data = encode_image(image_path)
             payload = {"id": image_id, "image_data": image_data}
             start_transfer_time = time.time()
-            response = requests.post(f"{args.endpoint}/object_detection", json=payload)
+            with trace.span("request"):
+                response = post_with_retry(f"{args.endpoint}/object_detection", payload, headers={HEADER: trace.trace_id}, timeout=args.timeout)
             end_transfer_time = time.time()
             transfer_time = end_transfer_time - start_transfer_time
             assert response.status_code == 200, f"Status code: {response.status_code}"
             assert response.json()["id"] == image_id, f"Image ID mismatch for {image_id}"
 
-            response_data = {key: value for key, value in response.json().items() if key != "image"}
+            # the server's spans are recorded under the trace id we sent
+            trace.spans.extend(response.json().get("trace", {}).get("spans", []))
+            traces.write(json.dumps({**trace.as_dict(), "image": image_path}) + "\n")
+
+            response_data = {key: value for key, value in response.json().items() if key not in ("image", "trace")}
             print(json.dumps(response_data, indent=4))
 
             inference_time = response_data["inference_time"]
@@ -64,12 +124,14 @@ if __name__ == "__main__":
             total_inference_time += inference_time
             num_images += 1
 
-            collected_data.append({"imageid": image_id, "image_path": image_path, "transfertime": transfer_time, "inference_time": inference_time})
+            collected_data.append({"imageid": image_id, "image_path": image_path, "transfertime": transfer_time, "inference_time": inference_time, "trace_id": trace.trace_id})
 
             print(json.dumps(response_data, indent=4))
             print(f"Transfer Time: {transfer_time:.4f} seconds")
             print(f"Inference Time: {inference_time:.4f} seconds")
 
+    traces.close()
+
     print("\n\n**** Local Execution Summary ****")
     print(f"Total Images Processed: {num_images}")
     print(f"Total Transfer Time: {total_transfer_time:.4f} seconds")
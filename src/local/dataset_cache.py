@@ -0,0 +1,124 @@
+"""
+Pre-decoded dataset cache for repeatable benchmarks.
+
+An image folder is converted once into `<prefix>.npy`, a memory-mapped float32 array of shape (images, 3, 416, 416)
+holding the output of `ObjectDetection.preprocess`, and `<prefix>.json`, the index with the path, original size,
+file size and mtime of every image and the preprocessing settings.
+
+Benchmarks then measure inference without jpeg decoding and resizing, and all processes that open the cache share
+one copy of it in the page cache:
+
+    cache = DatasetCache("/tmp/coco")
+    for i in range(len(cache)):
+        objects, inference_time = detector.detect_preprocessed(cache.blob(i), *cache.size(i))
+
+$ python3 ./src/local/dataset_cache.py ./data/input_folder /tmp/coco
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from colorama import Fore, Style
+
+from object_detection import INPUT_SIZE, SCALE, ObjectDetection
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+def preprocessing() -> dict:
+    return {"input_size": list(INPUT_SIZE), "scale": SCALE, "swap_rb": True, "crop": False}
+
+
+class DatasetCache:
+    def __init__(self, prefix: str):
+        self.prefix = str(prefix)
+        with open(f"{self.prefix}.json", "r") as f:
+            self.index = json.load(f)
+        if self.index["preprocessing"] != preprocessing():
+            raise ValueError(f"{self.prefix} was built with different preprocessing settings, rebuild it")
+        self.blobs = np.load(f"{self.prefix}.npy", mmap_mode="r")
+        assert self.blobs.flags.c_contiguous and self.blobs.dtype == np.float32
+
+    def __len__(self) -> int:
+        return len(self.index["images"])
+
+    def blob(self, i: int) -> np.ndarray:
+        # a view of the mapped file, nothing is read before the net touches it
+        return self.blobs[i : i + 1]
+
+    def size(self, i: int) -> tuple:
+        image = self.index["images"][i]
+        return image["width"], image["height"]
+
+    def path(self, i: int) -> str:
+        return self.index["images"][i]["path"]
+
+    def stale(self) -> list:
+        """
+        returns the paths of images that changed or disappeared since the cache was built
+        """
+        stale = []
+        for image in self.index["images"]:
+            try:
+                stat = os.stat(image["path"])
+            except FileNotFoundError:
+                stale.append(image["path"])
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (image["file_size"], image["mtime_ns"]):
+                stale.append(image["path"])
+        return stale
+
+
+def build(input_folder: str, prefix: str, workers: int = os.cpu_count()) -> DatasetCache:
+    paths = sorted(str(p.resolve()) for p in Path(input_folder).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    assert paths, f"no images in {input_folder}"
+
+    Path(prefix).parent.mkdir(parents=True, exist_ok=True)
+    blobs = np.lib.format.open_memmap(f"{prefix}.npy.part", mode="w+", dtype=np.float32, shape=(len(paths), 3, INPUT_SIZE[1], INPUT_SIZE[0]))
+    images = [None] * len(paths)
+
+    def convert(i: int) -> None:
+        stat = os.stat(paths[i])
+        with open(paths[i], "rb") as image_file:
+            img = ObjectDetection.decode(image_file.read())
+        height, width, _ = img.shape
+        blobs[i] = ObjectDetection.preprocess(img)[0]
+        images[i] = {"path": paths[i], "width": width, "height": height, "file_size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    # every thread writes its own rows, cv2 releases the GIL while decoding and resizing
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(convert, range(len(paths))))
+    blobs.flush()
+    del blobs
+
+    # the index is written last, a cache without one is incomplete
+    os.replace(f"{prefix}.npy.part", f"{prefix}.npy")
+    with open(f"{prefix}.json.part", "w") as f:
+        json.dump({"created_at": time.time(), "input_folder": str(Path(input_folder).resolve()), "preprocessing": preprocessing(), "images": images}, f)
+    os.replace(f"{prefix}.json.part", f"{prefix}.json")
+    return DatasetCache(prefix)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Convert an image folder into a memory-mapped cache of preprocessed blobs")
+    parser.add_argument("input_folder", type=str, help="Path to the images")
+    parser.add_argument("prefix", type=str, help="Output path without extension, <prefix>.npy and <prefix>.json are written")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Images converted in parallel")
+    args = parser.parse_args()
+
+    if not Path(args.input_folder).is_dir():
+        parser.error("Invalid input folder")
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    start_time = time.perf_counter()
+    cache = build(args.input_folder, args.prefix, args.workers)
+    size = os.path.getsize(f"{args.prefix}.npy")
+    print(f"{Fore.GREEN}{len(cache)} images cached in {args.prefix}.npy ({size / 1024**2:.0f} MiB) in {time.perf_counter() - start_time:.1f}s{Style.RESET_ALL}")
@@ -2,6 +2,7 @@
 Demo script to show how to use YOLO object detection with OpenCV.
 
 $ python3 demo.py --image-path ./data/input_folder/000000000968.jpg
+$ python3 demo.py --image-path ./data/input_folder/000000000968.jpg --output annotated.jpg  # headless
 
     [[111, 190, 224, 184]] ['cat'] [0.931888222694397] 
 
@@ -27,6 +28,7 @@ def get_args():
     parser.add_argument("-c", "--conf-threshold", type=float, default=0.2, help="Confidence threshold")
     parser.add_argument("--apply-nms", type=bool, default=True, help="Apply non-max suppression")
     parser.add_argument("--nms-threshold", type=float, default=0.2, help="NMS threshold")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Write the annotated image to this file instead of showing it")
     return parser.parse_args()
 
 
@@ -101,6 +103,9 @@ if __name__ == "__main__":
             cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
             text = "{}: {:.4f}".format(classes[classIds[i]], confidences[i])
             cv2.putText(image, text, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-    # show the output image
-    cv2.imshow("Image", image)
-    cv2.waitKey(0)
+    # show the output image, or write it when there is no display
+    if args.output:
+        cv2.imwrite(args.output, image)
+    else:
+        cv2.imshow("Image", image)
+        cv2.waitKey(0)
@@ -0,0 +1,334 @@
+"""
+Long running ingest of a folder that cameras keep dropping images into (`client.py --watch`).
+
+- watching: inotify through ctypes on linux, polling the directory tree everywhere else (or with `--poll`).
+  the folder is watched recursively and rescanned on startup, so files that arrived while the daemon was down are picked up.
+- debouncing: a file is sent once its size and mtime didn't change for `settle` seconds, hidden files (`.name.part` etc.) are skipped.
+- sending: at most `concurrency` requests in flight, the rest waits in the backlog. failed files are retried with
+  exponential backoff (`retry_delay` doubling up to `max_retry_delay`), after `max_attempts` the file is logged and
+  skipped until it changes.
+- checkpoint: every acknowledged file is committed to a SQLite file keyed by path, size and mtime, so a restart doesn't
+  send it again, and a replaced file with the same name is sent again. the image id is derived from the same key, so
+  a file that was sent but not yet checkpointed when the daemon died is re-sent with the same id.
+- metrics: backlog size, files/s and ingest lag (acknowledgement time - file mtime) every `metrics_interval` seconds.
+"""
+
+import base64
+import ctypes
+import ctypes.util
+import heapq
+import os
+import select
+import sqlite3
+import struct
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from colorama import Fore, Style
+
+from client import post_with_retry
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def is_image(path: str) -> bool:
+    name = os.path.basename(path)
+    return not name.startswith(".") and name.lower().endswith(IMAGE_SUFFIXES)
+
+
+def scan(root: str) -> list:
+    return [os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names if is_image(name)]
+
+
+def drain(fd: int) -> None:
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+class InotifyWatcher:
+    """
+    `wake_fd` interrupts `poll`, e.g. when a request finished
+
+    `writing` holds the files that were created or modified but not closed yet, a writer that pauses longer than
+    the settle time would otherwise get its partial file sent
+    """
+
+    def __init__(self, root: str, wake_fd: int):
+        self.wake_fd = wake_fd
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.folders = {}
+        self.writing = set()
+        for folder, _, _ in os.walk(root):
+            self.add_watch(folder)
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(ctypes.CDLL(ctypes.util.find_library("c")), "inotify_init1")
+
+    def add_watch(self, folder: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, folder.encode(), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+        self.folders[wd] = folder
+
+    def poll(self, timeout: float) -> set:
+        readable = select.select([self.fd, self.wake_fd], [], [], timeout)[0]
+        if self.wake_fd in readable:
+            drain(self.wake_fd)
+        if self.fd not in readable:
+            return set()
+        data = os.read(self.fd, 1 << 16)
+        paths, offset = set(), 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0").decode()
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # the kernel dropped events, only a rescan can tell what happened. closes may be lost as well, so a
+                # file could stay in `writing` forever, the settle time has to protect the files written right now
+                self.writing.clear()
+                paths |= {path for folder in self.folders.values() for path in scan(folder)}
+            elif wd in self.folders:
+                path = os.path.join(self.folders[wd], name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        for folder, _, _ in os.walk(path):
+                            self.add_watch(folder)
+                        paths |= set(scan(path))  # files written before the watch was added
+                elif is_image(path):
+                    if mask & (IN_CREATE | IN_MODIFY):
+                        self.writing.add(path)
+                    else:
+                        self.writing.discard(path)
+                    paths.add(path)
+        return paths
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    reports new and changed files, only the settle time protects against partial files
+    """
+
+    def __init__(self, root: str, wake_fd: int, interval: float = 1.0):
+        self.root = root
+        self.wake_fd = wake_fd
+        self.interval = interval
+        self.next_scan = 0.0
+        self.writing = set()
+        self.known = {}  # path -> (size, mtime_ns) at the last scan
+
+    def poll(self, timeout: float) -> set:
+        if select.select([self.wake_fd], [], [], max(0, min(timeout, self.next_scan - time.monotonic())))[0]:
+            drain(self.wake_fd)
+        if time.monotonic() < self.next_scan:
+            return set()
+        self.next_scan = time.monotonic() + self.interval
+
+        known, changed = {}, set()
+        for path in scan(self.root):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            known[path] = (stat.st_size, stat.st_mtime_ns)
+            if self.known.get(path) != known[path]:
+                changed.add(path)
+        self.known = known
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class Debouncer:
+    """
+    hands out `(path, size, mtime_ns)` once a file stopped changing for `settle` seconds
+    """
+
+    def __init__(self, settle: float):
+        self.settle = settle
+        self.pending = {}  # path -> (size, mtime_ns, unchanged since)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def touch(self, path: str) -> None:
+        self.pending.setdefault(path, (-1, -1, time.monotonic()))
+
+    def ready(self, writing: set = frozenset()) -> list:
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, since) in list(self.pending.items()):
+            if path in writing:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - since >= self.settle and size > 0:
+                del self.pending[path]
+                ready.append((path, size, mtime_ns))
+        return ready
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # a checkpointed file must survive a power loss
+        self.conn.execute("CREATE TABLE IF NOT EXISTS processed (path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, image_id TEXT NOT NULL, processed_at REAL NOT NULL, PRIMARY KEY (path, size, mtime_ns))")
+        self.conn.commit()
+
+    def done(self, path: str, size: int, mtime_ns: int) -> bool:
+        return self.conn.execute("SELECT 1 FROM processed WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns)).fetchone() is not None
+
+    def record(self, path: str, size: int, mtime_ns: int, image_id: str) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?)", (path, size, mtime_ns, image_id, time.time()))
+
+
+def image_id_of(path: str, size: int, mtime_ns: int) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"file://{os.path.abspath(path)}?size={size}&mtime_ns={mtime_ns}"))
+
+
+def send(endpoint: str, path: str, image_id: str, timeout: float = 30.0) -> dict:
+    with open(path, "rb") as image_file:
+        payload = {"id": image_id, "image_data": base64.b64encode(image_file.read()).decode("utf-8")}
+    response = post_with_retry(f"{endpoint}/object_detection", payload, timeout=timeout)
+    assert response.status_code == 200, f"Status code: {response.status_code}"
+    return response.json()
+
+
+class Metrics:
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.sent, self.failed, self.given_up = 0, 0, 0
+        self.lags = []
+
+    def report(self, backlog: int, in_flight: int) -> None:
+        elapsed = time.monotonic() - self.start_time
+        lag = f"p50 {np.percentile(self.lags, 50):.2f}s max {max(self.lags):.2f}s" if self.lags else "-"
+        color = Fore.RED if self.failed else Fore.GREEN
+        print(f"{color}[ingest] sent {self.sent} ({self.sent / elapsed:.2f} files/s), failed {self.failed}, gave up {self.given_up}, backlog {backlog}, in flight {in_flight}, lag {lag}{Style.RESET_ALL}", flush=True)
+        self.start_time = time.monotonic()
+        self.sent, self.failed, self.given_up = 0, 0, 0
+        self.lags = []
+
+
+def watch(root: str, endpoint: str, checkpoint_path: str, concurrency: int = 4, settle: float = 1.0, poll: bool = False, poll_interval: float = 1.0, metrics_interval: float = 10.0, retry_delay: float = 5.0, timeout: float = 30.0, max_retry_delay: float = 300.0, max_attempts: int = 8) -> None:
+    wake_fd, wake_write_fd = os.pipe()
+    os.set_blocking(wake_fd, False)
+    os.set_blocking(wake_write_fd, False)
+    if not poll and InotifyWatcher.available():
+        watcher = InotifyWatcher(root, wake_fd)
+    else:
+        watcher = PollingWatcher(root, wake_fd, poll_interval)
+    print(f"watching {root} with {type(watcher).__name__}, checkpoint {checkpoint_path}")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    debouncer = Debouncer(settle)
+    backlog = deque()
+    retries = []  # heap of (due, path), the failed file is treated like a new event when due
+    attempts = {}  # path -> failed sends in a row
+    given_up = {}  # path -> (size, mtime_ns) of the version that failed `max_attempts` times
+    in_flight = {}  # future -> (path, size, mtime_ns)
+    queued = set()  # paths in the backlog or in flight
+    metrics = Metrics()
+    next_report = time.monotonic() + metrics_interval
+    next_debounce = 0.0
+
+    def wake(_):
+        try:
+            os.write(wake_write_fd, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full, the loop is awake anyway
+
+    for path in scan(root):  # after the watch was set up, so nothing falls in between
+        debouncer.touch(path)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while True:
+                for path in watcher.poll(timeout=min(settle / 4, 0.25)):
+                    debouncer.touch(path)
+                while retries and retries[0][0] <= time.monotonic():
+                    debouncer.touch(heapq.heappop(retries)[1])
+
+                # stat'ing every pending file on each completed request would be wasted work for a large backlog
+                if time.monotonic() >= next_debounce:
+                    for path, size, mtime_ns in debouncer.ready(watcher.writing):
+                        if given_up.get(path) == (size, mtime_ns):
+                            continue
+                        given_up.pop(path, None)  # replaced, it gets a new set of attempts
+                        if path not in queued and not checkpoint.done(path, size, mtime_ns):
+                            backlog.append((path, size, mtime_ns))
+                            queued.add(path)
+                    next_debounce = time.monotonic() + settle / 4
+
+                while backlog and len(in_flight) < concurrency:
+                    path, size, mtime_ns = backlog.popleft()
+                    future = executor.submit(send, endpoint, path, image_id_of(path, size, mtime_ns), timeout)
+                    in_flight[future] = (path, size, mtime_ns)
+                    future.add_done_callback(wake)
+
+                done, _ = wait(list(in_flight), timeout=0, return_when=FIRST_COMPLETED) if in_flight else (set(), None)
+                for future in done:
+                    path, size, mtime_ns = in_flight.pop(future)
+                    queued.discard(path)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        metrics.failed += 1
+                        attempts[path] = attempts.get(path, 0) + 1
+                        if attempts[path] >= max_attempts:
+                            metrics.given_up += 1
+                            given_up[path] = (size, mtime_ns)
+                            del attempts[path]
+                            print(f"{Fore.RED}[ingest] {path}: {e}, giving up after {max_attempts} attempts{Style.RESET_ALL}", flush=True)
+                            continue
+                        delay = min(max_retry_delay, retry_delay * 2 ** (attempts[path] - 1))
+                        heapq.heappush(retries, (time.monotonic() + delay, path))
+                        print(f"{Fore.RED}[ingest] {path}: {e}, retrying in {delay:.0f}s (attempt {attempts[path]} of {max_attempts}){Style.RESET_ALL}", flush=True)
+                        continue
+                    attempts.pop(path, None)
+                    checkpoint.record(path, size, mtime_ns, image_id_of(path, size, mtime_ns))
+                    metrics.sent += 1
+                    metrics.lags.append(time.time() - mtime_ns / 1e9)
+
+                if time.monotonic() >= next_report:
+                    metrics.report(len(debouncer) + len(backlog) + len(retries), len(in_flight))
+                    next_report = time.monotonic() + metrics_interval
+        except KeyboardInterrupt:
+            print("stopping, waiting for requests in flight")
+            for future in list(in_flight):
+                path, size, mtime_ns = in_flight.pop(future)
+                if future.exception() is None:
+                    checkpoint.record(path, size, mtime_ns, image_id_of(path, size, mtime_ns))
+        finally:
+            watcher.close()
+            os.close(wake_fd)
+            os.close(wake_write_fd)
@@ -0,0 +1,243 @@
+"""
+Registry of detection models, so one server can serve several detector variants.
+
+Models live in `<root>/<name>/<version>/` with one `.cfg`, one `.weights` and one `.names` file each. The bundled
+`yolo_tiny_configs` folder is always available as `yolov3-tiny:bundled`, the default model. Requests name a model
+as `name` (its active version) or `name:version`.
+
+- nets are loaded on first use, one instance per detection thread that needs it (a `cv2.dnn.Net` isn't thread-safe)
+- loaded models are evicted least recently used when the estimated memory exceeds `memory_budget`, models with
+  requests in flight are never evicted. the budget can be overrun when everything loaded is busy (`budget_overruns`)
+- `activate(name, version)` loads the new version before it swaps the active version, so requests never wait for the
+  load. requests that already hold the old version finish on it
+"""
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import psutil
+
+from object_detection import ObjectDetection
+
+BUNDLED = ("yolov3-tiny", "bundled")
+LATENCY_WINDOW = 1000
+SEGMENT = re.compile(r"^[A-Za-z0-9._-]+$")  # model names and versions are folder names, never paths
+
+
+class ModelNotFound(Exception):
+    pass
+
+
+def version_key(version: str) -> tuple:
+    # "10" sorts after "9", non-numeric versions sort by name before numeric ones
+    return (1, int(version), "") if version.isdigit() else (0, 0, version)
+
+
+class LoadedModel:
+    def __init__(self, name: str, version: str, files: dict):
+        self.name = name
+        self.version = version
+        self.files = files
+        self.free = []  # idle instances
+        self.instances = 0
+        self.in_flight = 0
+        self.memory_per_instance = 0
+        self.last_used = 0.0
+        self.metrics = {"loads": 0, "load_time": 0.0, "requests": 0, "errors": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    @property
+    def memory(self) -> int:
+        return self.memory_per_instance * self.instances
+
+    def report(self) -> dict:
+        latencies = np.array(self.latencies) if self.latencies else None
+        return {
+            "model": f"{self.name}:{self.version}",
+            "instances": self.instances,
+            "in_flight": self.in_flight,
+            "memory_mb": self.memory / 1024**2,
+            "last_used": self.last_used,
+            **self.metrics,
+            "latency_p50": float(np.percentile(latencies, 50)) if latencies is not None else None,
+            "latency_p99": float(np.percentile(latencies, 99)) if latencies is not None else None,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, root: str = None, memory_budget: int = 1024**3, max_instances: int = 1):
+        self.root = Path(root) if root else Path.cwd() / "models"
+        self.memory_budget = memory_budget
+        self.max_instances = max_instances
+        self.lock = threading.Condition()
+        self.load_lock = threading.Lock()  # one load at a time, so the memory measurement of a load isn't mixed up with another
+        self.active = {BUNDLED[0]: BUNDLED[1]}  # name -> version
+        self.loaded = {}  # (name, version) -> LoadedModel
+        self.evicted = {}  # (name, version) -> metrics of evicted models, kept for reporting
+        self.stats = {"evictions": 0, "budget_overruns": 0, "swaps": 0}
+
+    def available(self) -> dict:
+        """
+        returns {name: [versions, oldest first]} of the models on disk
+        """
+        models = {BUNDLED[0]: [BUNDLED[1]]} if (Path.cwd() / "yolo_tiny_configs").is_dir() else {}
+        if self.root.is_dir():
+            for model_dir in sorted(p for p in self.root.iterdir() if p.is_dir()):
+                versions = sorted((p.name for p in model_dir.iterdir() if p.is_dir()), key=version_key)
+                if versions:
+                    models.setdefault(model_dir.name, [])
+                    models[model_dir.name] = sorted(set(models[model_dir.name] + versions), key=version_key)
+        return models
+
+    def files(self, name: str, version: str) -> dict:
+        if (name, version) == BUNDLED:
+            folder = Path.cwd() / "yolo_tiny_configs"
+            return {"model_config": folder / "yolov3-tiny.cfg", "model_weights": folder / "yolov3-tiny.weights", "coco_names": folder / "coco.names"}
+
+        folder = self.root / name / version
+        if not folder.is_dir() or not folder.resolve().is_relative_to(self.root.resolve()):
+            raise ModelNotFound(f"unknown model {name}:{version}")
+        found = {}
+        for key, suffix in (("model_config", ".cfg"), ("model_weights", ".weights"), ("coco_names", ".names")):
+            matches = sorted(folder.glob(f"*{suffix}"))
+            if len(matches) != 1:
+                raise ModelNotFound(f"{folder} needs exactly one {suffix} file, found {len(matches)}")
+            found[key] = matches[0]
+        return found
+
+    def resolve(self, model: str = None) -> tuple:
+        """
+        `name` or `name:version` to `(name, version)`, no name means the active version of the bundled model's name
+        """
+        name, _, version = (model or BUNDLED[0]).partition(":")
+        if not all(SEGMENT.match(part) and part not in (".", "..") for part in ((name, version) if version else (name,))):
+            raise ModelNotFound(f"invalid model name {model}")
+        with self.lock:
+            if name in self.active and (not version or version == self.active[name]):
+                return name, self.active[name]
+        versions = self.available().get(name)
+        if not versions or (version and version not in versions):
+            raise ModelNotFound(f"unknown model {model}")
+        if version:
+            return name, version
+        with self.lock:
+            return name, self.active.setdefault(name, versions[-1])
+
+    def __load_instance(self, entry: LoadedModel) -> ObjectDetection:
+        with self.load_lock:
+            rss_before = psutil.Process().memory_info().rss
+            start_time = time.perf_counter()
+            detector = ObjectDetection(**{key: str(path) for key, path in entry.files.items()})
+            load_time = time.perf_counter() - start_time
+            rss_delta = psutil.Process().memory_info().rss - rss_before
+
+        with self.lock:
+            entry.metrics["loads"] += 1
+            entry.metrics["load_time"] += load_time
+            if entry.memory_per_instance == 0:
+                # rss can shrink during a load (freed arenas), the weights file size is the lower bound
+                entry.memory_per_instance = max(rss_delta, os.path.getsize(entry.files["model_weights"]))
+        return detector
+
+    def __evict_for(self, needed: int, keep: tuple) -> None:
+        """
+        called with the lock held
+        """
+        used = sum(entry.memory for entry in self.loaded.values())
+        idle = sorted((entry for key, entry in self.loaded.items() if key != keep and entry.in_flight == 0), key=lambda entry: entry.last_used)
+        while used + needed > self.memory_budget and idle:
+            entry = idle.pop(0)
+            used -= entry.memory
+            del self.loaded[(entry.name, entry.version)]
+            self.evicted[(entry.name, entry.version)] = entry.report()
+            self.stats["evictions"] += 1
+        if used + needed > self.memory_budget:
+            self.stats["budget_overruns"] += 1
+
+    def __checkout(self, key: tuple) -> tuple:
+        with self.lock:
+            entry = self.loaded.get(key)
+            if entry is None:
+                entry = self.loaded[key] = LoadedModel(*key, self.files(*key))
+                self.evicted.pop(key, None)
+            entry.in_flight += 1
+            entry.last_used = time.time()
+            while not entry.free and entry.instances >= self.max_instances:
+                self.lock.wait()
+            if entry.free:
+                return entry, entry.free.pop()
+            # evict before reserving, `entry.memory` would otherwise count the new instance twice
+            self.__evict_for(entry.memory_per_instance or os.path.getsize(entry.files["model_weights"]), key)
+            entry.instances += 1  # reserved, so no other thread loads past max_instances
+
+        try:
+            return entry, self.__load_instance(entry)
+        except Exception:
+            with self.lock:
+                entry.instances -= 1
+                entry.in_flight -= 1
+                if entry.instances == 0:
+                    self.loaded.pop(key, None)
+            raise
+
+    def __checkin(self, entry: LoadedModel, detector: ObjectDetection, latency: float = None, failed: bool = False) -> None:
+        """
+        without `latency` (warm-ups) nothing is counted as a request
+        """
+        with self.lock:
+            entry.in_flight -= 1
+            if latency is not None:
+                entry.metrics["requests"] += 1
+                entry.metrics["errors"] += int(failed)
+                entry.latencies.append(latency)
+            entry.free.append(detector)
+            self.lock.notify_all()
+
+    def run(self, model: str, fn):
+        """
+        runs `fn(detector)` on an instance of `model` and returns `(result, "name:version")`
+        """
+        key = self.resolve(model)
+        entry, detector = self.__checkout(key)
+        start_time = time.perf_counter()
+        failed = True
+        try:
+            result = fn(detector)
+            failed = False
+            return result, f"{key[0]}:{key[1]}"
+        finally:
+            self.__checkin(entry, detector, time.perf_counter() - start_time, failed)
+
+    def activate(self, name: str, version: str = None) -> str:
+        """
+        loads `version` (the newest on disk by default) and makes it the version served for `name`
+        """
+        version = version or self.available().get(name, [None])[-1]
+        if version is None:
+            raise ModelNotFound(f"unknown model {name}")
+        # warm: at least one instance is loaded before the swap
+        key = self.resolve(f"{name}:{version}")
+        self.__checkin(*self.__checkout(key))
+        with self.lock:
+            previous = self.active.get(name)
+            self.active[name] = version
+            if previous != version:
+                self.stats["swaps"] += 1
+        return f"{name}:{version}"
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "memory_budget_mb": self.memory_budget / 1024**2,
+                "memory_used_mb": sum(entry.memory for entry in self.loaded.values()) / 1024**2,
+                "active": dict(self.active),
+                "loaded": [entry.report() for entry in self.loaded.values()],
+                "evicted": list(self.evicted.values()),
+                "available": self.available(),
+                **self.stats,
+            }
@@ -0,0 +1,246 @@
+import base64
+import cv2
+import numpy as np
+import time
+from pathlib import Path
+
+from render import color_of
+from tracing import span
+
+# preprocessing of `blobFromImage`, dataset caches built with other settings are rejected (see dataset_cache.py)
+INPUT_SIZE = (416, 416)
+SCALE = 0.00392
+
+
+class Scratch:
+    """
+    Buffers an `ObjectDetection` instance reuses across requests instead of allocating them per request.
+    An instance only serves one thread at a time, so the buffers need no locking.
+    """
+
+    def __init__(self):
+        self.resized = np.empty((INPUT_SIZE[1], INPUT_SIZE[0], 3), np.uint8)
+        self.blob = np.empty((1, 3, INPUT_SIZE[1], INPUT_SIZE[0]), np.float32)
+        self.outs = None  # output shapes depend on the net, allocated by the first forward pass
+
+    def allocate_outputs(self, outs):
+        self.outs = list(outs)
+        self.class_ids = [np.empty(len(out), np.intp) for out in outs]
+        self.confidences = [np.empty(len(out), np.float32) for out in outs]
+        self.mask = [np.empty(len(out), bool) for out in outs]
+        # flat index of the best class score of every row, row * row_length + 5 + class_id
+        self.rows = [np.arange(len(out), dtype=np.intp) * out.shape[1] + 5 for out in outs]
+        self.flat = [np.empty(len(out), np.intp) for out in outs]
+
+
+class ObjectDetection:
+    def __init__(self, model_config=None, model_weights=None, coco_names=None, reuse_buffers=True):
+        # defaults to the bundled yolov3-tiny, other models are served through the registry (see model_registry.py)
+        self.MODEL_CONFIG = Path(model_config) if model_config else Path.cwd() / "yolo_tiny_configs" / "yolov3-tiny.cfg"
+        self.MODEL_WEIGHTS = Path(model_weights) if model_weights else Path.cwd() / "yolo_tiny_configs" / "yolov3-tiny.weights"
+        self.COCO_NAMES = Path(coco_names) if coco_names else Path.cwd() / "yolo_tiny_configs" / "coco.names"
+
+        self.net = cv2.dnn.readNet(str(self.MODEL_WEIGHTS), str(self.MODEL_CONFIG))
+
+        # Check if CUDA is available and set the preferable backend and target
+        # Note: could not get the openCV running on CUDA
+        if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+            print("CUDA is available. Using GPU.")
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+        else:
+            print("CUDA is not available. Using CPU.")
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+        with open(self.COCO_NAMES, "r") as f:
+            self.classes = [line.strip() for line in f.readlines()]
+
+        self.output_layers = self.net.getUnconnectedOutLayersNames()
+
+        # `reuse_buffers=False` allocates everything per request, as before (see src/bench/allocations.py)
+        self.reuse_buffers = reuse_buffers
+        self.scratch = Scratch()
+
+    # The stages of `detect_objects` are separate methods, so they can be benchmarked in isolation (see src/bench/stages.py)
+
+    @staticmethod
+    def decode(image_data):
+        # Convert to a numpy array and decode to an image
+        nparr = np.frombuffer(image_data, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    @staticmethod
+    def preprocess(img):
+        # Prepare the image for YOLO
+        return cv2.dnn.blobFromImage(img, SCALE, INPUT_SIZE, (0, 0, 0), True, crop=False)
+
+    def preprocess_into(self, img):
+        """
+        Same blob as `preprocess`, written into the reused input tensor. It is overwritten by the next call.
+        """
+        resized = cv2.resize(img, INPUT_SIZE, dst=self.scratch.resized, interpolation=cv2.INTER_LINEAR)
+        for channel in range(3):
+            # BGR -> RGB and HWC -> NCHW in one pass per channel, scaled in double precision like blobFromImage
+            np.multiply(resized[:, :, 2 - channel], SCALE, out=self.scratch.blob[0, channel], dtype=np.float64, casting="unsafe")
+        return self.scratch.blob
+
+    def forward(self, blob):
+        # Run the YOLO network
+        self.net.setInput(blob)
+        return self.net.forward(self.output_layers)
+
+    def forward_into(self, blob):
+        """
+        Same as `forward` for single images, the net writes into the reused output arrays.
+        """
+        if self.scratch.outs is None or len(blob) != 1:
+            outs = self.forward(blob)
+            if len(blob) == 1:
+                self.scratch.allocate_outputs(outs)
+            return outs
+        self.net.setInput(blob)
+        return self.net.forward(self.output_layers, self.scratch.outs)
+
+    def parse_outputs(self, outs, width, height, confidence_threshold):
+        class_ids = []
+        confidences = []
+        boxes = []
+
+        # Extract the bounding boxes, confidences, and class IDs
+        for out in outs:
+            for detection in out:
+                scores = detection[5:]
+                class_id = np.argmax(scores)
+                confidence = scores[class_id]
+
+                # filter out low confidence detections
+                if confidence > confidence_threshold:
+                    center_x = int(detection[0] * width)
+                    center_y = int(detection[1] * height)
+                    w = int(detection[2] * width)
+                    h = int(detection[3] * height)
+
+                    x = int(center_x - w / 2)
+                    y = int(center_y - h / 2)
+
+                    boxes.append([x, y, w, h])
+                    confidences.append(float(confidence))
+                    class_ids.append(class_id)
+
+        return boxes, confidences, class_ids
+
+    def parse_outputs_into(self, outs, width, height, confidence_threshold):
+        """
+        Same result as `parse_outputs`, the argmax and the threshold run on all rows at once in the reused scratch arrays
+        and only the rows above the threshold are converted to boxes.
+        """
+        if self.scratch.outs is None or [out.shape for out in outs] != [out.shape for out in self.scratch.outs]:
+            return self.parse_outputs(outs, width, height, confidence_threshold)
+
+        class_ids = []
+        confidences = []
+        boxes = []
+        scratch = self.scratch
+        for k, out in enumerate(outs):
+            np.argmax(out[:, 5:], axis=1, out=scratch.class_ids[k])
+            np.add(scratch.rows[k], scratch.class_ids[k], out=scratch.flat[k])
+            np.take(out.reshape(-1), scratch.flat[k], out=scratch.confidences[k])
+            # compared in float64 like the scalar comparison in `parse_outputs`
+            np.greater(scratch.confidences[k], confidence_threshold, out=scratch.mask[k], signature=(np.float64, np.float64, np.bool_))
+
+            for i in np.flatnonzero(scratch.mask[k]):
+                detection = out[i]
+                center_x = int(detection[0] * width)
+                center_y = int(detection[1] * height)
+                w = int(detection[2] * width)
+                h = int(detection[3] * height)
+
+                x = int(center_x - w / 2)
+                y = int(center_y - h / 2)
+
+                boxes.append([x, y, w, h])
+                confidences.append(float(scratch.confidences[k][i]))
+                class_ids.append(scratch.class_ids[k][i])
+
+        return boxes, confidences, class_ids
+
+    def suppress(self, boxes, confidences, confidence_threshold):
+        return cv2.dnn.NMSBoxes(boxes, confidences, confidence_threshold, 0.4)
+
+    def annotate(self, img, boxes, confidences, class_ids, indexes, confidence_threshold):
+        for i in indexes:
+            if confidences[i] > confidence_threshold:
+                (x, y) = (boxes[i][0], boxes[i][1])
+                (w, h) = (boxes[i][2], boxes[i][3])
+                color = color_of(self.classes[class_ids[i]])  # fixed palette, see render.py
+                cv2.rectangle(img, (x, y), (x + w, y + h), color, 2)
+                text = "{}: {:.4f}".format(self.classes[class_ids[i]], confidences[i])
+                cv2.putText(img, text, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        return img
+
+    def encode(self, img):
+        # Encode the image to return
+        _, img_encoded = cv2.imencode(".jpg", img)
+        return base64.b64encode(img_encoded).decode("utf-8")
+
+    def label(self, boxes, confidences, class_ids, indexes, confidence_threshold):
+        detected_objects = []
+        for i in indexes:
+            label = str(self.classes[class_ids[i]])
+            confidence = confidences[i]
+            if confidence > confidence_threshold:
+                detected_objects.append({"label": label, "accuracy": confidence, "box": [int(v) for v in boxes[i]]})
+        return detected_objects
+
+    def detect_frame(self, img, confidence_threshold=0.5):
+        """
+        Runs an already decoded BGR image, e.g. a video frame (see tracking.py).
+        """
+        height, width, _ = img.shape
+        blob = self.preprocess_into(img) if self.reuse_buffers else self.preprocess(img)
+        return self.detect_preprocessed(blob, width, height, confidence_threshold)
+
+    def detect_preprocessed(self, blob, width, height, confidence_threshold=0.5):
+        """
+        Runs a blob that was preprocessed ahead of time, e.g. a slice `cache.blob(i)` of a dataset cache (see dataset_cache.py).
+        A contiguous float32 slice of the memmap is passed to the net as is, without a copy.
+        """
+        start_time = time.time()
+        outs = self.forward_into(blob) if self.reuse_buffers else self.forward(blob)
+        end_time = time.time()
+        inference_time = end_time - start_time
+
+        boxes, confidences, class_ids = (self.parse_outputs_into if self.reuse_buffers else self.parse_outputs)(outs, width, height, confidence_threshold)
+        indexes = self.suppress(boxes, confidences, confidence_threshold)
+        return self.label(boxes, confidences, class_ids, indexes, confidence_threshold), inference_time
+
+    def detect_objects(self, image_data, confidence_threshold=0.5, return_image=False, trace=None):
+        """
+        `trace` (see tracing.py) records the stages as spans
+        """
+        with span(trace, "decode"):
+            img = self.decode(image_data)
+            height, width, _ = img.shape
+
+        with span(trace, "preprocess"):
+            blob = self.preprocess_into(img) if self.reuse_buffers else self.preprocess(img)
+
+        with span(trace, "forward"):
+            start_time = time.time()
+            outs = self.forward_into(blob) if self.reuse_buffers else self.forward(blob)
+            end_time = time.time()
+            inference_time = end_time - start_time
+
+        with span(trace, "postprocess"):
+            boxes, confidences, class_ids = (self.parse_outputs_into if self.reuse_buffers else self.parse_outputs)(outs, width, height, confidence_threshold)
+            indexes = self.suppress(boxes, confidences, confidence_threshold)
+            detected_objects = self.label(boxes, confidences, class_ids, indexes, confidence_threshold)
+
+        img_base64 = None
+        if return_image:
+            with span(trace, "annotate"):
+                self.annotate(img, boxes, confidences, class_ids, indexes, confidence_threshold)
+                img_base64 = self.encode(img)
+
+        return detected_objects, inference_time, img_base64
@@ -0,0 +1,197 @@
+"""
+Annotated images, rendered on demand instead of with every detection.
+
+The servers keep the source bytes and the detected objects of every request under a render id and return only the id.
+`/api/render/<id>` draws the boxes when someone actually looks at the picture, with `format` (jpeg, png, webp),
+`quality` (1-100, jpeg and webp) and `width` (the image is scaled down before drawing, so the lines stay crisp).
+
+Both caches are least recently used and bounded by bytes: the sources (`max_source_bytes`) and the rendered outputs
+(`max_rendered_bytes`, keyed by id and options). An evicted source can't be rendered anymore (404).
+With `directory` the sources are files that every process can read, for servers with several worker processes.
+Each process still only evicts the files it wrote, so the budget is per process.
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# fixed BGR colors, 20 hues evenly spaced. a label always gets the same one
+PALETTE = [tuple(int(v) for v in cv2.cvtColor(np.uint8([[[hue, 220, 255]]]), cv2.COLOR_HSV2BGR)[0, 0]) for hue in range(0, 180, 9)]
+FORMATS = {"jpeg": (".jpg", "image/jpeg"), "png": (".png", "image/png"), "webp": (".webp", "image/webp")}
+RENDER_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class RenderNotFound(Exception):
+    pass
+
+
+def color_of(label: str) -> tuple:
+    return PALETTE[zlib.crc32(label.encode()) % len(PALETTE)]
+
+
+def draw(img, objects: list, scale: float = 1.0):
+    """
+    draws `{"label", "accuracy", "box"}` objects onto `img`, boxes are multiplied by `scale`
+    """
+    for obj in objects:
+        x, y, w, h = (int(round(v * scale)) for v in obj["box"])
+        color = color_of(obj["label"])
+        cv2.rectangle(img, (x, y), (x + w, y + h), color, 2)
+        cv2.putText(img, "{}: {:.4f}".format(obj["label"], obj["accuracy"]), (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    return img
+
+
+class LRU:
+    """
+    least recently used entries beyond `max_bytes` are dropped, `on_evict(key, value)` is called for each of them
+    """
+
+    def __init__(self, max_bytes: int, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.evictions = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, value, size: int) -> None:
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            evicted_key, (evicted, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+
+class RenderCache:
+    def __init__(self, max_source_bytes: int = 256 * 1024**2, max_rendered_bytes: int = 64 * 1024**2, directory: str = None):
+        self.directory = Path(directory) if directory else None
+        self.lock = threading.Lock()
+        self.sources = LRU(max_source_bytes, self.__delete_files if self.directory else None)
+        self.rendered = LRU(max_rendered_bytes)
+        self.stats = {"renders": 0, "hits": 0, "misses": 0}
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __files(self, render_id: str) -> tuple:
+        return self.directory / f"{render_id}.src", self.directory / f"{render_id}.json"
+
+    def __delete_files(self, render_id: str, _) -> None:
+        for path in self.__files(render_id):
+            path.unlink(missing_ok=True)
+
+    def put(self, image_data: bytes, objects: list) -> str:
+        render_id = uuid.uuid4().hex
+        if self.directory:
+            # the objects are written last and renamed into place, a render never sees a half written source
+            source_path, objects_path = self.__files(render_id)
+            source_path.write_bytes(image_data)
+            tmp_path = objects_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(objects))
+            os.replace(tmp_path, objects_path)
+            value = None
+        else:
+            value = (image_data, objects)
+        with self.lock:
+            self.sources.put(render_id, value, len(image_data))
+        return render_id
+
+    def source(self, render_id: str) -> tuple:
+        if not RENDER_ID.match(render_id):
+            raise RenderNotFound(f"invalid render id {render_id}")
+        with self.lock:
+            value = self.sources.get(render_id)
+        if value is not None:
+            return value
+        if self.directory:
+            source_path, objects_path = self.__files(render_id)
+            try:
+                objects = json.loads(objects_path.read_text())
+                return source_path.read_bytes(), objects
+            except FileNotFoundError:
+                pass
+        raise RenderNotFound(f"unknown or evicted render id {render_id}")
+
+    @staticmethod
+    def options(fmt: str = "jpeg", quality=None, width=None) -> tuple:
+        """
+        validated `(format, quality, width)`, raises ValueError
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format {fmt}, expected one of {', '.join(FORMATS)}")
+        quality = int(quality) if quality not in (None, "") else 90
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+        width = int(width) if width not in (None, "") else None
+        if width is not None and not 16 <= width <= 8192:
+            raise ValueError("width must be between 16 and 8192")
+        return fmt, quality, width
+
+    def render(self, render_id: str, fmt: str = "jpeg", quality=None, width=None) -> tuple:
+        """
+        returns `(encoded image, content type)`
+        """
+        fmt, quality, width = self.options(fmt, quality, width)
+        key = (render_id, fmt, quality if fmt != "png" else None, width)
+        with self.lock:
+            cached = self.rendered.get(key)
+            self.stats["hits" if cached is not None else "misses"] += 1
+        if cached is not None:
+            return cached, FORMATS[fmt][1]
+
+        image_data, objects = self.source(render_id)
+        img = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        scale = 1.0
+        if width is not None and width < img.shape[1]:
+            scale = width / img.shape[1]
+            img = cv2.resize(img, (width, max(1, int(round(img.shape[0] * scale)))), interpolation=cv2.INTER_AREA)
+        draw(img, objects, scale)
+
+        params = {"jpeg": [cv2.IMWRITE_JPEG_QUALITY, quality], "webp": [cv2.IMWRITE_WEBP_QUALITY, quality], "png": []}[fmt]
+        ok, encoded = cv2.imencode(FORMATS[fmt][0], img, params)
+        if not ok:
+            raise ValueError(f"could not encode {fmt}")
+        encoded = encoded.tobytes()
+        with self.lock:
+            self.rendered.put(key, encoded, len(encoded))
+            self.stats["renders"] += 1
+        return encoded, FORMATS[fmt][1]
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "sources": len(self.sources.entries),
+                "source_mb": self.sources.size / 1024**2,
+                "source_evictions": self.sources.evictions,
+                "rendered": len(self.rendered.entries),
+                "rendered_mb": self.rendered.size / 1024**2,
+                "rendered_evictions": self.rendered.evictions,
+                **self.stats,
+            }
+
+    def close(self) -> None:
+        """
+        deletes the source files this process wrote
+        """
+        if self.directory:
+            with self.lock:
+                for render_id in list(self.sources.entries):
+                    self.__delete_files(render_id, None)
+                self.sources.entries.clear()
@@ -0,0 +1,194 @@
+"""
+Embedded store for detection results.
+
+Results are appended from the request path into a queue and written by a background thread in batched transactions,
+so a request never waits for a commit. SQLite runs in WAL mode, so queries don't block the writer and vice versa.
+
+Indexes:
+    detections(label, result_id, confidence)  "all images with a person above 0.8", paginated by result id
+    detections(confidence)                    confidence-only filters
+    results(ingested_at)                      time range filters, resolved to an id range
+
+`ingested_at` is the commit time of the batch, so it grows with the id.
+
+A failing commit (e.g. `database is locked`, a full disk) is retried with backoff, after `max_attempts` the batch is
+dropped. When the writer falls `max_pending` results behind, new results are dropped instead of blocking the request.
+Both are counted in `stats`.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from colorama import Fore, Style
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    image_id TEXT NOT NULL,
+    ingested_at REAL NOT NULL,
+    inference_time REAL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_detections_label ON detections(label, result_id, confidence);
+CREATE INDEX IF NOT EXISTS idx_detections_confidence ON detections(confidence);
+CREATE INDEX IF NOT EXISTS idx_detections_result ON detections(result_id);
+CREATE INDEX IF NOT EXISTS idx_results_ingested_at ON results(ingested_at);
+"""
+
+MAX_PAGE_SIZE = 10_000  # results per `query` page
+
+
+class ResultStore:
+    def __init__(self, path: str, batch_size: int = 512, batch_interval: float = 0.05, max_pending: int = 100_000, max_attempts: int = 8):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_attempts = max_attempts
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.stats = {"committed": 0, "dropped": 0, "failed_commits": 0, "failed_batches": 0}
+
+        with closing(self.connect()) as conn:
+            conn.executescript(SCHEMA)
+
+        self.writer = threading.Thread(target=self.__write_batches, name="result-store-writer", daemon=True)
+        self.writer.start()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints, a crash may only lose the last batches
+        return conn
+
+    def append(self, image_id: str, objects: list, inference_time: float = None, block: bool = False) -> bool:
+        """
+        returns False if the result was dropped because the writer is `max_pending` behind, `block` waits instead (bulk loads)
+        """
+        try:
+            self.pending.put((image_id, inference_time, [(obj["label"], obj["accuracy"]) for obj in objects]), block=block)
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+
+    def flush(self) -> None:
+        """
+        blocks until everything appended so far is committed
+        """
+        self.pending.join()
+
+    def __write_batches(self) -> None:
+        conn = self.connect()
+        conn.isolation_level = None  # transactions are managed explicitly
+        conn.execute("PRAGMA wal_autocheckpoint=10000")  # checkpoint (and fsync) every ~40MB of WAL instead of every 4MB
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            # the only writer thread must never die, a failing batch is retried and eventually dropped
+            for attempt in range(self.max_attempts):
+                try:
+                    self.__commit(conn, batch)
+                    self.stats["committed"] += len(batch)
+                    break
+                except Exception as e:
+                    self.stats["failed_commits"] += 1
+                    if conn.in_transaction:
+                        try:
+                            conn.execute("ROLLBACK")
+                        except sqlite3.Error:
+                            pass
+                    delay = min(0.1 * 2**attempt, 10.0)
+                    print(f"{Fore.RED}[result store] commit of {len(batch)} results failed ({e}), attempt {attempt + 1}/{self.max_attempts}{Style.RESET_ALL}", flush=True)
+                    if attempt + 1 < self.max_attempts:
+                        time.sleep(delay)
+            else:
+                self.stats["failed_batches"] += 1
+                self.stats["dropped"] += len(batch)
+            for _ in batch:
+                self.pending.task_done()
+
+    def __commit(self, conn: sqlite3.Connection, batch: list) -> None:
+        # ids and the ingest time are assigned under the write lock (other server workers may share the file), so
+        # ingested_at never decreases with the id and time filters become id ranges
+        conn.execute("BEGIN IMMEDIATE")
+        last_id, last_ingested_at = conn.execute("SELECT id, ingested_at FROM results ORDER BY id DESC LIMIT 1").fetchone() or (0, 0.0)
+        ingested_at = max(time.time(), last_ingested_at)
+        conn.executemany("INSERT INTO results (id, image_id, ingested_at, inference_time) VALUES (?, ?, ?, ?)", [(last_id + 1 + i, image_id, ingested_at, inference_time) for i, (image_id, inference_time, _) in enumerate(batch)])
+        conn.executemany("INSERT INTO detections (result_id, label, confidence) VALUES (?, ?, ?)", [(last_id + 1 + i, label, confidence) for i, (_, _, detections) in enumerate(batch) for label, confidence in detections])
+        conn.execute("COMMIT")
+
+    def id_range(self, conn: sqlite3.Connection, since: float = None, until: float = None) -> tuple:
+        """
+        returns the ids `[first, end)` ingested in `[since, until)`, an index lookup each
+        """
+        first_id_from = lambda t: conn.execute("SELECT id FROM results WHERE ingested_at >= ? ORDER BY ingested_at, id LIMIT 1", (t,)).fetchone()
+        first, end = 0, None
+        if since is not None:
+            row = first_id_from(since)
+            first = row[0] if row else None
+        if until is not None:
+            row = first_id_from(until)
+            end = row[0] if row else None
+        return first, end
+
+    def query(self, label: str = None, min_confidence: float = None, since: float = None, until: float = None, cursor: int = 0, limit: int = 100) -> tuple:
+        """
+        returns one page of results with at least one matching detection, ordered by id, and the cursor of the next page (None on the last page)
+        """
+        assert 1 <= limit <= MAX_PAGE_SIZE, f"limit must be between 1 and {MAX_PAGE_SIZE}"
+        with closing(self.connect()) as conn:
+            first, end = self.id_range(conn, since, until)
+            if first is None:
+                return [], None
+            column = "id" if label is None and min_confidence is None else "d.result_id"
+            conditions, params = [f"{column} > ?"], [max(cursor, first - 1)]
+            if end is not None:
+                conditions.append(f"{column} < ?")
+                params.append(end)
+
+            if label is None and min_confidence is None:
+                # no detection filter, images without detections match too
+                rows = conn.execute(f"SELECT id FROM results WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?", params + [limit]).fetchall()
+            else:
+                if label is not None:
+                    conditions.append("d.label = ?")
+                    params.append(label)
+                if min_confidence is not None:
+                    conditions.append("d.confidence >= ?")
+                    params.append(min_confidence)
+                rows = conn.execute(f"SELECT DISTINCT d.result_id FROM detections d WHERE {' AND '.join(conditions)} ORDER BY d.result_id LIMIT ?", params + [limit]).fetchall()
+            result_ids = [row[0] for row in rows]
+            if not result_ids:
+                return [], None
+
+            placeholders = ",".join("?" * len(result_ids))
+            results = {
+                row[0]: {"id": row[0], "image_id": row[1], "ingested_at": row[2], "inference_time": row[3], "objects": []}
+                for row in conn.execute(f"SELECT id, image_id, ingested_at, inference_time FROM results WHERE id IN ({placeholders})", result_ids)
+            }
+            for result_id, detection_label, confidence in conn.execute(f"SELECT result_id, label, confidence FROM detections WHERE result_id IN ({placeholders})", result_ids):
+                results[result_id]["objects"].append({"label": detection_label, "accuracy": confidence})
+
+        next_cursor = result_ids[-1] if len(result_ids) == limit else None
+        return [results[result_id] for result_id in result_ids], next_cursor
+
+    def stream(self, page_size: int = 1000, **filters):
+        """
+        yields every matching result, page by page, so arbitrarily large answers never have to be held in memory
+        """
+        cursor = 0
+        while cursor is not None:
+            page, cursor = self.query(cursor=cursor, limit=page_size, **filters)
+            yield from page
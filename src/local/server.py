@@ -1,160 +1,177 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 import base64
-import cv2
-import numpy as np
+import json
+import os
 import time
-import psutil
-import GPUtil
 from pathlib import Path
-import requests
 import pdb
 
+from admission import AdmissionController, Rejected
+from model_registry import ModelNotFound, ModelRegistry
+from render import RenderCache, RenderNotFound
+from result_store import MAX_PAGE_SIZE, ResultStore
+from tuning import apply_threads, load_config
+from system_info import get_system_info
+from tracing import HEADER, Trace
+
 app = Flask(__name__)
 
+# thread count, detector instances and cpu pinning as tuned by src/bench/tune.py, defaults without a config file
+config = load_config()
+apply_threads(config)
+
+# models are loaded on first use, `MODEL_ROOT` holds `<name>/<version>/` folders, see model_registry.py
+registry = ModelRegistry(os.environ.get("MODEL_ROOT"), int(float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 1024)) * 1024**2), config["instances"])
+registry.activate(*registry.resolve())  # fail at startup, not on the first request, if the default model is missing
+
+# the nets aren't thread-safe, so flask's request threads hand their work to the detection threads through a bounded queue
+admission = AdmissionController([registry] * config["instances"], max_queue_depth=int(os.environ.get("DETECTION_QUEUE_DEPTH", 32)), affinity=config["affinity"])
+
+# optional: keep every result in an embedded store, e.g. `RESULT_STORE_PATH=./results.sqlite`
+store = ResultStore(os.environ["RESULT_STORE_PATH"]) if os.environ.get("RESULT_STORE_PATH") else None
+
+# annotated images are drawn on request from the cached source bytes, see render.py
+renders = RenderCache(int(float(os.environ.get("RENDER_CACHE_MB", 256)) * 1024**2), int(float(os.environ.get("RENDER_OUTPUT_CACHE_MB", 64)) * 1024**2))
 
-class ObjectDetection:
-    def __init__(self):
-        self.MODEL_CONFIG = Path.cwd() / "yolo_tiny_configs" / "yolov3-tiny.cfg"
-        self.MODEL_WEIGHTS = Path.cwd() / "yolo_tiny_configs" / "yolov3-tiny.weights"
-        self.COCO_NAMES = Path.cwd() / "yolo_tiny_configs" / "coco.names"
-
-        self.net = cv2.dnn.readNet(str(self.MODEL_WEIGHTS), str(self.MODEL_CONFIG))
-
-        # Check if CUDA is available and set the preferable backend and target
-        # Note: could not get the openCV running on CUDA
-        if cv2.cuda.getCudaEnabledDeviceCount() > 0:
-            print("CUDA is available. Using GPU.")
-            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        else:
-            print("CUDA is not available. Using CPU.")
-            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_DEFAULT)
-            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
-
-        with open(self.COCO_NAMES, "r") as f:
-            self.classes = [line.strip() for line in f.readlines()]
-
-        self.output_layers = self.net.getUnconnectedOutLayersNames()
-
-    def detect_objects(self, image_data, confidence_threshold=0.5, return_image=False):
-        # Convert to a numpy array and decode to an image
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        height, width, _ = img.shape
-
-        # Prepare the image for YOLO
-        blob = cv2.dnn.blobFromImage(img, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-
-        # Run the YOLO network
-        self.net.setInput(blob)
-        start_time = time.time()
-        outs = self.net.forward(self.output_layers)
-        end_time = time.time()
-        inference_time = end_time - start_time
-
-        class_ids = []
-        confidences = []
-        boxes = []
-
-        # Extract the bounding boxes, confidences, and class IDs
-        for out in outs:
-            for detection in out:
-                scores = detection[5:]
-                class_id = np.argmax(scores)
-                confidence = scores[class_id]
-
-                # filter out low confidence detections
-                if confidence > confidence_threshold:
-                    center_x = int(detection[0] * width)
-                    center_y = int(detection[1] * height)
-                    w = int(detection[2] * width)
-                    h = int(detection[3] * height)
-
-                    x = int(center_x - w / 2)
-                    y = int(center_y - h / 2)
-
-                    boxes.append([x, y, w, h])
-                    confidences.append(float(confidence))
-                    class_ids.append(class_id)
-
-        indexes = cv2.dnn.NMSBoxes(boxes, confidences, confidence_threshold, 0.4)
-
-        detected_objects = []
-        if len(indexes) > 0:
-            COLORS = np.random.randint(0, 255, size=(len(self.classes), 3))
-            for i in indexes:
-                label = str(self.classes[class_ids[i]])
-                confidence = confidences[i]
-                if confidence > confidence_threshold:
-                    detected_objects.append({"label": label, "accuracy": confidence})
-
-                    if return_image:
-                        (x, y) = (boxes[i][0], boxes[i][1])
-                        (w, h) = (boxes[i][2], boxes[i][3])
-                        color = COLORS[class_ids[i]].tolist()
-                        cv2.rectangle(img, (x, y), (x + w, y + h), color, 2)
-                        text = "{}: {:.4f}".format(label, confidence)
-                        cv2.putText(img, text, (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-        # Encode the image to return
-        img_base64 = None
-        if return_image:
-            _, img_encoded = cv2.imencode(".jpg", img)
-            img_base64 = base64.b64encode(img_encoded).decode("utf-8")
-
-        return detected_objects, inference_time, img_base64
-
-
-detector = ObjectDetection()
+
+def detect(img_data: bytes, confidence_threshold: float, priority: str = "interactive", deadline: float = None, model: str = None, trace: Trace = None) -> dict:
+    """
+    runs a detection through the admission queue, keeps the source for `/api/render/<id>` and returns the response body
+    """
+    run = lambda detector: detector.detect_objects(img_data, confidence_threshold, trace=trace)
+    submitted = time.time()
+    future = admission.submit(lambda registry: registry.run(model, run), priority, deadline)
+    ((detected_objects, inference_time, _), model_version), timings = future.result()
+    if trace is not None:
+        trace.add("queue", submitted, timings["queue_time"])
+    render_id = renders.put(img_data, detected_objects)
+    return {
+        "model": model_version,
+        "objects": detected_objects,
+        "inference_time": inference_time,
+        "queue_time": timings["queue_time"],
+        "service_time": timings["service_time"],
+        "render_id": render_id,
+        "render_url": f"/api/render/{render_id}",
+    }
 
 
 @app.route("/api/object_detection", methods=["POST"])
 def object_detection():
+    """
+    Optional: `X-Priority` header or `priority` field (`interactive` (default) or `bulk`) and `X-Deadline-Ms` header
+    or `deadline_ms` field with the time budget of the request in milliseconds.
+    `X-Model` header or `model` field (`name` or `name:version`) to choose a model from the registry.
+    `X-Trace-Id` header or `trace_id` field to correlate the returned spans with the client's (see tracing.py).
+
+    The response doesn't contain the annotated image, `render_url` draws it on request (see `/api/render/<id>`).
+    """
     try:
-        data = request.get_json()
-        img_id = data["id"]
-        img_data = base64.b64decode(data["image_data"])
-        confidence_threshold = data.get("confidence", 0.5)
-        return_image = data.get("return_image", False)
-        detected_objects, inference_time, img_base64 = detector.detect_objects(img_data, confidence_threshold, return_image)
-        if return_image:
-            return jsonify({"id": img_id, "objects": detected_objects, "inference_time": inference_time, "image": img_base64})
-        else:
-            return jsonify({"id": img_id, "objects": detected_objects, "inference_time": inference_time})
+        trace = Trace(request.headers.get(HEADER))
+        try:
+            with trace.span("parse_request"):
+                data = request.get_json(silent=True)
+                if not isinstance(data, dict):
+                    raise ValueError("the body must be a JSON object")
+                img_id = data["id"]
+                img_data = base64.b64decode(data["image_data"])
+                confidence_threshold = float(data.get("confidence", 0.5))
+                if not 0 <= confidence_threshold <= 1:
+                    raise ValueError(f"confidence must be between 0 and 1, got {data['confidence']}")
+        except (KeyError, TypeError, ValueError) as e:  # base64 errors are ValueErrors
+            return jsonify({"error": f"invalid request: {f'missing field {e}' if isinstance(e, KeyError) else e}"}), 400
+        trace.trace_id = request.headers.get(HEADER) or data.get("trace_id") or trace.trace_id
+        priority = request.headers.get("X-Priority", data.get("priority", "interactive"))
+        deadline = AdmissionController.deadline_from(request.headers.get("X-Deadline-Ms", data.get("deadline_ms")))
+        model = request.headers.get("X-Model", data.get("model"))
+
+        response = {"id": img_id, **detect(img_data, confidence_threshold, priority, deadline, model, trace)}
+        if store is not None:
+            with trace.span("store"):
+                store.append(img_id, response["objects"], response["inference_time"])
+        response["trace"] = trace.as_dict()
+        return jsonify(response), 200, {HEADER: trace.trace_id}
+    except Rejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers()
+    except ModelNotFound as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": "An error occurred during object detection", "details": str(e)}), 500
 
 
-@app.route("/api/system_info", methods=["GET"])
-def system_info():
-    cpu_info = {
-        "physical_cores": psutil.cpu_count(logical=False),
-        "total_cores": psutil.cpu_count(logical=True),
-        "max_frequency": psutil.cpu_freq().max,
-        "min_frequency": psutil.cpu_freq().min,
-        "current_frequency": psutil.cpu_freq().current,
-        "cpu_usage": psutil.cpu_percent(interval=1),
-    }
+@app.route("/api/models", methods=["GET"])
+def models():
+    # loaded and evicted models with their load times, latencies and memory, and the versions on disk
+    return jsonify(registry.report())
 
-    gpus = GPUtil.getGPUs()
-    gpu_info = []
-    for gpu in gpus:
-        gpu_info.append(
-            {
-                "id": gpu.id,
-                "name": gpu.name,
-                "load": gpu.load,
-                "memory_free": gpu.memoryFree,
-                "memory_used": gpu.memoryUsed,
-                "memory_total": gpu.memoryTotal,
-                "temperature": gpu.temperature,
-                "driver_version": gpu.driver,
-            }
-        )
 
-    net_info = {k: v._asdict() for k, v in psutil.net_if_stats().items()}
+@app.route("/api/models/activate", methods=["POST"])
+def activate_model():
+    """
+    Hot-swaps the version served for a model name, e.g. `{"model": "yolov3-tiny", "version": "2"}`.
+    Without a version the newest one in `MODEL_ROOT` is activated.
+    """
+    data = request.get_json()
+    try:
+        return jsonify({"active": registry.activate(data["model"], data.get("version"))})
+    except ModelNotFound as e:
+        return jsonify({"error": str(e)}), 404
 
-    return jsonify({"cpu_info": cpu_info, "gpu_info": gpu_info, "net_info": net_info})
+
+@app.route("/api/results", methods=["GET"])
+def results():
+    """
+    Query stored results, e.g. `/api/results?label=person&min_confidence=0.8&limit=100`.
+
+    Optional: `since` and `until` (unix timestamps of ingestion), `cursor` (the `next_cursor` of the previous page)
+    and `stream=true` to get all matches as newline delimited JSON instead of a single page.
+    """
+    if store is None:
+        return jsonify({"error": "result store disabled, start the server with RESULT_STORE_PATH set"}), 404
+    try:
+        filters = {
+            "label": request.args.get("label"),
+            "min_confidence": request.args.get("min_confidence", type=float),
+            "since": request.args.get("since", type=float),
+            "until": request.args.get("until", type=float),
+        }
+        if request.args.get("stream", "false").lower() == "true":
+            lines = (json.dumps(result) + "\n" for result in store.stream(**filters))
+            return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+        limit = request.args.get("limit", default=100, type=int)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+        page, next_cursor = store.query(cursor=request.args.get("cursor", default=0, type=int), limit=limit, **filters)
+        return jsonify({"results": page, "next_cursor": next_cursor, "store": store.stats})
+    except Exception as e:
+        return jsonify({"error": "An error occurred while querying results", "details": str(e)}), 500
+
+
+@app.route("/api/render/<render_id>", methods=["GET"])
+def render(render_id):
+    """
+    The image of a detection with its boxes, e.g. `/api/render/<render_id>?format=webp&quality=80&width=640`.
+    `format` is jpeg (default), png or webp, `quality` 1-100 (default 90), `width` scales the image down.
+    """
+    try:
+        image, content_type = renders.render(render_id, request.args.get("format", "jpeg"), request.args.get("quality"), request.args.get("width"))
+        return Response(image, mimetype=content_type, headers={"Cache-Control": "private, max-age=3600"})
+    except RenderNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/render", methods=["GET"])
+def render_stats():
+    # sizes, evictions and hit rates of the render caches
+    return jsonify(renders.report())
+
+
+@app.route("/api/system_info", methods=["GET"])
+def system_info():
+    return jsonify(get_system_info())
 
 
 @app.route("/api/debug", methods=["GET"])
@@ -174,34 +191,25 @@ def debug():
 
     try:
         with open(image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
-
-        payload = {"id": "unique_image_id", "image_data": encoded_image, "confidence": confidence_param, "return_image": True}
-
-        url = "http://127.0.0.1:5000/api/object_detection"
-        response = requests.post(url, json=payload)
-
-        if response.status_code != 200:
-            return jsonify({"error": f"Request failed with status code {response.status_code}"}), response.status_code
-
-        print("Response Text:", response.text)
+            image_data = image_file.read()
 
-        response_data = response.json()
-        img_base64 = response_data.get("image")
+        # runs the detection directly, the image is rendered by the browser's request for `render_url`
+        response_data = detect(image_data, confidence_param)
+        print("Response:", json.dumps(response_data))
 
         html_content = f"""
         <html>
         <body>
             <h1>Object Detection Result</h1>
-            <img src="data:image/jpeg;base64,{img_base64}" alt="Detected Objects">
+            <img src="{response_data["render_url"]}" alt="Detected Objects">
         </body>
         </html>
         """
         return render_template_string(html_content)
     except FileNotFoundError:
         return jsonify({"error": "File not found"}), 404
-    except requests.exceptions.JSONDecodeError as e:
-        return jsonify({"error": "Failed to decode JSON response", "details": str(e)}), 500
+    except Rejected as e:
+        return jsonify({"error": str(e)}), e.status, e.headers()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+"""
+Frame streaming over one WebSocket connection (`/api/stream` of the ASGI server, `client.py --stream`).
+
+- frames: binary messages, an 8 byte big-endian sequence number followed by the encoded image
+- replies: JSON text messages, `{"type": "result", "seq", "objects", ...}` as soon as a frame is done (not in order),
+  or `{"type": "dropped", "seq", "reason"}`. the first message of the server is `{"type": "hello", "window": n}`
+- credits: a client may have at most `window` frames without a reply. every reply returns a credit, frames beyond the
+  window are dropped right away (`"window"`)
+- dropping: at most `in_flight` frames of a connection are in the detection queue. newer frames wait in a buffer of
+  `buffer` frames, when it's full the oldest waiting frame is dropped (`"superseded"`), a live feed only needs the
+  latest one. frames the admission queue rejects are dropped as well (`"overloaded"`)
+"""
+
+import asyncio
+import json
+import statistics
+import struct
+import time
+from collections import deque
+
+import numpy as np
+from colorama import Fore, Style
+
+FRAME_HEADER = struct.Struct(">Q")  # sequence number
+
+
+class FrameStream:
+    """
+    server side of one connection. `submit(image_data)` starts the detection of a frame and returns an awaitable of
+    the result message (a dict), or raises one of `reject_errors` if the frame can't be admitted
+    """
+
+    def __init__(self, send_text, submit, window: int, in_flight: int, buffer: int = 1, reject_errors: tuple = ()):
+        self.send_text = send_text
+        self.submit = submit
+        self.window = window
+        self.in_flight = in_flight
+        self.buffer = buffer
+        self.reject_errors = reject_errors
+        self.waiting = deque()  # (seq, image_data, received_at)
+        self.running = 0
+        self.unanswered = 0
+        self.tasks = set()  # keeps the finish tasks referenced
+        self.send_lock = asyncio.Lock()
+        self.stats = {"frames": 0, "results": 0, "dropped": 0}
+
+    async def reply(self, message: dict) -> None:
+        self.unanswered -= 1
+        self.stats["results" if message["type"] == "result" else "dropped"] += 1
+        async with self.send_lock:
+            await self.send_text(json.dumps(message))
+
+    async def drop(self, seq: int, reason: str) -> None:
+        await self.reply({"type": "dropped", "seq": seq, "reason": reason})
+
+    async def on_frame(self, message: bytes) -> None:
+        if len(message) <= FRAME_HEADER.size:
+            async with self.send_lock:
+                await self.send_text(json.dumps({"type": "error", "error": "frames are an 8 byte sequence number followed by the image"}))
+            return
+        (seq,) = FRAME_HEADER.unpack_from(message)
+        self.stats["frames"] += 1
+        self.unanswered += 1
+        if self.unanswered > self.window:
+            await self.drop(seq, "window")
+            return
+
+        self.waiting.append((seq, message[FRAME_HEADER.size :], time.perf_counter()))
+        while len(self.waiting) > self.buffer:
+            await self.drop(self.waiting.popleft()[0], "superseded")
+        await self.start_waiting()
+
+    async def start_waiting(self) -> None:
+        while self.waiting and self.running < self.in_flight:
+            seq, image_data, received_at = self.waiting.popleft()
+            try:
+                result = self.submit(image_data)
+            except self.reject_errors:
+                await self.drop(seq, "overloaded")
+                continue
+            self.running += 1
+            task = asyncio.ensure_future(self.finish(seq, received_at, result))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def finish(self, seq: int, received_at: float, result) -> None:
+        try:
+            message = {"type": "result", "seq": seq, **await result}
+            message["server_time"] = time.perf_counter() - received_at
+        except self.reject_errors:
+            message = {"type": "dropped", "seq": seq, "reason": "overloaded"}
+        except Exception as e:
+            message = {"type": "dropped", "seq": seq, "reason": "error", "error": str(e)}
+        self.running -= 1
+        try:
+            await self.reply(message)
+            await self.start_waiting()
+        except Exception:
+            pass  # the connection is gone
+
+    async def close(self) -> None:
+        # frames in the detection queue still finish (cancelling would cancel the admission futures), their replies go nowhere
+        self.waiting.clear()
+
+
+async def run_client(url: str, frames: list, duration: float, fps: float, window: int, reply_timeout: float = 30.0) -> dict:
+    """
+    sends `frames` in a loop for `duration` seconds (at most `fps` per second, 0 is as fast as the credits allow)
+    and returns the sent, answered and dropped frames with the latency of every result. frames without a reply
+    `reply_timeout` seconds after the last one was sent are counted as lost
+    """
+    import websockets  # only needed for streaming
+
+    sent, latencies, dropped = {}, [], {}
+    async with websockets.connect(f"{url}?window={window}", max_size=None) as ws:
+        hello = json.loads(await ws.recv())
+        credits = asyncio.Semaphore(hello["window"])
+        done = asyncio.Event()
+
+        async def receive() -> None:
+            async for message in ws:
+                reply = json.loads(message)
+                if reply["type"] == "result":
+                    latencies.append(time.perf_counter() - sent[reply["seq"]])
+                elif reply["type"] == "dropped":
+                    dropped[reply["reason"]] = dropped.get(reply["reason"], 0) + 1
+                else:
+                    print(f"{Fore.RED}{reply}{Style.RESET_ALL}")
+                    continue
+                credits.release()
+                if done.is_set() and len(latencies) + sum(dropped.values()) == len(sent):
+                    return
+
+        receiver = asyncio.ensure_future(receive())
+        start_time = time.perf_counter()
+        seq = 0
+        while time.perf_counter() - start_time < duration:
+            try:
+                # a server that stopped replying never returns the credits
+                await asyncio.wait_for(credits.acquire(), timeout=max(0.0, start_time + duration - time.perf_counter()))
+            except asyncio.TimeoutError:
+                break
+            if fps > 0:
+                await asyncio.sleep(max(0.0, start_time + seq / fps - time.perf_counter()))
+            sent[seq] = time.perf_counter()
+            await ws.send(FRAME_HEADER.pack(seq) + frames[seq % len(frames)])
+            seq += 1
+        done.set()
+        if len(latencies) + sum(dropped.values()) < len(sent):
+            try:
+                await asyncio.wait_for(receiver, timeout=reply_timeout)
+            except asyncio.TimeoutError:
+                pass  # the missing replies are reported as lost
+        elapsed = time.perf_counter() - start_time
+        receiver.cancel()
+
+    lost = len(sent) - len(latencies) - sum(dropped.values())
+    return {"sent": len(sent), "results": len(latencies), "dropped": dropped, "lost": lost, "elapsed": elapsed, "latencies": latencies, "window": hello["window"]}
+
+
+def print_report(report: dict) -> None:
+    latencies = np.array(report["latencies"]) * 1000
+    print(f"\n{Fore.GREEN}**** Streaming Summary ****{Style.RESET_ALL}")
+    print(f"window: {report['window']} frames, {report['elapsed']:.2f}s")
+    print(f"sent: {report['sent']} frames ({report['sent'] / report['elapsed']:.2f} frames/s)")
+    print(f"results: {report['results']} frames ({report['results'] / report['elapsed']:.2f} frames/s sustained)")
+    if report["dropped"]:
+        print(f"{Fore.YELLOW}dropped: {sum(report['dropped'].values())} ({', '.join(f'{reason}: {count}' for reason, count in sorted(report['dropped'].items()))}){Style.RESET_ALL}")
+    if report["lost"]:
+        print(f"{Fore.RED}lost: {report['lost']} frames without a reply{Style.RESET_ALL}")
+    if len(latencies):
+        print(f"latency ms: mean {statistics.mean(latencies):.2f}  p50 {np.percentile(latencies, 50):.2f}  p90 {np.percentile(latencies, 90):.2f}  p99 {np.percentile(latencies, 99):.2f}  max {latencies.max():.2f}")
@@ -0,0 +1,33 @@
+import psutil
+import GPUtil
+
+
+def get_system_info() -> dict:
+    cpu_info = {
+        "physical_cores": psutil.cpu_count(logical=False),
+        "total_cores": psutil.cpu_count(logical=True),
+        "max_frequency": psutil.cpu_freq().max,
+        "min_frequency": psutil.cpu_freq().min,
+        "current_frequency": psutil.cpu_freq().current,
+        "cpu_usage": psutil.cpu_percent(interval=1),
+    }
+
+    gpus = GPUtil.getGPUs()
+    gpu_info = []
+    for gpu in gpus:
+        gpu_info.append(
+            {
+                "id": gpu.id,
+                "name": gpu.name,
+                "load": gpu.load,
+                "memory_free": gpu.memoryFree,
+                "memory_used": gpu.memoryUsed,
+                "memory_total": gpu.memoryTotal,
+                "temperature": gpu.temperature,
+                "driver_version": gpu.driver,
+            }
+        )
+
+    net_info = {k: v._asdict() for k, v in psutil.net_if_stats().items()}
+
+    return {"cpu_info": cpu_info, "gpu_info": gpu_info, "net_info": net_info}
@@ -0,0 +1,46 @@
+"""
+Per-image traces of the local client -> server path, the lambda has its own copy (see src/aws/lambda_function.py).
+
+The client picks a trace id per image and sends it in the `X-Trace-Id` header, the server records its spans under that
+id and returns them with the response. A span is `{"name", "start", "duration"}`: `start` is wall clock time, so spans
+of different hosts can be put on one timeline (up to clock skew), `duration` is measured with the monotonic clock.
+The client writes one trace per line, `src/bench/trace_report.py` reconstructs the timelines.
+"""
+
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+HEADER = "X-Trace-Id"
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Trace:
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or new_trace_id()
+        self.spans = []
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        self.spans.append({"name": name, "start": start, "duration": duration})
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.time()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start_time)
+
+    def as_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "spans": sorted(self.spans, key=lambda span: span["start"])}
+
+
+def span(trace: Trace, name: str):
+    """
+    `trace.span(name)`, or nothing if the request isn't traced
+    """
+    return trace.span(name) if trace is not None else nullcontext()
@@ -0,0 +1,201 @@
+"""
+Keyframe detection for frame sequences from one camera.
+
+Full inference only runs on keyframes: every `every` frames, or earlier when the frame changed by more than
+`diff_threshold` since the last keyframe (mean absolute difference of downscaled grayscale frames, 0-255).
+In between, the boxes of the last keyframe are carried forward with the velocity of their track. Detections are
+assigned stable track ids by IoU, with a centroid distance fallback for small or fast objects.
+
+    pipeline = KeyframeDetector(ObjectDetection(), every=5, diff_threshold=12)
+    for frame in frames:
+        objects, keyframe = pipeline.process(frame)  # objects carry "track_id" and "box" ([x, y, w, h])
+
+`bulk.py --keyframes N` runs videos and folders of frames through it, `src/bench/keyframes.py` measures the gain.
+"""
+
+import itertools
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+DIFF_SIZE = (64, 64)
+FRAME_SUFFIXES = (".jpg", ".jpeg", ".png")
+
+
+def read_frames(sequence: str):
+    """
+    yields the frames of a video file, or of a folder of images sorted by name
+    """
+    if Path(sequence).is_dir():
+        for path in sorted(p for p in Path(sequence).iterdir() if p.suffix.lower() in FRAME_SUFFIXES):
+            frame = cv2.imread(str(path), cv2.IMREAD_COLOR)
+            if frame is not None:
+                yield frame
+        return
+
+    capture = cv2.VideoCapture(sequence)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def iou(a: list, b: list) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    overlap_w = min(ax + aw, bx + bw) - max(ax, bx)
+    overlap_h = min(ay + ah, by + bh) - max(ay, by)
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+    intersection = overlap_w * overlap_h
+    return intersection / (aw * ah + bw * bh - intersection)
+
+
+def centroid_distance(a: list, b: list) -> float:
+    """
+    distance of the box centers relative to the diagonal of `a`
+    """
+    dx = (a[0] + a[2] / 2) - (b[0] + b[2] / 2)
+    dy = (a[1] + a[3] / 2) - (b[1] + b[3] / 2)
+    return float(np.hypot(dx, dy) / max(1.0, np.hypot(a[2], a[3])))
+
+
+def match(boxes_a: list, labels_a: list, boxes_b: list, labels_b: list, iou_threshold: float, max_distance: float = None) -> list:
+    """
+    greedy one-to-one matching of boxes with the same label, best IoU first, then closest centroids.
+    returns `(index_a, index_b)` pairs
+    """
+    pairs, used_a, used_b = [], set(), set()
+    candidates = sorted(((iou(a, b), i, j) for i, a in enumerate(boxes_a) for j, b in enumerate(boxes_b) if labels_a[i] == labels_b[j]), reverse=True)
+    for score, i, j in candidates:
+        if score < iou_threshold:
+            break
+        if i not in used_a and j not in used_b:
+            pairs.append((i, j))
+            used_a.add(i)
+            used_b.add(j)
+
+    if max_distance is not None:
+        candidates = sorted(
+            (centroid_distance(a, b), i, j) for i, a in enumerate(boxes_a) for j, b in enumerate(boxes_b) if labels_a[i] == labels_b[j] and i not in used_a and j not in used_b
+        )
+        for distance, i, j in candidates:
+            if distance > max_distance:
+                break
+            if i not in used_a and j not in used_b:
+                pairs.append((i, j))
+                used_a.add(i)
+                used_b.add(j)
+    return pairs
+
+
+class Track:
+    def __init__(self, track_id: int, obj: dict, frame: int):
+        self.track_id = track_id
+        self.label = obj["label"]
+        self.accuracy = obj["accuracy"]
+        self.box = [float(v) for v in obj["box"]]
+        self.velocity = [0.0, 0.0]  # pixels per frame of the box origin
+        self.frame = frame  # last keyframe the track was detected on
+        self.missed = 0
+
+    def update(self, obj: dict, frame: int) -> None:
+        frames = max(1, frame - self.frame)
+        self.velocity = [(obj["box"][0] - self.box[0]) / frames, (obj["box"][1] - self.box[1]) / frames]
+        self.box = [float(v) for v in obj["box"]]
+        self.accuracy = obj["accuracy"]
+        self.frame = frame
+        self.missed = 0
+
+    def predict(self, frame: int) -> list:
+        frames = frame - self.frame
+        x, y, w, h = self.box
+        return [int(round(x + self.velocity[0] * frames)), int(round(y + self.velocity[1] * frames)), int(w), int(h)]
+
+    def as_object(self, frame: int) -> dict:
+        return {"label": self.label, "accuracy": self.accuracy, "box": self.predict(frame), "track_id": self.track_id}
+
+
+class Tracker:
+    """
+    `max_missed` is the number of keyframes a track survives without a matching detection
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_distance: float = 0.5, max_missed: int = 1):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.tracks = []
+        self.ids = itertools.count(1)
+
+    def update(self, detected_objects: list, frame: int) -> list:
+        predicted = [track.predict(frame) for track in self.tracks]
+        pairs = match(
+            predicted, [track.label for track in self.tracks], [obj["box"] for obj in detected_objects], [obj["label"] for obj in detected_objects], self.iou_threshold, self.max_distance
+        )
+
+        matched_tracks = {i for i, _ in pairs}
+        matched_objects = {j for _, j in pairs}
+        for i, j in pairs:
+            self.tracks[i].update(detected_objects[j], frame)
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        for j, obj in enumerate(detected_objects):
+            if j not in matched_objects:
+                self.tracks.append(Track(next(self.ids), obj, frame))
+
+        # objects of this frame: the detected ones, with their track ids
+        return [track.as_object(frame) for track in self.tracks if track.frame == frame]
+
+    def carry(self, frame: int) -> list:
+        return [track.as_object(frame) for track in self.tracks if track.missed == 0]
+
+
+class KeyframeDetector:
+    def __init__(self, detector, every: int = 5, diff_threshold: float = None, confidence_threshold: float = 0.5, tracker: Tracker = None):
+        self.detector = detector
+        self.every = every
+        self.diff_threshold = diff_threshold
+        self.confidence_threshold = confidence_threshold
+        self.tracker = tracker or Tracker()
+        self.frame = -1
+        self.last_keyframe = None
+        self.keyframe_thumbnail = None
+        self.stats = {"frames": 0, "keyframes": 0, "forced_by_diff": 0, "inference_time": 0.0}
+
+    @staticmethod
+    def thumbnail(img) -> np.ndarray:
+        return cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), DIFF_SIZE, interpolation=cv2.INTER_AREA)
+
+    def process(self, img) -> tuple:
+        """
+        returns the objects of the frame and whether it was a keyframe
+        """
+        self.frame += 1
+        self.stats["frames"] += 1
+
+        keyframe = self.last_keyframe is None or self.frame - self.last_keyframe >= self.every
+        thumbnail = None
+        if not keyframe and self.diff_threshold is not None:
+            thumbnail = self.thumbnail(img)
+            if float(cv2.absdiff(thumbnail, self.keyframe_thumbnail).mean()) > self.diff_threshold:
+                keyframe = True
+                self.stats["forced_by_diff"] += 1
+
+        if not keyframe:
+            return self.tracker.carry(self.frame), False
+
+        detected_objects, inference_time = self.detector.detect_frame(img, self.confidence_threshold)
+        self.stats["keyframes"] += 1
+        self.stats["inference_time"] += inference_time
+        self.last_keyframe = self.frame
+        if self.diff_threshold is not None:
+            self.keyframe_thumbnail = thumbnail if thumbnail is not None else self.thumbnail(img)
+        return self.tracker.update(detected_objects, self.frame), True
@@ -0,0 +1,82 @@
+"""
+Thread and worker settings found by `src/bench/tune.py` for this machine.
+
+The servers read `detection_config.json` (or `$DETECTION_CONFIG`) at startup:
+
+    threads    cv2.setNumThreads, the size of OpenCV's internal thread pool
+    instances  detector instances, each served by its own admission thread
+    batch      images per forward pass that gave the best throughput, used by batch consumers
+    affinity   logical cpus per instance or null, the admission threads pin themselves to them
+
+Without a config file OpenCV keeps its default and a single instance is used.
+
+Pinning only works with `threads == 1`. OpenCV's pthreads pool is global to the process, it's created by the first
+thread that calls `forward` and its workers inherit that thread's cpus. With more threads the parallel work of every
+instance would run on the first instance's cores, so `load_config` ignores the affinity of such configs.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import cv2
+
+DEFAULT_CONFIG = {"threads": None, "instances": 1, "batch": 1, "affinity": None}
+
+
+def config_path() -> Path:
+    return Path(os.environ.get("DETECTION_CONFIG", Path.cwd() / "detection_config.json"))
+
+
+def load_config() -> dict:
+    path = config_path()
+    if not path.exists():
+        return dict(DEFAULT_CONFIG)
+    with open(path, "r") as f:
+        config = json.load(f)
+    config = {**DEFAULT_CONFIG, **{key: config[key] for key in DEFAULT_CONFIG if key in config}}
+    if not can_pin(config["threads"]):
+        config["affinity"] = None
+    return config
+
+
+def apply_threads(config: dict) -> None:
+    if config["threads"] is not None:
+        cv2.setNumThreads(config["threads"])
+
+
+def core_groups() -> list:
+    """
+    logical cpus grouped by physical core (hyperthreads share a group), limited to the cpus this process may use
+    """
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    groups = {}
+    for cpu in allowed:
+        topology = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology")
+        try:
+            key = ((topology / "physical_package_id").read_text().strip(), (topology / "core_id").read_text().strip())
+        except OSError:
+            key = ("", str(cpu))
+        groups.setdefault(key, []).append(cpu)
+    return list(groups.values())
+
+
+def can_pin(threads: int) -> bool:
+    """
+    only single threaded instances can be pinned, the shared thread pool would otherwise inherit the first pinned thread's cpus
+    """
+    return threads == 1
+
+
+def plan_affinity(instances: int, threads: int) -> list:
+    """
+    gives every instance `threads` physical cores of its own (first hyperthread only), wrapping around if there aren't enough
+    """
+    cores = [group[0] for group in core_groups()]
+    return [sorted({cores[(i * threads + j) % len(cores)] for j in range(threads)}) for i in range(instances)]
+
+
+def pin_current_thread(cpus: list) -> None:
+    # on linux, pid 0 is the calling thread, not the whole process
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)